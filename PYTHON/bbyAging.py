@@ -0,0 +1,267 @@
+"""Event-driven pixel aging for the shared paint canvas.
+
+Instead of walking every pixel on every fade tick, `PixelAger` keeps a heap of
+pixels ordered by the next second at which their alpha can change.  A tick
+only pops the pixels that are due, recomputes their alpha with exactly the same
+curve the old loop used, and reschedules them.
+
+The ager works directly on the server's buffers (`paint_rgba`, `paint_ts`,
+`paint_life`, `paint_alpha0`), so callers must hold `paint_lock` around
+`touch()`, `rebuild()` and `tick()`.  Given the canvas' tile grid (bbyTiles),
+rebuilds walk tile rows and skip the ones with nothing painted, and can be
+limited to the tiles another process wrote to.
+
+Run this file directly for a benchmark against the legacy full-scan loop.
+"""
+import heapq, math
+
+
+def fade_alpha(age, cur_a, alpha0, start_fade, end_fade):
+    """The fade curve, verbatim from the original loop.
+    Returns (new_alpha, expired)."""
+    if age > end_fade:
+        if cur_a > 0:
+            return 0, True
+        return cur_a, False
+    if age > start_fade:
+        frac = (age - start_fade) / (end_fade - start_fade)
+        frac = max(0.0, min(1.0, frac))
+        frac = frac * frac  # ease-out
+        base = alpha0 or cur_a or 255
+        return int(base * (1.0 - frac)), False
+    return cur_a, False
+
+
+def next_change_age(cur_a, alpha0, start_fade, end_fade):
+    """Earliest whole-second age at which `fade_alpha` may differ from `cur_a`,
+    or None if the pixel can never change again.  Errs on the early side:
+    popping a pixel a second too soon only costs a recompute."""
+    if end_fade <= start_fade or cur_a <= 0:
+        return None
+    expire = math.floor(end_fade) + 1
+    base = alpha0 or cur_a or 255
+    if cur_a >= base:
+        # any step into the fade window drops below cur_a
+        first = math.floor(start_fade) + 1
+    else:
+        # int(base * (1 - f^2)) < cur_a  <=>  f > sqrt(1 - cur_a/base)
+        f = math.sqrt(1.0 - cur_a / base)
+        first = math.floor(start_fade + (end_fade - start_fade) * f)
+    return min(first, expire)
+
+
+class PixelAger:
+    def __init__(self, rgba, ts, life, alpha0, width, grid=None):
+        self.rgba = rgba
+        self.ts = ts
+        self.life = life
+        self.alpha0 = alpha0
+        self.width = width
+        self.grid = grid
+        self.count = len(ts)
+        self._ts_bytes = memoryview(ts).cast("B")   # for C-speed "anything painted here?" checks
+        self._ts_size = memoryview(ts).itemsize
+        self._heap = []                 # (due_ts, idx, gen)
+        self._gen = [0] * self.count    # bumps on every touch, stale heap entries are skipped
+        self._queued = bytearray(self.count)
+        self._live = 0
+
+    def __len__(self):
+        return self._live
+
+    def rebuild(self, tiles=None):
+        """Rescan and reschedule every pixel (startup), or only those in
+        `tiles` (tile ids from the grid) after another process wrote there."""
+        if tiles is None:
+            self._heap = []
+            self._queued = bytearray(self.count)
+            self._live = 0
+        for lo, hi in self._runs(tiles):
+            if self._idle(lo, hi):
+                continue
+            for i in range(lo, hi):
+                self._gen[i] += 1
+                if self._queued[i]:
+                    self._queued[i] = 0
+                    self._live -= 1
+                self._schedule(i)
+        heapq.heapify(self._heap)
+
+    def _rescan_all(self):
+        """The pre-tile rebuild, walking every pixel; kept for the benchmark in bbyTiles."""
+        self._heap = []
+        self._queued = bytearray(self.count)
+        self._live = 0
+        for i in range(self.count):
+            self._gen[i] += 1
+            self._schedule(i)
+        heapq.heapify(self._heap)
+
+    def _idle(self, lo, hi):
+        """No painted pixel and nothing queued in [lo, hi): checked in C, no per-pixel work."""
+        z = self._ts_size
+        return not self._ts_bytes[lo*z:hi*z].tobytes().strip(b"\0") and self._queued.find(1, lo, hi) < 0
+
+    def _runs(self, tiles):
+        if tiles is not None:
+            return [r for t in tiles for r in self.grid.runs(t)]
+        # whole canvas: skip empty rows outright, split the rest at tile edges
+        w = self.width
+        step = self.grid.tile if self.grid else w
+        return [(lo + x, lo + min(w, x + step)) for lo in range(0, self.count, w)
+                if not self._idle(lo, lo + w) for x in range(0, w, step)]
+
+    def touch(self, idx):
+        """Call after writing a pixel so its schedule reflects the new state."""
+        self._gen[idx] += 1
+        if self._queued[idx]:
+            self._queued[idx] = 0
+            self._live -= 1
+        if self._schedule(idx):
+            heapq.heappush(self._heap, self._heap.pop())
+        self._maybe_compact()
+
+    def _schedule(self, i):
+        ts = self.ts[i]
+        if ts == 0:
+            return False
+        due = next_change_age(self.rgba[i*4 + 3], self.alpha0[i], self.life[i*2], self.life[i*2+1])
+        if due is None:
+            return False
+        self._heap.append((ts + due, i, self._gen[i]))
+        self._queued[i] = 1
+        self._live += 1
+        return True
+
+    def _maybe_compact(self):
+        # repaints leave stale entries behind; drop them once they dominate
+        if len(self._heap) > 2 * self._live + 1024:
+            self._heap = [e for e in self._heap if e[2] == self._gen[e[1]]]
+            heapq.heapify(self._heap)
+
+    def tick(self, now):
+        """Apply the fade for every pixel due at or before `now`.
+        Returns the list of pixel indices whose alpha changed."""
+        changed = []
+        heap = self._heap
+        rgba, ts, life, alpha0, gen = self.rgba, self.ts, self.life, self.alpha0, self._gen
+        popped = []
+        while heap and heap[0][0] <= now:
+            _, i, g = heapq.heappop(heap)
+            if g != gen[i]:
+                continue
+            self._queued[i] = 0
+            self._live -= 1
+            popped.append(i)
+        for i in popped:
+            t = ts[i]
+            if t == 0:
+                continue
+            a_idx = i*4 + 3
+            cur_a = rgba[a_idx]
+            start_fade = life[i*2]
+            end_fade = life[i*2+1]
+            new_a, expired = fade_alpha(now - t, cur_a, alpha0[i], start_fade, end_fade)
+            if expired:
+                ts[i] = 0
+                life[i*2] = 0.0
+                life[i*2+1] = 0.0
+                alpha0[i] = 0
+            if new_a != cur_a:
+                rgba[a_idx] = max(0, min(255, new_a))
+                changed.append(i)
+            gen[i] += 1
+            if self._schedule(i):
+                due, _, g = heap.pop()
+                # never reschedule into the past, or the pixel would spin
+                heapq.heappush(heap, (max(due, now + 1), i, g))
+        return changed
+
+
+# ========= BENCHMARK =========
+def _legacy_tick(rgba, ts, life, alpha0, now):
+    """The original per-pixel loop, kept for comparison."""
+    changed = []
+    for i in range(len(ts)):
+        t = ts[i]
+        if t == 0: continue
+        age = now - t
+        a_idx = i*4 + 3
+        cur_a = rgba[a_idx]
+        start_fade = life[i*2]
+        end_fade   = life[i*2+1]
+        if end_fade <= start_fade:
+            continue
+        new_a = cur_a
+        if age > end_fade:
+            if cur_a > 0:
+                new_a = 0
+                ts[i] = 0
+                life[i*2] = 0.0
+                life[i*2+1] = 0.0
+                alpha0[i] = 0
+        elif age > start_fade:
+            frac = (age - start_fade) / (end_fade - start_fade)
+            frac = max(0.0, min(1.0, frac))
+            frac = frac * frac
+            a0 = alpha0[i] or cur_a or 255
+            new_a = int(a0 * (1.0 - frac))
+        if new_a != cur_a:
+            rgba[a_idx] = max(0, min(255, new_a))
+            changed.append(i)
+    return changed
+
+
+def _bench_buffers(w, h, fill, now, seed=1):
+    import array, random
+    rnd = random.Random(seed)
+    n = w * h
+    rgba = bytearray(n * 4)
+    ts = array.array('L', [0] * n)
+    life = array.array('f', [0.0] * (n * 2))
+    alpha0 = array.array('B', [0] * n)
+    for i in rnd.sample(range(n), int(n * fill)):
+        a = rnd.randint(1, 255)
+        rgba[i*4:i*4+4] = bytes((rnd.randrange(256), rnd.randrange(256), rnd.randrange(256), a))
+        ts[i] = now - rnd.randint(0, 7 * 24 * 3600)
+        start = rnd.uniform(0, 36 * 3600)
+        life[i*2] = start
+        life[i*2+1] = start + rnd.uniform(20 * 60, 14 * 24 * 3600)
+        alpha0[i] = a
+    return rgba, ts, life, alpha0
+
+
+def _bench(sizes=(64, 256, 1024), fill=0.5, ticks=5, tick_seconds=60):
+    """Steady-state cost per fade tick.  Both sides first run one catch-up
+    tick (the buffers are generated mid-fade), which is not timed."""
+    import time
+    print(f"{'size':>10} {'changed/tick':>13} {'legacy ms/tick':>15} {'ager ms/tick':>13} {'rebuild ms':>11} {'speedup':>8}")
+    for side in sizes:
+        now0 = int(time.time())
+        legacy = _bench_buffers(side, side, fill, now0)
+        ager_bufs = tuple(b[:] for b in legacy)
+        ager = PixelAger(*ager_bufs, width=side)
+        t0 = time.perf_counter()
+        ager.rebuild()
+        rebuild_ms = (time.perf_counter() - t0) * 1000
+        _legacy_tick(*legacy, now0)
+        ager.tick(now0)
+
+        legacy_s = ager_s = 0.0
+        n_changed = 0
+        for k in range(1, ticks + 1):
+            now = now0 + k * tick_seconds
+            t0 = time.perf_counter()
+            a = _legacy_tick(*legacy, now)
+            legacy_s += time.perf_counter() - t0
+            t0 = time.perf_counter()
+            b = ager.tick(now)
+            ager_s += time.perf_counter() - t0
+            assert sorted(a) == sorted(b), f"changed sets differ at {side}x{side} tick {k}"
+            n_changed += len(b)
+        assert bytes(legacy[0]) == bytes(ager_bufs[0]), "alpha mismatch"
+        lm, am = legacy_s * 1000 / ticks, ager_s * 1000 / ticks
+        print(f"{side:>4}x{side:<5} {n_changed // ticks:>13} {lm:>15.2f} {am:>13.2f} {rebuild_ms:>11.1f} {lm / max(am, 1e-6):>7.0f}x")
+
+if __name__ == "__main__":
+    _bench()
@@ -0,0 +1,110 @@
+"""Rate-limited, self-pruning backups of the critical JSON files.
+
+Saving a file only marks it as due (`request(path)`, a set insert); a
+background thread copies the file as it is on disk into `<dir>/backups/` no
+more than once per `min_interval` per file, optionally gzipped, and then
+prunes that file's backups down to the newest `keep` and drops any older than
+`max_age_days`.  The newest backup is never pruned.  Old uncompressed backups
+(`<name>.<stamp>.json`) are pruned by the same rules.
+
+A path can be given a `source` (a callable returning the bytes to back up)
+for data that no longer lives in that file, e.g. the SQLite-backed indexes.
+"""
+import atexit, gzip, os, shutil, threading, time
+
+
+class BackupManager:
+    def __init__(self, min_interval=600, keep=48, max_age_days=14, compress=True, poll_seconds=5.0):
+        self.min_interval = min_interval
+        self.keep = keep
+        self.max_age_days = max_age_days
+        self.compress = compress
+        self.poll_seconds = poll_seconds
+        self._due = set()
+        self._last = {}                 # path -> time of its last backup
+        self._sources = {}              # path -> callable producing the backup bytes
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def register(self, path, source):
+        """Back `path` up from `source()` instead of reading the file."""
+        self._sources[path] = source
+
+    def request(self, path):
+        """Note that `path` changed; it'll be backed up when its interval allows."""
+        with self._lock:
+            self._due.add(path)
+        self._wake.set()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+        atexit.register(self.run_pending, True)
+
+    def _loop(self):
+        while True:
+            self._wake.wait(self.poll_seconds)
+            self._wake.clear()
+            try:
+                self.run_pending()
+            except Exception as e:
+                print("[BACKUP][ERROR]", e)
+
+    def run_pending(self, force=False):
+        """Back up every due file whose interval has passed (all of them if `force`)."""
+        now = time.time()
+        with self._lock:
+            ready = [p for p in self._due
+                     if force or now - self._last.get(p, 0) >= self.min_interval]
+            self._due.difference_update(ready)
+            for p in ready:
+                self._last[p] = now
+        for path in ready:
+            try:
+                self._backup(path)
+                self.prune(path)
+            except Exception as e:
+                print("[BACKUP][WARN] could not back up", path, "->", e)
+
+    def _backup_dir(self, path):
+        return os.path.join(os.path.dirname(path), "backups")
+
+    def _backup(self, path):
+        source = self._sources.get(path)
+        if source is None and not os.path.exists(path):
+            return
+        backup_dir = self._backup_dir(path)
+        os.makedirs(backup_dir, exist_ok=True)
+        stamp = time.strftime("%Y%m%d-%H%M%S", time.gmtime())
+        dest = os.path.join(backup_dir, f"{os.path.basename(path)}.{stamp}.json")
+        opener = gzip.open if self.compress else open
+        if self.compress:
+            dest += ".gz"
+        tmp = dest + ".tmp"
+        if source is not None:
+            with opener(tmp, "wb") as out:
+                out.write(source())
+        else:
+            # the live file is only ever replaced atomically, so a plain copy is consistent
+            with open(path, "rb") as src, opener(tmp, "wb") as out:
+                shutil.copyfileobj(src, out)
+        os.replace(tmp, dest)
+
+    def prune(self, path):
+        backup_dir = self._backup_dir(path)
+        prefix = os.path.basename(path) + "."
+        try:
+            names = [f for f in os.listdir(backup_dir)
+                     if f.startswith(prefix) and (f.endswith(".json") or f.endswith(".json.gz"))]
+        except FileNotFoundError:
+            return
+        names.sort(reverse=True)        # stamps sort chronologically; newest first
+        cutoff = time.time() - self.max_age_days * 86400 if self.max_age_days else None
+        for i, name in enumerate(names[1:], start=1):
+            full = os.path.join(backup_dir, name)
+            try:
+                if (self.keep and i >= self.keep) or (cutoff and os.path.getmtime(full) < cutoff):
+                    os.remove(full)
+            except FileNotFoundError:
+                pass
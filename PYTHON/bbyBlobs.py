@@ -0,0 +1,223 @@
+"""Content-addressed storage for snapshot rasters and gallery images.
+
+Every payload is stored once under blobs/<h[:2]>/<sha256>.  The names the
+rest of the server uses (snapshots/<id>.raw, gallery/<ts>_<id>.png, ...) are
+hard links to that blob, so readers and URLs are unchanged, identical payloads
+share one copy on disk, and the blob's link count is its reference count:
+removing a name through `unlink()` frees the blob once nothing else links it.
+A name's blob is found from its inode (blob inode -> digest, learned as blobs
+are stored and by listing the store on a miss), never by rehashing the file.
+
+`adopt()` converts files written before the store existed (deduplicating as it
+goes) and `gc()` drops blobs left unreferenced, e.g. by a crash between storing
+and linking.  Where hard links aren't available the names are written as
+plain files and the store is bypassed, which still works, just without the
+savings.
+
+    python bbyBlobs.py storage      # adopt snapshots/ and gallery/, print savings
+"""
+import hashlib, os, sys, threading, time, uuid
+
+
+def digest(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+class BlobStore:
+    def __init__(self, root, gc_grace=600):
+        self.root = root
+        self.gc_grace = gc_grace        # don't collect blobs touched this recently (a link may be on its way)
+        self.links = True
+        self._lock = threading.Lock()
+        self._inodes = {}               # blob inode -> digest
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, h):
+        return os.path.join(self.root, h[:2], h)
+
+    def _put(self, data, h):
+        path = self.path(h)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)       # a concurrent writer of the same bytes is harmless
+        self._inodes[os.stat(path).st_ino] = h
+        return path
+
+    def _link(self, blob, dest):
+        """Make `dest` a hard link to `blob`.  False if the filesystem won't
+        (links are then off for good and `dest` is left alone)."""
+        tmp = f"{dest}.{uuid.uuid4().hex}.tmp"
+        try:
+            os.link(blob, tmp)
+        except FileNotFoundError:
+            raise
+        except OSError as e:
+            print("[BLOBS][WARN] hard links unavailable, writing plain files:", e)
+            self.links = False
+            return False
+        os.replace(tmp, dest)
+        return True
+
+    def _write_plain(self, dest, data):
+        tmp = f"{dest}.{uuid.uuid4().hex}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, dest)
+
+    def write(self, dest, data):
+        """Store `data` and make `dest` name it.  Returns the digest."""
+        h = digest(data)
+        with self._lock:
+            old = self._blob_of(dest)
+            if self.links:
+                try:
+                    linked = self._link(self._put(data, h), dest)
+                except FileNotFoundError:   # collected between put and link: store it again
+                    linked = self._link(self._put(data, h), dest)
+                if not linked:
+                    self._release(h)        # nothing names the blob just stored
+            if not self.links:
+                self._write_plain(dest, data)
+            if old and old != h:
+                self._release(old)
+        return h
+
+    def _scan(self):
+        """Relearn every blob's inode from the store's listing (no reads)."""
+        self._inodes = {}
+        for sub in os.scandir(self.root):
+            if sub.is_dir():
+                for e in os.scandir(sub.path):
+                    if not e.name.endswith(".tmp"):
+                        self._inodes[e.inode()] = e.name
+
+    def _blob_of(self, path):
+        """Digest of the blob the name `path` links to, or None if it links
+        none (missing, or a plain file)."""
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return None
+        if st.st_nlink < 2:
+            return None
+        for attempt in (0, 1):
+            h = self._inodes.get(st.st_ino)
+            try:
+                if h and os.stat(self.path(h)).st_ino == st.st_ino:
+                    return h
+            except FileNotFoundError:
+                pass
+            if not attempt:
+                self._scan()            # stored by another process, or the inode was reused
+        return None
+
+    def _release(self, h):
+        path = self.path(h)
+        try:
+            st = os.stat(path)
+            if st.st_nlink <= 1:
+                os.remove(path)
+                self._inodes.pop(st.st_ino, None)
+        except FileNotFoundError:
+            pass
+
+    def unlink(self, path):
+        """Remove the name `path`; free its blob if that was the last reference."""
+        with self._lock:
+            h = self._blob_of(path)
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                return False
+            if h:
+                self._release(h)
+            return True
+
+    def refs(self, h):
+        """Names currently linking blob `h` (0 if it isn't stored)."""
+        try:
+            return os.stat(self.path(h)).st_nlink - 1
+        except FileNotFoundError:
+            return 0
+
+    def adopt(self, directory, suffixes=(".raw", ".png")):
+        """Move existing files in `directory` into the store, linking duplicates
+        to one blob.  Files already linked are skipped, so reruns are cheap.
+        Returns (files adopted, bytes saved)."""
+        adopted = saved = 0
+        for name in sorted(os.listdir(directory)):
+            path = os.path.join(directory, name)
+            if not self.links:
+                break                   # nothing to gain from copies
+            if not name.endswith(suffixes) or not os.path.isfile(path) or os.stat(path).st_nlink > 1:
+                continue
+            with open(path, "rb") as f:
+                data = f.read()
+            h = digest(data)
+            with self._lock:
+                existed = os.path.exists(self.path(h))
+                if not existed:
+                    os.makedirs(os.path.dirname(self.path(h)), exist_ok=True)
+                    try:
+                        os.link(path, self.path(h))     # this file becomes the blob
+                        self._inodes[os.stat(path).st_ino] = h
+                    except FileExistsError:
+                        existed = True
+                    except OSError as e:
+                        print("[BLOBS][WARN] hard links unavailable, not adopting:", e)
+                        self.links = False
+                        break
+                if existed:
+                    self._link(self.path(h), path)
+            adopted += 1
+            saved += len(data) if existed else 0
+        return adopted, saved
+
+    def gc(self):
+        """Remove blobs nothing links to any more.  Returns (blobs removed, bytes freed)."""
+        removed = freed = 0
+        cutoff = time.time() - self.gc_grace
+        for sub in os.listdir(self.root):
+            d = os.path.join(self.root, sub)
+            if not os.path.isdir(d):
+                continue
+            for name in os.listdir(d):
+                path = os.path.join(d, name)
+                with self._lock:
+                    st = os.stat(path)
+                    if st.st_nlink <= 1 and st.st_ctime < cutoff:  # ctime moves whenever a link comes or goes
+                        os.remove(path)
+                        removed += 1
+                        freed += st.st_size
+        return removed, freed
+
+    def stats(self):
+        """{"blobs", "bytes", "names", "logical_bytes"}: stored vs. referenced."""
+        blobs = size = names = logical = 0
+        for sub in os.listdir(self.root):
+            d = os.path.join(self.root, sub)
+            if not os.path.isdir(d):
+                continue
+            for name in os.listdir(d):
+                st = os.stat(os.path.join(d, name))
+                refs = max(st.st_nlink - 1, 0)
+                blobs += 1
+                size += st.st_size
+                names += refs
+                logical += refs * st.st_size
+        return {"blobs": blobs, "bytes": size, "names": names, "logical_bytes": logical}
+
+
+if __name__ == "__main__":
+    store_dir = sys.argv[1] if len(sys.argv) > 1 else "storage"
+    blobs = BlobStore(os.path.join(store_dir, "blobs"))
+    for sub in ("snapshots", "gallery"):
+        d = os.path.join(store_dir, sub)
+        if os.path.isdir(d):
+            n, saved = blobs.adopt(d)
+            print(f"[BLOBS] {sub}: adopted {n} files, {saved // 1024} KB deduplicated")
+    print("[BLOBS] gc removed %d blobs (%d bytes)" % blobs.gc())
+    print("[BLOBS]", blobs.stats())
@@ -0,0 +1,188 @@
+"""Shared HTTP client for everything the server asks the brain.
+
+One `requests.Session` with a keep-alive connection pool, so the 10 Hz state
+poll and the proxied calls reuse connections instead of handshaking each time.
+
+Per endpoint ("GET /api/state", ...) there is a timeout and a retry count.
+Connection failures are retried for any method (the request never reached
+the brain); GETs are also retried on read timeouts and 502/503/504.  Retries
+draw on a shared budget that refills by `budget_ratio` per request, so a
+struggling brain isn't hit with a multiple of the normal load.
+
+A circuit breaker trips after `breaker_failures` consecutive transport errors:
+calls then fail fast with `BrainUnavailable` for `breaker_reset` seconds, after
+which one trial call is let through.  Endpoints listed in `own_breaker` (slow
+ones such as /api/say) get a breaker of their own, so their long read
+timeouts neither trip nor hold the half-open trial of the shared one that
+the state poll and the quick calls use.  `BrainUnavailable` is a requests
+ConnectionError, so existing `except RequestException` handlers still apply.
+"""
+import threading, time
+from collections import deque
+import requests
+from requests.adapters import HTTPAdapter
+
+_RETRY_STATUS = (502, 503, 504)
+
+
+class BrainUnavailable(requests.exceptions.ConnectionError):
+    pass
+
+
+class _Endpoint:
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.retries = 0
+        self.rejected = 0
+        self.latencies = deque(maxlen=200)      # seconds, recent successful-transport calls
+
+    def snapshot(self):
+        lat = sorted(self.latencies)
+
+        def pct(p):
+            return round(lat[min(len(lat) - 1, int(p * len(lat)))] * 1000, 1) if lat else None
+        return {"calls": self.calls, "errors": self.errors, "retries": self.retries,
+                "rejected": self.rejected,
+                "error_rate": round(self.errors / self.calls, 4) if self.calls else 0.0,
+                "p50_ms": pct(0.5), "p95_ms": pct(0.95), "max_ms": pct(1.0)}
+
+
+class _Breaker:
+    def __init__(self):
+        self.failures = 0
+        self.open_until = 0.0
+        self.trial = False
+
+
+class BrainClient:
+    def __init__(self, base_url, endpoints=None, default=(10, 0), pool_size=16,
+                 breaker_failures=5, breaker_reset=10.0, budget_ratio=0.1, budget_max=10.0,
+                 own_breaker=()):
+        self.base_url = (base_url or "").rstrip("/")
+        self.endpoints = dict(endpoints or {})  # "METHOD /path" -> (timeout, retries)
+        self.default = default
+        self.breaker_failures = breaker_failures
+        self.breaker_reset = breaker_reset
+        self.budget_ratio = budget_ratio
+        self.budget_max = budget_max
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._lock = threading.Lock()
+        self._stats = {}
+        self._shared = _Breaker()
+        self._own = {key: _Breaker() for key in own_breaker}     # endpoint -> its own breaker
+        self._budget = budget_max
+
+    # ---- breaker ----
+    def _admit(self, br):
+        with self._lock:
+            if br.failures < self.breaker_failures:
+                return True
+            if time.time() < br.open_until or br.trial:
+                return False
+            br.trial = True                 # half-open: one call decides
+            return True
+
+    def _record(self, br, ok):
+        with self._lock:
+            br.trial = False
+            if ok:
+                br.failures = 0
+            else:
+                br.failures += 1
+                if br.failures >= self.breaker_failures:
+                    br.open_until = time.time() + self.breaker_reset
+
+    def _release(self, br):
+        """End a call that says nothing about the brain: frees the half-open
+        trial without counting a success or a failure."""
+        with self._lock:
+            br.trial = False
+
+    def _spend_retry(self):
+        with self._lock:
+            if self._budget < 1:
+                return False
+            self._budget -= 1
+            return True
+
+    def _breaker_state(self, br):
+        if br.failures < self.breaker_failures:
+            return "closed"
+        return "open" if time.time() < br.open_until else "half-open"
+
+    # ---- calls ----
+    def request(self, method, path, timeout=None, retries=None, **kw):
+        """Like `session.request` against the brain.  Raises BrainUnavailable if
+        no URL is configured or the breaker is open; other RequestExceptions
+        propagate after retries."""
+        method = method.upper()
+        path = "/" + path.lstrip("/")
+        key = f"{method} {path}"
+        ep_timeout, ep_retries = self.endpoints.get(key, self.default)
+        timeout = ep_timeout if timeout is None else timeout
+        retries = ep_retries if retries is None else retries
+        br = self._own.get(key, self._shared)
+        with self._lock:
+            st = self._stats.setdefault(key, _Endpoint())
+            self._budget = min(self.budget_max, self._budget + self.budget_ratio)
+        if not self.base_url:
+            raise BrainUnavailable("brain not configured")
+
+        attempt = 0
+        while True:
+            if not self._admit(br):
+                with self._lock:
+                    st.rejected += 1
+                raise BrainUnavailable(f"brain circuit open ({key})")
+            t0 = time.perf_counter()
+            try:
+                r = self.session.request(method, self.base_url + path, timeout=timeout, **kw)
+            except requests.exceptions.RequestException as e:
+                self._record(br, False)
+                retryable = isinstance(e, requests.exceptions.ConnectionError) or (
+                    method == "GET" and isinstance(e, requests.exceptions.Timeout))
+                with self._lock:
+                    st.calls += 1
+                    st.errors += 1
+                if retryable and attempt < retries and self._spend_retry():
+                    attempt += 1
+                    with self._lock:
+                        st.retries += 1
+                    time.sleep(0.1 * 2 ** (attempt - 1))
+                    continue
+                raise
+            except BaseException:
+                self._release(br)       # a bad argument (unserialisable json=, ...), not the brain's fault
+                raise
+            self._record(br, True)
+            with self._lock:
+                st.calls += 1
+                st.latencies.append(time.perf_counter() - t0)
+                if r.status_code >= 500:
+                    st.errors += 1
+            if method == "GET" and r.status_code in _RETRY_STATUS and attempt < retries and self._spend_retry():
+                attempt += 1
+                with self._lock:
+                    st.retries += 1
+                time.sleep(0.1 * 2 ** (attempt - 1))
+                continue
+            return r
+
+    def get(self, path, **kw):
+        return self.request("GET", path, **kw)
+
+    def post(self, path, **kw):
+        return self.request("POST", path, **kw)
+
+    def metrics(self):
+        with self._lock:
+            return {"breaker": self._breaker_state(self._shared),
+                    "consecutive_failures": self._shared.failures,
+                    "own_breakers": {k: {"breaker": self._breaker_state(b), "consecutive_failures": b.failures}
+                                     for k, b in self._own.items()},
+                    "retry_budget": round(self._budget, 2),
+                    "endpoints": {k: v.snapshot() for k, v in self._stats.items()}}
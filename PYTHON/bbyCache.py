@@ -0,0 +1,77 @@
+"""Single-value cache with a TTL and stale-while-revalidate.
+
+`get()` answers from memory while the value is fresh.  Once it is older than
+`ttl` the stale value is still returned at once and one background thread
+refreshes it.  With nothing cached at all, one background fetch starts and
+every caller waits for that same fetch, for at most its `timeout`.
+A failed fetch keeps the old value (if any) and is retried only after
+`error_ttl`; until then a cold cache answers a miss without fetching.
+
+`seed()` preloads a value (e.g. last copy from disk) marked as already stale,
+so the first request after a restart is served without waiting on the fetch.
+"""
+import threading, time
+
+
+class SWRCache:
+    def __init__(self, fetch, ttl=60.0, error_ttl=10.0, on_update=None, name="cache"):
+        self.fetch = fetch              # () -> value; raise on failure
+        self.ttl = ttl
+        self.error_ttl = error_ttl
+        self.on_update = on_update      # called with each newly fetched value, off the lock
+        self.name = name
+        self._cv = threading.Condition()
+        self._value = None
+        self._has_value = False
+        self._expires = 0.0
+        self._fetching = False
+        self._last_error = None
+
+    def seed(self, value):
+        with self._cv:
+            if not self._has_value:
+                self._value, self._has_value, self._expires = value, True, 0.0
+
+    def invalidate(self):
+        with self._cv:
+            self._expires = 0.0
+
+    def get(self, timeout=None):
+        """Returns (value, status) with status "fresh", "stale" or "miss";
+        value is None if nothing could be fetched and nothing was cached."""
+        with self._cv:
+            now = time.time()
+            if self._has_value and now < self._expires:
+                return self._value, "fresh"
+            if not self._fetching and (self._has_value or now >= self._expires):
+                self._fetching = True
+                threading.Thread(target=self._refresh, daemon=True).start()
+            if self._has_value:
+                return self._value, "stale"
+            if self._fetching:                      # coalesce onto the fetch in flight
+                self._cv.wait_for(lambda: not self._fetching, timeout)
+            return (self._value if self._has_value else None), "miss"
+
+    def _refresh(self):
+        try:
+            value, error = self.fetch(), None
+        except Exception as e:
+            value, error = None, e
+        with self._cv:
+            self._fetching = False
+            self._last_error = error
+            if error is None:
+                self._value, self._has_value = value, True
+                self._expires = time.time() + self.ttl
+            else:
+                self._expires = time.time() + self.error_ttl
+            self._cv.notify_all()
+        if error is None and self.on_update:
+            try:
+                self.on_update(value)
+            except Exception as e:
+                print(f"[CACHE][WARN] {self.name} on_update failed:", e)
+
+    @property
+    def last_error(self):
+        return self._last_error
@@ -0,0 +1,248 @@
+"""Memory-mapped paint buffers, shared by every worker process.
+
+`paintCanvas.mmap` holds a small header followed by the four paint buffers:
+
+    header   magic, version, header size, width, height, write_seq, flushed_seq, instance
+    rgba     uint8   x 4 per pixel
+    ts       uint64  per pixel (paint time, 0 = unpainted)
+    life     float32 x 2 per pixel (start_fade, end_fade)
+    alpha0   uint8   per pixel
+
+The buffers are exposed as memoryviews straight onto the mapping, so a write
+in one process is visible to the others without copying, and persistence is
+just the mapping being flushed.  `write_seq` orders journal frames across
+processes and doubles as the canvas version; `flushed_seq` marks what the file
+is known to hold durably; `instance` is random per file, so versions from a
+recreated canvas never collide with old ones.
+
+Mutations must hold a `ProcessLock`, which pairs a thread lock with an flock
+so it also excludes other processes.
+
+The size comes from the server's config.  Opening a file made for another
+size moves it aside and starts a fresh one; `resized_from` then names the old
+file so its pixels can be carried over with `copy_from()`.
+"""
+import mmap, os, random, struct, threading
+try:
+    import fcntl
+except ImportError:   # no flock (Windows): single-process only
+    fcntl = None
+
+MAGIC = b"BBYC"
+VERSION = 1
+HEADER = struct.Struct("<4sHHIIQQQ")
+HEADER_SIZE = 64
+_SEQ_OFF = 16       # offset of write_seq within the header
+_FLUSHED_OFF = 24   # offset of flushed_seq
+_INSTANCE_OFF = 32  # offset of instance
+
+
+def _align8(n):
+    return (n + 7) & ~7
+
+
+class ProcessLock:
+    """A threading.Lock that also takes an exclusive flock on `path`."""
+    def __init__(self, path):
+        self._tlock = threading.Lock()
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+
+    def acquire(self):
+        self._tlock.acquire()
+        if fcntl:
+            try:
+                fcntl.flock(self._fd, fcntl.LOCK_EX)
+            except Exception:
+                self._tlock.release()
+                raise
+        return True
+
+    def release(self):
+        if fcntl:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        self._tlock.release()
+
+    def __enter__(self):
+        return self.acquire()
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+def try_exclusive(path):
+    """Take a non-blocking exclusive flock on `path`.  Returns the fd on success
+    (keep it open to keep the lock) or None if another process holds it."""
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    if fcntl is None:
+        return fd
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return fd
+    except OSError:
+        os.close(fd)
+        return None
+
+
+def attach(path, recover):
+    """Register this process as a user of the canvas.  The first process to
+    attach runs `recover()` while holding `path` exclusively; everyone then
+    holds it shared for their lifetime, so a later worker waits for recovery
+    to finish and knows the mapping is already live.  Returns the fd (keep
+    it open) and whether this process ran recovery."""
+    fd = try_exclusive(path)
+    first = fd is not None
+    if first:
+        recover()
+    else:
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    if fcntl:
+        fcntl.flock(fd, fcntl.LOCK_SH)
+    return fd, first
+
+
+class PaintCanvasFile:
+    def __init__(self, path, width, height):
+        self.path = path
+        self.width = width
+        self.height = height
+        self.count = width * height
+        n = self.count
+        self._rgba_off   = HEADER_SIZE
+        self._ts_off     = _align8(self._rgba_off + n * 4)
+        self._life_off   = _align8(self._ts_off + n * 8)
+        self._alpha0_off = _align8(self._life_off + n * 8)
+        self.size        = _align8(self._alpha0_off + n)
+        self.created = False
+        self.resized_from = None
+        self._local_writes = 0
+        self._seen_seq = 0
+
+        self._open()
+        mv = memoryview(self._mm)
+        self.rgba   = mv[self._rgba_off:self._rgba_off + n * 4]
+        self.ts     = mv[self._ts_off:self._ts_off + n * 8].cast("Q")
+        self.life   = mv[self._life_off:self._life_off + n * 8].cast("f")
+        self.alpha0 = mv[self._alpha0_off:self._alpha0_off + n]
+        self._seen_seq = self.write_seq
+
+    def _open(self):
+        # creating/validating happens under an flock so two workers booting
+        # together can't both initialise the file
+        init_fd = os.open(self.path + ".init", os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if fcntl:
+                fcntl.flock(init_fd, fcntl.LOCK_EX)
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                cur = os.fstat(fd).st_size
+                if cur and not self._header_ok(fd):
+                    os.close(fd)
+                    aside = f"{self.path}.{int(os.path.getmtime(self.path))}.bak"
+                    print(f"[CANVAS][WARN] {self.path} has a different version or size, moving it to {aside}")
+                    os.replace(self.path, aside)
+                    self.resized_from = aside
+                    fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+                    cur = 0
+                if cur == 0:
+                    os.ftruncate(fd, self.size)
+                    os.pwrite(fd, HEADER.pack(MAGIC, VERSION, HEADER_SIZE, self.width, self.height, 0, 0, random.getrandbits(63) or 1), 0)
+                    self.created = True
+                self._mm = mmap.mmap(fd, self.size)
+            finally:
+                os.close(fd)
+        finally:
+            os.close(init_fd)   # releases the flock
+
+    def _header_ok(self, fd):
+        try:
+            magic, version, hsize, w, h, _, _, _ = HEADER.unpack(os.pread(fd, HEADER.size, 0))
+        except struct.error:
+            return False
+        return (magic == MAGIC and version == VERSION and hsize == HEADER_SIZE
+                and (w, h) == (self.width, self.height) and os.fstat(fd).st_size >= self.size)
+
+    @classmethod
+    def open_existing(cls, path):
+        """Open a canvas file at whatever size its header says (e.g. `resized_from`)."""
+        with open(path, "rb") as f:
+            magic, version, _, w, h, _, _, _ = HEADER.unpack(f.read(HEADER.size))
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a version {VERSION} canvas")
+        return cls(path, w, h)
+
+    # ---- pixels (call under the ProcessLock) ----
+    def apply_record(self, idx, r, g, b, a, ts, start_fade, end_fade, alpha0):
+        """Write one journal record's full pixel state."""
+        if not (0 <= idx < self.count): return
+        self.rgba[idx*4:idx*4+4] = bytes((r, g, b, a))
+        self.ts[idx] = ts
+        self.life[idx*2] = start_fade
+        self.life[idx*2+1] = end_fade
+        self.alpha0[idx] = alpha0
+
+    def _buffers(self):
+        """(offset, bytes per pixel) of each buffer in the mapping."""
+        return ((self._rgba_off, 4), (self._ts_off, 8), (self._life_off, 8), (self._alpha0_off, 1))
+
+    def copy_from(self, other):
+        """Copy the overlapping top-left region of another canvas into this one."""
+        w, h = min(self.width, other.width), min(self.height, other.height)
+        for (dst, bpp), (src, _) in zip(self._buffers(), other._buffers()):
+            for y in range(h):
+                d = dst + y * self.width * bpp
+                o = src + y * other.width * bpp
+                self._mm[d:d + w * bpp] = other._mm[o:o + w * bpp]
+
+    # ---- sequence numbers (call under the ProcessLock) ----
+    @property
+    def write_seq(self):
+        return struct.unpack_from("<Q", self._mm, _SEQ_OFF)[0]
+
+    @property
+    def instance(self):
+        return struct.unpack_from("<Q", self._mm, _INSTANCE_OFF)[0]
+
+    @property
+    def flushed_seq(self):
+        return struct.unpack_from("<Q", self._mm, _FLUSHED_OFF)[0]
+
+    def next_seq(self):
+        seq = self.write_seq + 1
+        struct.pack_into("<Q", self._mm, _SEQ_OFF, seq)
+        self._local_writes += 1
+        return seq
+
+    def advance_seq(self, seq):
+        """Move write_seq up to at least `seq` (after replaying a journal)."""
+        if seq > self.write_seq:
+            struct.pack_into("<Q", self._mm, _SEQ_OFF, seq)
+
+    def foreign_writes(self):
+        """True if another process has written since the last call."""
+        seq = self.write_seq
+        foreign = (seq - self._seen_seq) != self._local_writes
+        self._seen_seq = seq
+        self._local_writes = 0
+        return foreign
+
+    def flush(self):
+        """msync the whole mapping.  Slow; don't hold the ProcessLock for it."""
+        self._mm.flush()
+
+    def flush_rows(self, bands):
+        """msync only rows [y0, y1) of each buffer, for every (y0, y1) in `bands`
+        (the dirty tiles' rows).  Like flush(), call without the ProcessLock."""
+        page = mmap.PAGESIZE
+        for y0, y1 in bands:
+            for off, bpp in self._buffers():
+                start = off + y0 * self.width * bpp
+                end = off + y1 * self.width * bpp
+                aligned = start - start % page
+                self._mm.flush(aligned, end - aligned)
+
+    def mark_flushed(self, seq):
+        """Record that everything up to `seq` is on disk (after `flush()`).
+        Call under the ProcessLock; the value only ever moves forward."""
+        if seq > self.flushed_seq:
+            struct.pack_into("<Q", self._mm, _FLUSHED_OFF, seq)
+            self._mm.flush(0, min(mmap.PAGESIZE, self.size))
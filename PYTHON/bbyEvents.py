@@ -0,0 +1,104 @@
+"""Ring buffer of paint events keyed by canvas sequence number.
+
+An event's seq is the canvas `write_seq` once its pixels are applied, and its
+id is "<epoch>-<seq>" where the epoch is the canvas file's `instance`.  Both
+live in the shared canvas header, so every worker names the same canvas state
+with the same cursor: a client that moves between workers (or reconnects to
+another one) keeps catching up instead of resyncing.  A cursor from another
+canvas file, or from before the canvas was recreated, has a different epoch
+and is recognised as foreign instead of being silently misread.
+
+Workers group writes differently (another worker's strokes arrive here as one
+relayed event), so a cursor may fall inside one of this log's events; that
+event is sent again, which is harmless since events carry final pixel values.
+Looking a cursor up is a bisect over the ring, never a scan.
+
+Event pixels are stored packed (`PIXEL` records: index + RGBA, 8 bytes each)
+rather than as one dict per pixel; JSON responses unpack them on the way out
+and binary responses send them as-is.
+"""
+import struct, threading, time
+
+PIXEL = struct.Struct("<I4B")     # idx, r, g, b, a
+
+
+def unpack_pixels(packed, width):
+    """Packed PIXEL records -> the JSON shape clients expect."""
+    return [{"x": idx % width, "y": idx // width, "r": r, "g": g, "b": b, "a": a}
+            for idx, r, g, b, a in PIXEL.iter_unpack(packed)]
+
+
+class PaintEventLog:
+    def __init__(self, maxlen=2000, epoch="0", base=0):
+        self.maxlen = maxlen
+        self.epoch = epoch              # shared by every log over the same canvas
+        self._ring = [None] * maxlen
+        self._count = 0                 # events appended so far; event n lives at n % maxlen
+        self._head = base               # seq the log is complete up to
+        self._floor = base              # oldest cursor still servable
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        with self._lock:
+            return min(self._count, self.maxlen)
+
+    def _id(self, seq):
+        return f"{self.epoch}-{seq}"
+
+    def append(self, pixels, ts=None, seq=None):
+        """`pixels` is a bytes-like run of PIXEL records; `seq` the canvas
+        write_seq they bring it to (default: the next one)."""
+        with self._lock:
+            seq = max(seq or 0, self._head + 1)
+            ev = {"id": self._id(seq), "seq": seq, "ts": ts or time.time(), "pixels": bytes(pixels)}
+            slot = self._count % self.maxlen
+            if self._count >= self.maxlen:
+                self._floor = self._ring[slot]["seq"]
+            self._ring[slot] = ev
+            self._count += 1
+            self._head = seq
+            return ev
+
+    def advance(self, seq):
+        """The canvas reached `seq` without any pixel changing."""
+        with self._lock:
+            self._head = max(self._head, seq)
+
+    def head_id(self):
+        """Cursor for "everything so far"."""
+        with self._lock:
+            return self._id(self._head)
+
+    def parse_cursor(self, cursor):
+        """Sequence number of a cursor over this canvas, or None if it is foreign or malformed."""
+        epoch, _, seq = (cursor or "").partition("-")
+        if epoch != self.epoch or not seq.isdigit():
+            return None
+        return int(seq)
+
+    def since(self, cursor):
+        """Events after `cursor`, oldest first.  Returns None when the cursor
+        can't be served (foreign, from the future, or already evicted)."""
+        seq = self.parse_cursor(cursor)
+        with self._lock:
+            if seq is None or seq > self._head or seq < self._floor:
+                return None
+            lo, hi = max(0, self._count - self.maxlen), self._count
+            while lo < hi:              # first event past the cursor
+                mid = (lo + hi) // 2
+                if self._ring[mid % self.maxlen]["seq"] <= seq:
+                    lo = mid + 1
+                else:
+                    hi = mid
+            return [self._ring[n % self.maxlen] for n in range(lo, self._count)]
+
+    @staticmethod
+    def coalesce(events):
+        """Merge events into one packed pixel run, last write per pixel wins."""
+        merged = {}
+        size = PIXEL.size
+        for ev in events:
+            packed = ev["pixels"]
+            for off in range(0, len(packed), size):
+                merged[packed[off:off+4]] = packed[off:off+size]
+        return b"".join(merged.values())
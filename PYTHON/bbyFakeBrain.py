@@ -0,0 +1,160 @@
+"""Stand-in brain for exercising bbyServer without the real one.
+
+Serves the endpoints the server calls (/api/state, /api/say, /api/bbybook) and
+wanders babyState every few seconds.  GET /api/state sends an ETag, answers
+If-None-Match with 304, and with `?wait=N` holds the request until the state
+changes (long-poll).  With --push-to it also POSTs each change to the server's
+/api/state/push.
+
+    python bbyFakeBrain.py --port 8001
+    LLM_SERVER_URL=http://127.0.0.1:8001 BBY_STATE_SYNC=longpoll python bbyServer.py
+
+    BRAIN_PUSH_TOKEN=t python bbyFakeBrain.py --push-to http://127.0.0.1:8420
+    LLM_SERVER_URL=http://127.0.0.1:8001 BBY_STATE_SYNC=push BRAIN_PUSH_TOKEN=t python bbyServer.py
+
+`--no-etag` / `--no-longpoll` make it behave like an older brain, to check the
+server's fallbacks.
+"""
+import argparse, json, os, random, threading, time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+import requests
+
+
+class FakeBrain:
+    def __init__(self, change_every=3.0, etag=True, longpoll=True, push_to=None, push_token=""):
+        self.state = {"eyes": 5, "mouth": 1, "isSpeaking": False, "R": 133, "G": 239, "B": 238}
+        self.version = 1
+        self.change_every = change_every
+        self.etag = etag
+        self.longpoll = longpoll
+        self.push_to = push_to.rstrip("/") if push_to else None
+        self.push_token = push_token
+        self.served = {"200": 0, "304": 0}
+        self._cv = threading.Condition()
+
+    def current_etag(self):
+        return f'"{self.version}"'
+
+    def set(self, changes):
+        with self._cv:
+            diff = {k: v for k, v in changes.items() if self.state.get(k) != v}
+            if not diff:
+                return {}
+            self.state.update(diff)
+            self.version += 1
+            self._cv.notify_all()
+        if self.push_to:
+            try:
+                requests.post(self.push_to + "/api/state/push", json=diff, timeout=2,
+                              headers={"X-Brain-Token": self.push_token})
+            except requests.exceptions.RequestException as e:
+                print("[FAKEBRAIN] push failed:", e)
+        return diff
+
+    def wander(self):
+        while True:
+            time.sleep(self.change_every)
+            self.set(random.choice([
+                {"eyes": random.randint(3, 9)},
+                {"mouth": random.randint(0, 4)},
+                {"isSpeaking": random.random() < 0.3},
+                {"R": random.randint(0, 255), "G": random.randint(0, 255), "B": random.randint(0, 255)},
+            ]))
+
+    def wait_for_change(self, etag, timeout):
+        deadline = time.time() + timeout
+        with self._cv:
+            while self.current_etag() == etag:
+                left = deadline - time.time()
+                if left <= 0:
+                    break
+                self._cv.wait(left)
+
+
+def make_handler(brain):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"       # keep-alive, like a real server
+
+        def _send(self, code, body=None, headers=None):
+            data = json.dumps(body).encode() if body is not None else b""
+            self.send_response(code)
+            for k, v in (headers or {}).items():
+                self.send_header(k, v)
+            if body is not None:
+                self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _body(self):
+            n = int(self.headers.get("Content-Length") or 0)
+            try:
+                return json.loads(self.rfile.read(n) or b"{}")
+            except ValueError:
+                return {}
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            if url.path == "/api/state":
+                seen = self.headers.get("If-None-Match")
+                wait = float(parse_qs(url.query).get("wait", ["0"])[0] or 0)
+                if brain.longpoll and wait and seen:
+                    brain.wait_for_change(seen, min(wait, 60))
+                with brain._cv:
+                    etag, state = brain.current_etag(), dict(brain.state)
+                if brain.etag and seen == etag:
+                    brain.served["304"] += 1
+                    return self._send(304, headers={"ETag": etag})
+                brain.served["200"] += 1
+                return self._send(200, state, {"ETag": etag} if brain.etag else None)
+            if url.path == "/api/bbybook":
+                return self._send(200, {"colour": {"value": "blue", "author": "fakebrain"}})
+            if url.path == "/stats":
+                return self._send(200, brain.served)
+            self._send(404, {"error": "not found"})
+
+        def do_POST(self):
+            url = urlparse(self.path)
+            data = self._body()
+            if url.path == "/api/state":
+                return self._send(200, {"ok": True, "changed": sorted(brain.set(data))})
+            if url.path == "/api/say":
+                brain.set({"isSpeaking": bool(data.get("speak"))})
+                return self._send(200, {"reply": f"you said: {data.get('text', '')}"})
+            self._send(404, {"error": "not found"})
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+def serve(port=0, **kw):
+    """Start a stand-in brain in the background; returns (brain, server)."""
+    brain = FakeBrain(**kw)
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(brain))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    if brain.change_every:
+        threading.Thread(target=brain.wander, daemon=True).start()
+    return brain, server
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--port", type=int, default=8001)
+    ap.add_argument("--change-every", type=float, default=3.0, help="seconds between state changes (0 = never)")
+    ap.add_argument("--push-to", help="server base URL to push state changes to")
+    ap.add_argument("--no-etag", action="store_true")
+    ap.add_argument("--no-longpoll", action="store_true")
+    args = ap.parse_args()
+    brain, server = serve(args.port, change_every=args.change_every, etag=not args.no_etag,
+                          longpoll=not args.no_longpoll, push_to=args.push_to,
+                          push_token=os.environ.get("BRAIN_PUSH_TOKEN", ""))
+    print(f"[FAKEBRAIN] listening on http://127.0.0.1:{server.server_address[1]}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
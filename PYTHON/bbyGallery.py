@@ -0,0 +1,156 @@
+"""Precomputed, cursor-paginated views of the gallery index.
+
+The listing (public fields, `timestamp`/`stamp` aliases, relative file URLs) is
+built once per index version, ordered by (ts, id), so a page is a bisect plus a
+slice no matter how big the gallery gets.  Filtered views (author, hue) are
+built on first use and kept alongside; encoded pages are cached by their query.
+Anything that changes the index calls `invalidate()`, which drops it all; a
+`generation` callable catches changes made elsewhere (another worker's
+writes, picked up when the index reloads) the same way.
+Uploads still being processed (status "pending") are left out until ready.
+
+Cursors are "<ts>:<id>" of an item; `before` pages walk towards older items,
+`after` pages towards newer ones.  Pages are always newest-first.
+"""
+import bisect, json, threading
+from collections import OrderedDict
+
+
+def _item(m):
+    it = dict(m)
+    it["url"] = f"/api/gallery/file/{m['file']}"
+    # Provide a stable 'timestamp' alias alongside legacy 'ts'
+    if 'timestamp' not in it:
+        it['timestamp'] = it.get('ts')
+    # Compatibility: some external clients look for 'stamp' meaning the timestamp
+    if 'stamp' not in it:
+        it['stamp'] = it.get('ts')
+    if m.get("stamp_file"):
+        it["stamp_url"] = f"/api/gallery/file/{m['stamp_file']}"
+    return it
+
+
+def _absolute(it, base):
+    it = dict(it, url=base + it["url"])
+    if "stamp_url" in it:
+        it["stamp_url"] = base + it["stamp_url"]
+    return it
+
+
+def _key(m):
+    return (int(m.get("ts") or 0), str(m.get("id") or ""))
+
+
+def make_cursor(key):
+    return f"{key[0]}:{key[1]}"
+
+
+def parse_cursor(cursor):
+    ts, _, gid = (cursor or "").partition(":")
+    try:
+        return (int(ts), gid)
+    except ValueError:
+        return None
+
+
+def hue_distance(a, b):
+    d = abs(a - b) % 360
+    return min(d, 360 - d)
+
+
+PALETTE_MIN_SHARE = 0.2     # a palette colour this prominent also matches a hue search
+
+
+def matches_hue(it, hue, hue_range):
+    """True if the item's average colour, or a prominent palette colour, is within range."""
+    hues = []
+    if isinstance(it.get("colour"), dict) and it["colour"].get("h") is not None:
+        hues.append(it["colour"]["h"])
+    for p in it.get("palette") or ():
+        if p.get("h") is not None and (p.get("share") or 0) >= PALETTE_MIN_SHARE:
+            hues.append(p["h"])
+    return any(hue_distance(int(h), hue) <= hue_range for h in hues)
+
+
+class GalleryListing:
+    def __init__(self, source, max_views=32, max_pages=256, generation=None):
+        self.source = source            # () -> the current gallery_index list
+        self.generation = generation    # () -> value that moves when the index was reloaded
+        self._seen_gen = None
+        self.max_views = max_views
+        self.max_pages = max_pages
+        self.version = 0
+        self._lock = threading.Lock()
+        self._views = OrderedDict()     # (author, hue, hue_range) -> (keys, items), ascending
+        self._pages = OrderedDict()     # query -> encoded page
+
+    def invalidate(self):
+        with self._lock:
+            self.version += 1
+            self._views.clear()
+            self._pages.clear()
+
+    def _view(self, author, hue, hue_range):
+        """(keys, items) for a filter, ascending by (ts, id).  Call under the lock."""
+        vkey = (author, hue, hue_range)
+        if vkey in self._views:
+            self._views.move_to_end(vkey)
+            return self._views[vkey]
+        if (None, None, None) not in self._views:
+            rows = sorted((m for m in list(self.source()) if isinstance(m, dict) and m.get("file")
+                           and m.get("status", "ready") == "ready"), key=_key)     # no pending uploads
+            self._views[(None, None, None)] = ([_key(m) for m in rows], [_item(m) for m in rows])
+        keys, items = self._views[(None, None, None)]
+        if vkey != (None, None, None):
+            pairs = [(k, it) for k, it in zip(keys, items)
+                     if (author is None or str(it.get("author") or "").lower() == author)
+                     and (hue is None or matches_hue(it, hue, hue_range))]
+            self._views[vkey] = ([k for k, _ in pairs], [it for _, it in pairs])
+            while len(self._views) > self.max_views:
+                old = next(iter(self._views))
+                if old == (None, None, None):
+                    self._views.move_to_end(old)
+                    old = next(iter(self._views))
+                del self._views[old]
+        return self._views[vkey]
+
+    def page(self, base="", limit=50, before=None, after=None, author=None, hue=None, hue_range=20, bare=False):
+        """Encoded JSON page: {items, total, next, prev}.  `next` is the cursor
+        for the following (older) page, `prev` for the preceding (newer) one.
+        `bare` encodes just the items array (the legacy /api/gallery shape)."""
+        author = author.lower() if author else None
+        hue_range = hue_range if hue is not None else None
+        query = (base, limit, before, after, author, hue, hue_range, bare)
+        gen = self.generation() if self.generation else None
+        with self._lock:
+            if gen != self._seen_gen:
+                self._seen_gen = gen
+                self.version += 1
+                self._views.clear()
+                self._pages.clear()
+            if query in self._pages:
+                self._pages.move_to_end(query)
+                return self._pages[query]
+            keys, items = self._view(author, hue, hue_range)
+            if after is not None and parse_cursor(after) is not None:
+                lo = bisect.bisect_right(keys, parse_cursor(after))
+                hi = min(len(items), lo + limit)
+            else:
+                hi = len(items)
+                if before is not None and parse_cursor(before) is not None:
+                    hi = bisect.bisect_left(keys, parse_cursor(before))
+                lo = max(0, hi - limit)
+            chunk = items[lo:hi][::-1]
+            if base:
+                chunk = [_absolute(it, base) for it in chunk]
+            out = chunk if bare else {
+                "items": chunk,
+                "total": len(items),
+                "next": make_cursor(keys[lo]) if lo > 0 else None,
+                "prev": make_cursor(keys[hi - 1]) if 0 < hi < len(items) else None,
+            }
+            body = json.dumps(out, ensure_ascii=False).encode("utf-8")
+            self._pages[query] = body
+            while len(self._pages) > self.max_pages:
+                self._pages.popitem(last=False)
+            return body
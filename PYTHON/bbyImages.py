@@ -0,0 +1,270 @@
+"""Background processing for gallery uploads.
+
+An upload is decoded once: the same in-memory RGBA image is cropped to a
+transparent square, encoded as the gallery PNG, shrunk into the stamp and
+analysed for its colour.  `process_upload()` does that work and is a plain
+module-level function so it can run in a ProcessPoolExecutor, away from the
+request threads.
+
+`ImagePipeline` owns the pool.  The request spools the raw bytes to disk and
+calls `submit()`, which returns at once; when the worker finishes, `on_done`
+(in the parent) writes the files and flips the gallery entry from "pending"
+to "ready".  Spooled uploads survive a restart and are simply submitted again.
+"""
+import io, os, threading, time, multiprocessing
+from colorsys import rgb_to_hsv
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+try:
+    from PIL import Image, ImageStat
+except ImportError:
+    Image = None
+
+MAX_STAMP_DIM = 64
+PALETTE_SIZE = 5            # colours kept per gallery item
+PALETTE_BITS = 3            # bits per channel when bucketing pixels for the palette
+PALETTE_MIN_SAT = 0.15      # greyer palette entries get no hue
+
+
+def _encode_png(img):
+    out = io.BytesIO()
+    img.save(out, format="PNG")
+    return out.getvalue()
+
+
+def crop_to_square(img):
+    """Crop transparent padding and centre the content on a square canvas."""
+    bbox = img.getbbox()
+    if not bbox:
+        return Image.new("RGBA", (1, 1), (0, 0, 0, 0))
+    cropped = img.crop(bbox)
+    width, height = cropped.size
+    max_dim = max(width, height)
+    square = Image.new("RGBA", (max_dim, max_dim), (0, 0, 0, 0))
+    square.paste(cropped, ((max_dim - width) // 2, (max_dim - height) // 2))
+    return square
+
+
+def make_stamp(img, snapshot=False):
+    """Snapshots are forced to 64x64; bigger drawings shrink to fit 64."""
+    if snapshot and img.size != (64, 64):
+        return img.resize((64, 64), Image.Resampling.NEAREST)
+    stamp = img.copy()
+    if img.width > MAX_STAMP_DIM or img.height > MAX_STAMP_DIM:
+        stamp.thumbnail((MAX_STAMP_DIM, MAX_STAMP_DIM), Image.Resampling.NEAREST)
+    return stamp
+
+
+def _opaque_mask(img):
+    """L-mode mask, 255 wherever alpha > 0 (one LUT pass in C)."""
+    return img.getchannel("A").point([0] + [255] * 255)
+
+
+def _hue(r, g, b):
+    h, s, v = rgb_to_hsv(r/255, g/255, b/255)
+    return int(h*360), s
+
+
+def analyse_colour(img):
+    """(colour, palette) for the non-transparent pixels of an RGBA image.
+
+    colour is the average {"r","g","b","h"} (None if fully transparent); the
+    palette is up to PALETTE_SIZE entries {"hex","share","h"}, most common
+    first, from pixels bucketed to PALETTE_BITS per channel.  Means and counts
+    come from ImageStat / getcolors, so no per-pixel Python objects are made."""
+    mask = _opaque_mask(img)
+    if not mask.getbbox():
+        return None, []
+    rgb = img.convert("RGB")
+    stat = ImageStat.Stat(rgb, mask)
+    avg_r, avg_g, avg_b = stat.mean
+    opaque = stat.count[0]
+    colour = {"r": int(avg_r), "g": int(avg_g), "b": int(avg_b), "h": _hue(avg_r, avg_g, avg_b)[0]}
+
+    # bucket each channel (centre of its bucket), tag opaque pixels via alpha, count in C
+    step = 256 >> PALETTE_BITS
+    lut = [(v // step) * step + step // 2 for v in range(256)]
+    bucketed = Image.merge("RGBA", (*rgb.point(lut * 3).split(), mask))
+    counts = bucketed.getcolors(2 << (3 * PALETTE_BITS)) or []
+    palette = []
+    for n, (r, g, b, a) in sorted((c for c in counts if c[1][3]), reverse=True)[:PALETTE_SIZE]:
+        h, sat = _hue(r, g, b)
+        palette.append({"hex": f"#{r:02x}{g:02x}{b:02x}", "share": round(n / opaque, 3),
+                         "h": h if sat >= PALETTE_MIN_SAT else None})
+    return colour, palette
+
+
+def analyse_file(path):
+    """analyse_colour() for an image on disk, for backfilling; (None, []) if unreadable."""
+    try:
+        with Image.open(path) as img:
+            return analyse_colour(img.convert("RGBA"))
+    except Exception as e:
+        print(f"[IMAGES][WARN] colour analysis of {path} failed:", e)
+        return None, []
+
+
+def _avg_colour_slow(img):
+    """The old per-pixel average, kept for the benchmark below."""
+    opaque = [(r, g, b) for (r, g, b, a) in img.getdata() if a > 0]
+    if not opaque:
+        return None
+    return [sum(p[i] for p in opaque) / len(opaque) for i in range(3)]
+
+
+def process_upload(source, snapshot=False):
+    """Decode `source` (bytes or a spool path) once and return
+    {"png", "stamp", "colour", "palette"}; stamp/colour are None (palette
+    empty) if they can't be made.
+    Without Pillow the bytes are passed through untouched."""
+    if not isinstance(source, (bytes, bytearray)):
+        with open(source, "rb") as f:
+            source = f.read()
+    if Image is None:
+        return {"png": bytes(source), "stamp": None, "colour": None, "palette": []}
+    with Image.open(io.BytesIO(source)) as img:
+        img = crop_to_square(img.convert("RGBA"))
+    out = {"png": _encode_png(img), "stamp": None, "colour": None, "palette": []}
+    try:
+        stamp = make_stamp(img, snapshot)
+        out["stamp"] = _encode_png(stamp)
+        out["colour"], out["palette"] = analyse_colour(stamp)
+    except Exception as e:
+        print("[IMAGES][WARN] stamp/colour failed:", e)
+    return out
+
+
+def sniff(image_bytes):
+    """Raise ValueError unless the bytes open as an image (header only, no decode)."""
+    if Image is None:
+        return
+    try:
+        with Image.open(io.BytesIO(image_bytes)) as img:
+            img.size
+    except Exception as e:
+        raise ValueError(f"not an image: {e}")
+
+
+class ImagePipeline:
+    def __init__(self, spool_dir, on_done, workers=2, keep_seconds=600):
+        self.spool_dir = spool_dir
+        self.on_done = on_done          # (gid, result dict or None, error str or None), in the parent
+        self.keep_seconds = keep_seconds
+        os.makedirs(spool_dir, exist_ok=True)
+        self.workers = workers
+        try:
+            # fork: spawn/forkserver would re-import the server as __mp_main__ in each worker.
+            # The workers are forked right here, all at once (the pool never forks again on
+            # fork), so build the pipeline before the server starts threads or opens lock
+            # files: the children then inherit neither a held lock nor an flock fd.
+            ctx = multiprocessing.get_context("fork") if "fork" in multiprocessing.get_all_start_methods() else None
+            self.pool = ProcessPoolExecutor(max_workers=workers, mp_context=ctx)
+            self.pool.submit(os.getpid).result()
+            self.kind = "process"
+        except (OSError, NotImplementedError, ValueError, RuntimeError) as e:
+            self._use_threads(e)
+        self._cv = threading.Condition()
+        self._jobs = {}                 # gid -> {"status", "error", "done_at"}
+
+    def _use_threads(self, why):
+        print("[IMAGES][WARN] process pool unavailable, using threads:", why)
+        self.pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="bby-images")
+        self.kind = "thread"
+
+    def spool_path(self, gid):
+        return os.path.join(self.spool_dir, f"{gid}.upload")
+
+    def spool(self, gid, image_bytes):
+        path = self.spool_path(gid)
+        with open(path + ".tmp", "wb") as f:
+            f.write(image_bytes)
+        os.replace(path + ".tmp", path)
+
+    def submit(self, gid, snapshot=False):
+        """Process the spooled upload for `gid` in the background."""
+        with self._cv:
+            self._prune()
+            self._jobs[gid] = {"status": "pending", "error": None, "done_at": None}
+        try:
+            fut = self.pool.submit(process_upload, self.spool_path(gid), snapshot)
+        except (OSError, RuntimeError) as e:        # e.g. BrokenProcessPool, can't fork
+            self._use_threads(e)
+            fut = self.pool.submit(process_upload, self.spool_path(gid), snapshot)
+        fut.add_done_callback(lambda f: self._finish(gid, f))
+
+    def _finish(self, gid, fut):
+        try:
+            result, error = fut.result(), None
+        except Exception as e:
+            result, error = None, f"{type(e).__name__}: {e}"
+        try:
+            self.on_done(gid, result, error)
+        except Exception as e:
+            print(f"[IMAGES][WARN] finishing {gid} failed:", e)
+            error = error or f"{type(e).__name__}: {e}"
+        try:
+            os.remove(self.spool_path(gid))
+        except OSError:
+            pass
+        with self._cv:
+            self._jobs[gid] = {"status": "failed" if error else "ready", "error": error, "done_at": time.time()}
+            self._cv.notify_all()
+
+    def _prune(self):
+        cutoff = time.time() - self.keep_seconds
+        for gid in [g for g, j in self._jobs.items() if j["done_at"] and j["done_at"] < cutoff]:
+            del self._jobs[gid]
+
+    def status(self, gid):
+        with self._cv:
+            job = self._jobs.get(gid)
+            return dict(job) if job else None
+
+    def wait(self, gid, timeout):
+        """Block until `gid` is no longer pending (or `timeout`); returns its status."""
+        with self._cv:
+            self._cv.wait_for(lambda: (self._jobs.get(gid) or {}).get("status") != "pending", timeout)
+            job = self._jobs.get(gid)
+            return dict(job) if job else None
+
+    def analyse_many(self, paths, chunksize=32):
+        """analyse_file() over many images on the pool; results in the same order."""
+        return list(self.pool.map(analyse_file, paths, chunksize=chunksize))
+
+    def pending(self):
+        with self._cv:
+            return sum(1 for j in self._jobs.values() if j["status"] == "pending")
+
+    def leftover(self):
+        """Gallery ids with a spooled upload on disk (e.g. from before a restart)."""
+        return [n[:-len(".upload")] for n in os.listdir(self.spool_dir) if n.endswith(".upload")]
+
+
+if __name__ == "__main__":
+    # how long an 8 MB-class upload holds the request: inline processing vs spool + submit
+    import sys, tempfile
+    if Image is None:
+        sys.exit("Pillow is required")
+    big = Image.new("RGBA", (2048, 2048), (0, 0, 0, 0))
+    big.paste(Image.effect_noise((1500, 1200), 64).convert("RGBA"), (300, 400))
+    raw = _encode_png(big)
+    for name, img in (("2048px upload", big), ("64px stamp", make_stamp(crop_to_square(big)))):
+        times = []
+        for fn in (_avg_colour_slow, analyse_colour):
+            t = time.perf_counter()
+            for _ in range(5):
+                fn(img)
+            times.append((time.perf_counter() - t) / 5 * 1000)
+        print(f"[IMAGES] colour of a {name}: per-pixel {times[0]:.2f} ms, analyse_colour {times[1]:.2f} ms (with palette)")
+    t = time.perf_counter()
+    process_upload(raw)
+    print(f"[IMAGES] inline: request held {(time.perf_counter() - t) * 1000:.0f} ms for a {len(raw) // 1024} KB upload")
+    done = threading.Event()
+    pipe = ImagePipeline(tempfile.mkdtemp(), lambda gid, result, error: done.set())
+    t = time.perf_counter()
+    pipe.spool("bench", raw)
+    pipe.submit("bench")
+    held = time.perf_counter() - t
+    done.wait(60)
+    print(f"[IMAGES] pipeline ({pipe.kind} pool): request held {held * 1000:.1f} ms, "
+          f"ready after {(time.perf_counter() - t) * 1000:.0f} ms, status {pipe.wait('bench', 5)['status']}")
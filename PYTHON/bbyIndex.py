@@ -0,0 +1,291 @@
+"""Ordered record index with O(1) lookups by id and by unique fields.
+
+Backs gallery_index and snapshot_index.  Records live in one dict keyed by
+id, whose insertion order is the list order, so appends, lookups, deletes and
+trimming the oldest entries are all O(1).  Unique fields (e.g. "file") get
+their own value -> id map, and flag fields (e.g. "has_png") keep an ordered
+set of the ids where they are truthy, so "newest with a PNG" is O(1) too.
+
+Change records through `update()` (or re-`put()` them) so the side maps stay
+in step; `check()` verifies they do.  An optional `sink` (see bbyMetaStore)
+is told about every change as it happens: put(rec) / remove(id) for
+single records, replace(records) for bulk swaps.  A sink shared with other
+processes also offers stale() and load(): every public lookup or change then
+first reloads the index if another process has written since (`sync()`).
+`python bbyIndex.py` runs a randomised consistency check.
+"""
+import uuid
+
+
+class RecordIndex:
+    def __init__(self, records=(), unique=(), flags=(), sink=None):
+        self.unique = tuple(unique)
+        self.flags = tuple(flags)
+        self.sink = None
+        self.reloads = 0                # times sync() picked up another process's writes
+        self.replace(records)
+        self.sink = sink                # set after loading: the initial records came from it
+
+    def sync(self):
+        """Reload from the sink if another process changed it.  Returns the
+        reload count, which moves whenever the contents were swapped."""
+        sink = self.sink
+        if sink is not None and getattr(sink, "stale", None) and sink.stale():
+            fresh = RecordIndex(sink.load(), self.unique, self.flags)
+            self._recs, self._seq, self._next = fresh._recs, fresh._seq, fresh._next
+            self._by, self._flagged = fresh._by, fresh._flagged
+            self.reloads += 1
+        return self.reloads
+
+    # ---- bulk ----
+    def replace(self, records):
+        """Swap in a new ordered list of records.  A repeated id keeps its
+        first position and the last record's contents."""
+        sink, self.sink = self.sink, None
+        try:
+            self._load(records)
+        finally:
+            self.sink = sink
+        if sink:
+            sink.replace(self.to_list())
+
+    def _load(self, records):
+        self._recs = {}
+        self._seq = {}                  # id -> insertion number, to keep flag sets in record order
+        self._next = 0
+        self._by = {f: {} for f in self.unique}
+        self._flagged = {f: {} for f in self.flags}
+        for rec in records or ():
+            if isinstance(rec, dict):
+                self._put(rec)
+
+    def to_list(self):
+        self.sync()
+        return list(self._recs.values())
+
+    # ---- sequence-ish ----
+    def __len__(self):
+        self.sync()
+        return len(self._recs)
+
+    def __iter__(self):
+        self.sync()
+        return iter(list(self._recs.values()))
+
+    def __reversed__(self):
+        self.sync()
+        return reversed(list(self._recs.values()))
+
+    def __contains__(self, rid):
+        self.sync()
+        return rid in self._recs
+
+    def last(self):
+        self.sync()
+        return self._recs[next(reversed(self._recs))] if self._recs else None
+
+    # ---- lookups ----
+    def get(self, rid):
+        self.sync()
+        return self._recs.get(rid)
+
+    def _by_value(self, field, value):
+        rid = self._by[field].get(value)
+        return self._recs.get(rid) if rid is not None else None
+
+    def by(self, field, value):
+        self.sync()
+        return self._by_value(field, value)
+
+    def find(self, key):
+        """Record whose id, or any unique field, equals `key`."""
+        self.sync()
+        rec = self._recs.get(key)
+        if rec is None:
+            for f in self.unique:
+                rec = self._by_value(f, key)
+                if rec is not None:
+                    break
+        return rec
+
+    def latest(self, flag):
+        """Newest record with `flag` truthy, or None."""
+        self.sync()
+        ids = self._flagged[flag]
+        return self._recs[next(reversed(ids))] if ids else None
+
+    # ---- mutation ----
+    def _unlink(self, rid):
+        rec = self._recs.get(rid)
+        if rec is None:
+            return None
+        for f in self.unique:
+            if self._by[f].get(rec.get(f)) == rid:
+                del self._by[f][rec.get(f)]
+        for f in self.flags:
+            self._flagged[f].pop(rid, None)
+        return rec
+
+    def _link(self, rid, rec):
+        for f in self.unique:
+            v = rec.get(f)
+            if v is not None:
+                other = self._by[f].get(v)
+                if other is not None and other != rid:
+                    self._remove(other)     # unique field taken over by this record
+                self._by[f][v] = rid
+        for f in self.flags:
+            if rec.get(f):
+                ids = self._flagged[f]
+                newer = ids and self._seq[next(reversed(ids))] > self._seq[rid]
+                ids[rid] = None
+                if newer:   # flagged an older record: rare, so just re-sort
+                    self._flagged[f] = dict.fromkeys(sorted(ids, key=self._seq.__getitem__))
+
+    def put(self, rec):
+        """Insert `rec` (appended) or replace the record with its id (in place)."""
+        self.sync()
+        return self._put(rec)
+
+    def _put(self, rec):
+        rid = rec.get("id")
+        if rid is None:
+            rid = rec["id"] = str(uuid.uuid4())
+        if self._unlink(rid) is None:
+            self._seq[rid] = self._next
+            self._next += 1
+        self._recs[rid] = rec
+        self._link(rid, rec)
+        if self.sink:
+            self.sink.put(rec)
+        return rec
+
+    append = put
+
+    def update(self, rid, **fields):
+        self.sync()
+        rec = self._recs.get(rid)
+        if rec is None:
+            return None
+        self._unlink(rid)
+        rec.update(fields)
+        self._link(rid, rec)
+        if self.sink:
+            self.sink.put(rec)
+        return rec
+
+    def remove(self, rid):
+        self.sync()
+        return self._remove(rid)
+
+    def _remove(self, rid):
+        rec = self._unlink(rid)
+        if rec is not None:
+            del self._recs[rid]
+            del self._seq[rid]
+            if self.sink:
+                self.sink.remove(rid)
+        return rec
+
+    def trim(self, keep):
+        """Drop the oldest records beyond `keep`.  Returns how many were dropped."""
+        self.sync()
+        n = 0
+        while len(self._recs) > keep:
+            self._remove(next(iter(self._recs)))
+            n += 1
+        return n
+
+    def merge(self, records, match=()):
+        """Insert or update each record, matching an existing one by the fields
+        in `match` first, then by id; a matched record keeps its position.
+        Returns (inserted, updated)."""
+        self.sync()
+        inserted = updated = 0
+        swaps = {}                      # old id -> record taking its place under a new id
+        for rec in records:
+            old = None
+            for f in match:
+                if rec.get(f) is not None:
+                    old = self._by_value(f, rec.get(f))
+                    if old is not None:
+                        break
+            if old is None:
+                old = self._recs.get(rec.get("id"))
+            if old is None:
+                self._put(rec)
+                inserted += 1
+            elif old.get("id") == rec.get("id"):
+                self._put(rec)
+                updated += 1
+            else:
+                swaps[old["id"]] = rec
+                updated += 1
+        if swaps:   # one rebuild for every entry whose id changed
+            self.replace([swaps.get(rid, r) for rid, r in self._recs.items()])
+        return inserted, updated
+
+    # ---- verification ----
+    def check(self):
+        """Raise AssertionError if any side map disagrees with the records."""
+        for rid, rec in self._recs.items():
+            assert rec.get("id") == rid, f"record under {rid!r} has id {rec.get('id')!r}"
+        for f in self.unique:
+            want = {rec[f]: rid for rid, rec in self._recs.items() if rec.get(f) is not None}
+            assert self._by[f] == want, f"{f} map out of step"
+        order = list(self._recs)
+        for f in self.flags:
+            want = [rid for rid in order if self._recs[rid].get(f)]
+            assert list(self._flagged[f]) == want, f"{f} flag set out of step"
+
+
+def _selfcheck(rounds=20000, seed=1):
+    """Randomised consistency check against a plain list model."""
+    import random
+    rnd = random.Random(seed)
+    idx = RecordIndex(unique=("file",), flags=("has_png",))
+    model = []
+
+    def model_remove(rid):
+        model[:] = [r for r in model if r["id"] != rid]
+
+    for step in range(rounds):
+        op = rnd.random()
+        if op < 0.4 or not model:
+            rec = {"id": f"g{rnd.randrange(400)}", "file": f"f{rnd.randrange(400)}.png", "has_png": rnd.random() < 0.5}
+            clash = next((r for r in model if r["file"] == rec["file"] and r["id"] != rec["id"]), None)
+            if clash:
+                model_remove(clash["id"])
+            pos = next((i for i, r in enumerate(model) if r["id"] == rec["id"]), None)
+            if pos is None:
+                model.append(rec)
+            else:
+                model[pos] = rec
+            idx.put(dict(rec))
+        elif op < 0.6:
+            rid = rnd.choice(model)["id"]
+            model_remove(rid)
+            idx.remove(rid)
+        elif op < 0.75:
+            rid = rnd.choice(model)["id"]
+            flag = rnd.random() < 0.5
+            next(r for r in model if r["id"] == rid)["has_png"] = flag
+            idx.update(rid, has_png=flag)
+        elif op < 0.8:
+            keep = rnd.randrange(len(model) + 1)
+            del model[:len(model) - keep]
+            idx.trim(keep)
+        else:
+            rec = rnd.choice(model)
+            assert idx.find(rec["id"]) == rec and idx.find(rec["file"]) == rec
+            want = next((r for r in reversed(model) if r["has_png"]), None)
+            assert idx.latest("has_png") == want
+        assert idx.to_list() == model, f"order diverged at step {step}"
+        if step % 97 == 0:
+            idx.check()
+    idx.check()
+    print(f"[INDEX] {rounds} random operations, index consistent ({len(idx)} records)")
+
+
+if __name__ == "__main__":
+    _selfcheck()
@@ -0,0 +1,120 @@
+"""Bounded job queue for slow brain calls (/api/say).
+
+`submit()` queues a payload and returns a job right away; a fixed pool of
+worker threads runs `handler(payload)` for each one.  A job submitted with the
+same key as one still queued or running is merged into it (the caller gets the
+existing job back), so a double-submitted message reaches the brain once.
+When the queue is full `submit()` returns None and the caller should shed the
+request, so a slow brain costs throughput rather than server workers.
+
+Finished jobs are kept for `keep_seconds` so clients can poll them, and are
+numbered in completion order so a push stream can send only the new ones.
+"""
+import threading, time, uuid
+from collections import deque
+
+
+class BrainJobQueue:
+    def __init__(self, handler, workers=2, maxsize=100, keep_seconds=300, on_done=None):
+        self.handler = handler
+        self.workers = workers
+        self.maxsize = maxsize
+        self.keep_seconds = keep_seconds
+        self.on_done = on_done          # called with each finished job, from the worker thread
+        self._cv = threading.Condition()
+        self._queue = deque()
+        self._jobs = {}                 # id -> job
+        self._by_key = {}               # key -> id, while queued or running
+        self._finished = deque()        # (done_seq, job), oldest first
+        self.done_seq = 0
+
+    def start(self):
+        for _ in range(self.workers):
+            threading.Thread(target=self._worker, daemon=True).start()
+
+    def submit(self, payload, key=None):
+        """Queue `payload`.  Returns (job, merged), or (None, False) if the queue is full."""
+        with self._cv:
+            self._expire()
+            if key is not None and key in self._by_key:
+                return self._jobs[self._by_key[key]], True
+            if len(self._queue) >= self.maxsize:
+                return None, False
+            job = {"id": uuid.uuid4().hex, "status": "queued", "submitted": time.time(),
+                   "key": key, "payload": payload, "result": None, "error": None}
+            self._jobs[job["id"]] = job
+            if key is not None:
+                self._by_key[key] = job["id"]
+            self._queue.append(job)
+            self._cv.notify_all()
+            return job, False
+
+    def find(self, key):
+        """The queued or running job for `key`, if any."""
+        with self._cv:
+            job_id = self._by_key.get(key)
+            return self._jobs.get(job_id) if job_id else None
+
+    def get(self, job_id):
+        with self._cv:
+            return self._jobs.get(job_id)
+
+    def wait(self, job_id, timeout):
+        """Block until the job finishes or `timeout` passes; returns the job (or None if unknown)."""
+        deadline = time.time() + timeout
+        with self._cv:
+            job = self._jobs.get(job_id)
+            while job is not None and job["status"] in ("queued", "running"):
+                left = deadline - time.time()
+                if left <= 0:
+                    break
+                self._cv.wait(left)
+            return job
+
+    def finished_since(self, seq):
+        """Jobs finished after completion number `seq` (see job["done_seq"]), oldest first."""
+        with self._cv:
+            return [job for n, job in self._finished if n > seq]
+
+    def position(self, job_id):
+        """How many jobs are ahead of a queued job (0 once it's running)."""
+        with self._cv:
+            for i, job in enumerate(self._queue):
+                if job["id"] == job_id:
+                    return i + 1
+            return 0
+
+    def _expire(self):
+        cutoff = time.time() - self.keep_seconds
+        while self._finished and self._finished[0][1]["finished"] < cutoff:
+            _, job = self._finished.popleft()
+            self._jobs.pop(job["id"], None)
+
+    def _worker(self):
+        while True:
+            with self._cv:
+                while not self._queue:
+                    self._cv.wait()
+                job = self._queue.popleft()
+                job["status"] = "running"
+                job["started"] = time.time()
+            try:
+                result, error = self.handler(job["payload"]), None
+            except Exception as e:
+                print("[JOBS][ERROR] job failed:", e)
+                result, error = None, str(e)
+            with self._cv:
+                job["result"], job["error"] = result, error
+                job["status"] = "error" if error else "done"
+                job["finished"] = time.time()
+                if self._by_key.get(job["key"]) == job["id"]:
+                    del self._by_key[job["key"]]
+                self.done_seq += 1
+                job["done_seq"] = self.done_seq
+                self._finished.append((self.done_seq, job))
+                self._cv.notify_all()
+            if self.on_done:
+                try:
+                    self.on_done(job)
+                except Exception as e:
+                    print("[JOBS][ERROR] on_done failed:", e)
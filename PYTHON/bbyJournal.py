@@ -0,0 +1,243 @@
+"""Append-only journal of paint pixel deltas.
+
+Every pixel write (paint or fade) is appended as a fixed-size record carrying
+the pixel's full state, so replaying a record is idempotent.  Each `commit()`
+becomes one frame stamped with a sequence number; frames are group-committed
+by one writer thread: whatever piles up while the previous batch is being
+written goes out with a single write() and at most one fsync.
+
+Each process writes its own numbered segments (`<name>.<pid>.<n>.log`), and
+the sequence numbers come from the shared canvas header, so replay can merge
+segments from several worker processes back into apply order.  Compaction
+rotates to a fresh segment, flushes the canvas, then deletes the older
+segments; frames at or below the canvas' flushed sequence are skipped.
+
+fsync policies:
+    "always"   - fsync every batch; callers `wait()` on their commit before replying
+    "interval" - fsync at most every `fsync_seconds`; callers don't wait
+    "never"    - leave flushing to the OS
+"""
+import os, re, struct, threading, time, zlib
+
+# idx, r, g, b, a, ts, start_fade, end_fade, alpha0
+RECORD = struct.Struct("<I4BIffB")
+FRAME  = struct.Struct("<QII")     # seq, record count, crc32 of the records
+FSYNC_POLICIES = ("always", "interval", "never")
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except Exception:
+        pass
+    return True
+
+
+class PaintJournal:
+    def __init__(self, directory, name="paintJournal", fsync="interval", fsync_seconds=1.0, commit_ms=5, seq_source=None):
+        if fsync not in FSYNC_POLICIES:
+            print(f"[JOURNAL][WARN] unknown fsync policy {fsync!r}, using 'interval'")
+            fsync = "interval"
+        self.directory = directory
+        self.name = name
+        self.fsync = fsync
+        self.fsync_seconds = fsync_seconds
+        self.commit_ms = commit_ms
+        self.pid = os.getpid()
+        self._local_seq = 0
+        self._seq_source = seq_source or self._next_local_seq
+        self._cv = threading.Condition()
+        self._pending = []          # (ticket, seq, packed records | rotation segment)
+        self._queued = 0            # ticket of the newest queued item
+        self._written = 0           # ticket of the newest item on disk
+        self._segment = max((n for pid, n in self.segments() if pid == self.pid), default=0) + 1
+        self._cur = self._segment
+        self._fh = None
+        self._dirty = False
+        self._bytes = 0
+        self._opened_ts = time.time()
+        self._last_fsync = 0.0
+        self._thread = None
+
+    def _next_local_seq(self):
+        self._local_seq += 1
+        return self._local_seq
+
+    # ---- segments ----
+    def _segment_path(self, pid, n):
+        return os.path.join(self.directory, f"{self.name}.{pid}.{n:08d}.log")
+
+    def segments(self):
+        """All (pid, n) segments on disk, from every process."""
+        pat = re.compile(re.escape(self.name) + r"\.(\d+)\.(\d+)\.log$")
+        out = []
+        for f in os.listdir(self.directory):
+            m = pat.match(f)
+            if m:
+                out.append((int(m.group(1)), int(m.group(2))))
+        return sorted(out)
+
+    # ---- replay ----
+    def replay(self, apply, min_seq=0):
+        """Call `apply(idx, r, g, b, a, ts, start_fade, end_fade, alpha0)` for every
+        record with seq > min_seq, across all segments, in seq order.  A segment
+        is cut at its first torn or corrupt frame.  Returns (records, max_seq)."""
+        frames = []
+        for pid, n in self.segments():
+            path = self._segment_path(pid, n)
+            try:
+                with open(path, "rb") as f:
+                    data = f.read()
+            except Exception as e:
+                print(f"[JOURNAL][WARN] could not read {path}: {e}")
+                continue
+            pos = 0
+            while pos + FRAME.size <= len(data):
+                seq, count, crc = FRAME.unpack_from(data, pos)
+                body = data[pos + FRAME.size: pos + FRAME.size + count * RECORD.size]
+                if len(body) != count * RECORD.size or zlib.crc32(body) != crc:
+                    print(f"[JOURNAL][WARN] torn frame in {os.path.basename(path)} at byte {pos}, ignoring rest")
+                    break
+                if seq > min_seq:
+                    frames.append((seq, body))
+                pos += FRAME.size + len(body)
+        frames.sort(key=lambda fr: fr[0])
+        n = 0
+        for _, body in frames:
+            for rec in RECORD.iter_unpack(body):
+                apply(*rec)
+                n += 1
+        return n, (frames[-1][0] if frames else min_seq)
+
+    # ---- writing ----
+    def start(self):
+        self._thread = threading.Thread(target=self._writer_loop, daemon=True)
+        self._thread.start()
+
+    def commit(self, records):
+        """Queue records (tuples in RECORD order) for the next group commit.
+        Call under the lock that orders the pixel writes (paint_lock), since the
+        sequence number is drawn here.  Returns a ticket for `wait()`."""
+        if not records:
+            return None
+        packed = b"".join(RECORD.pack(*r) for r in records)
+        seq = self._seq_source()
+        with self._cv:
+            self._queued += 1
+            self._pending.append((self._queued, seq, packed))
+            self._cv.notify_all()
+            return self._queued
+
+    def wait(self, ticket, timeout=5.0):
+        """Block until `ticket` has been handed to the OS (and fsynced, under
+        fsync='always').  Returns False on timeout."""
+        if ticket is None:
+            return True
+        deadline = time.time() + timeout
+        with self._cv:
+            while self._written < ticket:
+                left = deadline - time.time()
+                if left <= 0:
+                    return False
+                self._cv.wait(left)
+        return True
+
+    def rotate(self):
+        """Start a new segment for everything committed after this call.  Call
+        under paint_lock so the cut lines up with the canvas.  Returns
+        (segment, ticket); `wait(ticket)` before dropping older segments."""
+        with self._cv:
+            self._segment += 1
+            self._queued += 1
+            self._pending.append((self._queued, None, self._segment))
+            self._cv.notify_all()
+            return self._segment, self._queued
+
+    def drop_segments_before(self, seg):
+        """Delete this process' segments older than `seg`, plus any left behind
+        by processes that have exited, once the canvas has been flushed."""
+        for pid, n in self.segments():
+            if (pid == self.pid and n < seg) or (pid != self.pid and not _pid_alive(pid)):
+                self._remove(pid, n)
+
+    def drop_all(self):
+        """Delete every segment (startup, once replayed and flushed by the only
+        process attached to the canvas)."""
+        for pid, n in self.segments():
+            self._remove(pid, n)
+
+    def _remove(self, pid, n):
+        try:
+            os.remove(self._segment_path(pid, n))
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"[JOURNAL][WARN] could not remove segment {pid}.{n}: {e}")
+
+    def needs_compaction(self, max_bytes, max_age):
+        with self._cv:
+            if self._bytes <= 0:
+                return False
+            return self._bytes >= max_bytes or (time.time() - self._opened_ts) >= max_age
+
+    def _close(self):
+        if self._fh:
+            if self.fsync != "never":
+                os.fsync(self._fh.fileno())
+            self._fh.close()
+            self._fh = None
+
+    def _writer_loop(self):
+        while True:
+            with self._cv:
+                while not self._pending:
+                    if not self._cv.wait(self.fsync_seconds):
+                        self._sync(idle=True)
+            if self.commit_ms:
+                time.sleep(self.commit_ms / 1000.0)   # let concurrent strokes join this batch
+            with self._cv:
+                batch, self._pending = self._pending, []
+            ticket = batch[-1][0]
+            try:
+                chunk = []
+                for _, seq, item in batch:
+                    if seq is None:                 # rotation marker
+                        self._write(chunk); chunk = []
+                        self._close()
+                        with self._cv:
+                            self._cur = item
+                            self._bytes = 0
+                            self._opened_ts = time.time()
+                    else:
+                        chunk.append(FRAME.pack(seq, len(item) // RECORD.size, zlib.crc32(item)) + item)
+                self._write(chunk)
+                self._sync()
+            except Exception as e:
+                print("[JOURNAL][ERROR] write failed:", e)
+            with self._cv:
+                self._written = ticket
+                self._cv.notify_all()
+
+    def _write(self, frames):
+        if not frames:
+            return
+        if self._fh is None:
+            self._fh = open(self._segment_path(self.pid, self._cur), "ab", buffering=0)
+        data = b"".join(frames)
+        self._fh.write(data)
+        self._bytes += len(data)
+        self._dirty = True
+
+    def _sync(self, idle=False):
+        if not (self._fh and self._dirty) or self.fsync == "never":
+            return
+        now = time.time()
+        if self.fsync == "always" or idle or now - self._last_fsync >= self.fsync_seconds:
+            try:
+                os.fsync(self._fh.fileno())
+            except Exception as e:
+                print("[JOURNAL][WARN] fsync failed:", e)
+            self._last_fsync = now
+            self._dirty = False
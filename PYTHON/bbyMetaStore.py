@@ -0,0 +1,197 @@
+"""SQLite storage for the gallery, snapshot and chat metadata.
+
+One database (WAL mode) with a table per kind.  Each row holds the record as
+JSON plus the columns worth indexing (id, ts, author, uid, ...) and `pos`,
+the record's place in list order.  A `MetaTable` is meant to be the `sink` of
+a `RecordIndex`: the in-memory index still answers the routes, and every
+change to it becomes a single-row upsert or delete here instead of a rewrite
+of the whole JSON file.
+
+Several worker processes share the database, each with its own index.  Every
+write bumps the table's generation (meta row "gen:<kind>") in the same
+transaction, and new rows take their `pos` from the table, not from the
+writer's index, so workers never hand out the same position.  `stale()` tells
+an index that another process wrote since it last loaded; checking costs one
+`PRAGMA data_version` unless something did change.
+
+`migrate_json()` does the one-shot import from the old index.json /
+chatHistory.json files; `export()` turns a table back into the JSON list that
+/api/gallery/import_index (and the backups) use.
+
+    python bbyMetaStore.py migrate storage/bby.sqlite3 gallery storage/gallery/index.json
+    python bbyMetaStore.py export  storage/bby.sqlite3 gallery > index.json
+"""
+import json, sqlite3, sys, threading
+from contextlib import contextmanager
+
+# kind -> indexed columns, each taken from a record field
+KINDS = {
+    "gallery":   {"ts": "ts", "author": "author", "file": "file"},
+    "snapshots": {"ts": "ts", "has_png": "has_png"},
+    "chat":      {"ts": "timestamp", "uid": "uid", "author": "author"},
+}
+
+
+class MetaStore:
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.RLock()
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self._data_version = None
+        self._gens = {}                 # kind -> generation, as of _data_version
+        for kind, cols in KINDS.items():
+            extra = "".join(f", {c}" for c in cols)
+            self.db.execute(f"CREATE TABLE IF NOT EXISTS {kind} (id TEXT PRIMARY KEY, pos INTEGER NOT NULL{extra}, data TEXT NOT NULL)")
+            self.db.execute(f"CREATE INDEX IF NOT EXISTS {kind}_pos ON {kind}(pos)")
+            for c in cols:
+                self.db.execute(f"CREATE INDEX IF NOT EXISTS {kind}_{c} ON {kind}({c})")
+        self._tables = {}
+
+    def table(self, kind):
+        if kind not in self._tables:
+            self._tables[kind] = MetaTable(self, kind)
+        return self._tables[kind]
+
+    @contextmanager
+    def batch(self):
+        """Group many sink writes (e.g. a bulk backfill) into one transaction.
+        Other writers wait for it; nesting just joins the outer batch."""
+        with self._lock:
+            if self.db.in_transaction:
+                yield
+                return
+            self.db.execute("BEGIN IMMEDIATE")     # take the write lock up front: no upgrade deadlocks
+            try:
+                yield
+            except BaseException:
+                self.db.execute("ROLLBACK")
+                raise
+            self.db.execute("COMMIT")
+
+    def generation(self, kind):
+        """`kind`'s write generation.  Re-read only when another connection has
+        committed since the last look (our own writes update it in place)."""
+        with self._lock:
+            dv = self.db.execute("PRAGMA data_version").fetchone()[0]
+            if dv != self._data_version:
+                self._data_version = dv
+                self._gens = {k[4:]: int(v) for k, v in self.db.execute("SELECT key, value FROM meta WHERE key LIKE 'gen:%'")}
+            return self._gens.get(kind, 0)
+
+    def get_meta(self, key):
+        with self._lock:
+            row = self.db.execute("SELECT value FROM meta WHERE key=?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, key, value):
+        with self._lock:
+            self.db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    def migrate_json(self, kind, json_path):
+        """Import `json_path` into an empty table, once.  Returns rows imported
+        (0 if already migrated, the table has rows, or the file is missing)."""
+        t = self.table(kind)
+        if self.get_meta(f"migrated:{kind}") or t.count():
+            return 0
+        try:
+            with open(json_path, "r", encoding="utf-8") as f:
+                records = json.load(f)
+        except FileNotFoundError:
+            records = []
+        if not isinstance(records, list):
+            raise ValueError(f"{json_path} is not a JSON list")
+        from bbyIndex import RecordIndex      # dedupes ids the same way the live index does
+        records = RecordIndex(records, unique=("file",) if kind == "gallery" else ()).to_list()
+        t.replace(records)
+        self.set_meta(f"migrated:{kind}", json_path)
+        return len(records)
+
+
+class MetaTable:
+    def __init__(self, store, kind):
+        self.store = store
+        self.kind = kind
+        self.cols = KINDS[kind]
+        names = ["id", "pos", *self.cols, "data"]
+        marks = ", ".join("?" * (len(names) - 1))
+        self._insert = f"INSERT INTO {kind} ({', '.join(names)}) VALUES (?, {marks})"
+        # a new row goes after the last one; an existing row keeps its place
+        self._upsert = (f"INSERT INTO {kind} ({', '.join(names)}) "
+                        f"VALUES (?, (SELECT COALESCE(MAX(pos), -1) + 1 FROM {kind}), {', '.join('?' * (len(names) - 2))}) "
+                        f"ON CONFLICT(id) DO UPDATE SET " + ", ".join(f"{c}=excluded.{c}" for c in names[2:]))
+        self._gen_key = f"gen:{kind}"
+        self._seen = None               # generation this process's index reflects; None = reload
+
+    def _row(self, rec):
+        vals = []
+        for field in self.cols.values():
+            v = rec.get(field)
+            vals.append(v if isinstance(v, (int, float, str)) or v is None else json.dumps(v))
+        return (rec["id"], *vals, json.dumps(rec, ensure_ascii=False))
+
+    def _gen(self):
+        row = self.store.db.execute("SELECT value FROM meta WHERE key=?", (self._gen_key,)).fetchone()
+        return int(row[0]) if row else 0
+
+    @contextmanager
+    def _writing(self):
+        """One change to the table, in a transaction that also bumps its generation."""
+        with self.store.batch():
+            before = self._gen()
+            yield
+            self.store.db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (self._gen_key, str(before + 1)))
+            self.store._gens[self.kind] = before + 1
+            # someone else wrote since we loaded: our index misses that, reload it next time
+            self._seen = before + 1 if before == self._seen else None
+
+    def stale(self):
+        """True if another process changed the table since our index loaded it."""
+        return self._seen is None or self.store.generation(self.kind) != self._seen
+
+    def count(self):
+        with self.store._lock:
+            return self.store.db.execute(f"SELECT COUNT(*) FROM {self.kind}").fetchone()[0]
+
+    def _rows(self):
+        with self.store._lock:
+            return self.store.db.execute(f"SELECT data, pos FROM {self.kind} ORDER BY pos").fetchall()
+
+    def load(self):
+        """Every record, in list order, for building (or rebuilding) the RecordIndex."""
+        with self.store.batch():        # rows and generation from one snapshot
+            self._seen = self._gen()
+            return [json.loads(r[0]) for r in self._rows()]
+
+    # ---- RecordIndex sink ----
+    def put(self, rec):
+        with self._writing():
+            self.store.db.execute(self._upsert, self._row(rec))
+
+    def remove(self, rid):
+        with self._writing():
+            self.store.db.execute(f"DELETE FROM {self.kind} WHERE id=?", (rid,))
+
+    def replace(self, records):
+        """Rewrite the whole table (import/replace, id renames) in one transaction."""
+        with self._writing():
+            db = self.store.db
+            db.execute(f"DELETE FROM {self.kind}")
+            db.executemany(self._insert, ((r["id"], i, *self._row(r)[1:]) for i, r in enumerate(records)))
+
+    def export(self):
+        """The table as the JSON list the old index files held."""
+        return json.dumps([json.loads(r[0]) for r in self._rows()], indent=2, ensure_ascii=False).encode("utf-8")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 4 or sys.argv[1] not in ("migrate", "export") or sys.argv[3] not in KINDS:
+        sys.exit(__doc__.split("\n\n")[-1])
+    cmd, db_path, kind = sys.argv[1:4]
+    store = MetaStore(db_path)
+    if cmd == "migrate":
+        print(f"[METASTORE] imported {store.migrate_json(kind, sys.argv[4])} {kind} records")
+    else:
+        sys.stdout.buffer.write(store.table(kind).export())
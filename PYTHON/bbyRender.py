@@ -0,0 +1,133 @@
+"""PNG renderings of the paint canvas.
+
+`CanvasPNG` encodes a canvas snapshot (see bbyTiles.CanvasView) at an integer
+scale, nearest-neighbour so pixels stay crisp, and keeps the last few results
+in an LRU keyed on (canvas instance, version, scale): every bot or embed
+polling an unchanged canvas shares one encode, and a paint simply moves the
+version on.  Snapshots use the same renderer, so an autosnap has a PNG too.
+
+Pillow does the scaling and encoding when it is installed; without it a
+small zlib encoder writes the PNG directly.  `encode_animation()` turns
+timeline frames into an animated PNG or GIF (Pillow only).
+
+    python bbyRender.py     # encode times, cold vs. cached
+"""
+import io, struct, threading, zlib
+from collections import OrderedDict
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+
+def _chunk(kind, data):
+    return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+
+def encode_png(rgba, w, h, scale=1):
+    """RGBA bytes (row-major, w*h*4) -> PNG bytes, each pixel `scale` x `scale`."""
+    if Image is not None:
+        img = Image.frombuffer("RGBA", (w, h), bytes(rgba), "raw", "RGBA", 0, 1)
+        if scale > 1:
+            img = img.resize((w * scale, h * scale), Image.Resampling.NEAREST)
+        out = io.BytesIO()
+        img.save(out, format="PNG")
+        return out.getvalue()
+    rows = []
+    stride = w * 4
+    for y in range(h):
+        row = bytes(rgba[y * stride:(y + 1) * stride])
+        if scale > 1:
+            row = b"".join(row[i:i + 4] * scale for i in range(0, stride, 4))
+        rows.extend([b"\0" + row] * scale)       # filter type 0 per scanline
+    return (b"\x89PNG\r\n\x1a\n"
+            + _chunk(b"IHDR", struct.pack(">IIBBBBB", w * scale, h * scale, 8, 6, 0, 0, 0))
+            + _chunk(b"IDAT", zlib.compress(b"".join(rows), 6))
+            + _chunk(b"IEND", b""))
+
+
+def encode_animation(frames, scale=1, fps=8, fmt="apng"):
+    """[(rgba, w, h)] -> looping animated PNG ("apng") or GIF bytes.  Frames
+    smaller than the largest (a resized canvas) sit in its top-left corner.
+    Frames are upscaled one at a time as the encoder asks for them.  Needs
+    Pillow."""
+    if Image is None:
+        raise RuntimeError("Pillow is required for animations")
+    w, h = max(f[1] for f in frames), max(f[2] for f in frames)
+
+    def image(rgba, fw, fh):
+        img = Image.frombuffer("RGBA", (fw, fh), bytes(rgba), "raw", "RGBA", 0, 1)
+        if (fw, fh) != (w, h):
+            full = Image.new("RGBA", (w, h), (0, 0, 0, 0))
+            full.paste(img, (0, 0))
+            img = full
+        if scale > 1:
+            img = img.resize((w * scale, h * scale), Image.Resampling.NEAREST)
+        return img
+
+    class Rest:                     # re-iterable: Pillow's APNG writer walks append_images twice
+        def __iter__(self):
+            return (image(*f) for f in frames[1:])
+
+    out = io.BytesIO()
+    opts = dict(save_all=True, append_images=Rest(),
+                duration=max(1, int(1000 / fps)), loop=0)
+    if fmt == "gif":
+        image(*frames[0]).save(out, format="GIF", disposal=2, **opts)
+    else:
+        image(*frames[0]).save(out, format="PNG", **opts)
+    return out.getvalue()
+
+
+class CanvasPNG:
+    def __init__(self, view, width, height, instance, max_entries=16, max_edge=4096):
+        self.view = view                # CanvasView: .current() -> snapshot with .seq and .rgba()
+        self.width = width
+        self.height = height
+        self.instance = instance        # () -> canvas instance id, part of the key
+        self.max_entries = max_entries
+        self.max_scale = max(1, max_edge // max(width, height))
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()     # (instance, version, scale) -> png bytes
+        self.hits = self.misses = 0
+
+    def render(self, snap, scale=1):
+        """PNG of `snap` at `scale` (1..max_scale), from the cache if it's there."""
+        if not 1 <= scale <= self.max_scale:
+            raise ValueError(f"scale must be 1..{self.max_scale}")
+        key = (self.instance(), snap.seq, scale)
+        with self._lock:
+            png = self._cache.get(key)
+            if png is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return png
+            self.misses += 1
+        png = encode_png(snap.rgba(), self.width, self.height, scale)   # outside the lock; a racing duplicate is harmless
+        with self._lock:
+            self._cache[key] = png
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+        return png
+
+    def get(self, scale=1):
+        """(version, png) for the current canvas."""
+        snap = self.view.current()
+        return snap.seq, self.render(snap, scale)
+
+
+if __name__ == "__main__":
+    import os, random, tempfile, time
+    from bbyTiles import TileTable, CanvasView
+    for side in (64, 512):
+        tiles = TileTable(os.path.join(tempfile.mkdtemp(), "tiles"), side, side)
+        rgba = bytearray(random.Random(1).randbytes(side * side * 4))
+        view = CanvasView(tiles, rgba, threading.Lock(), lambda: 1)
+        r = CanvasPNG(view, side, side, lambda: 0)
+        for scale in (1, min(8, r.max_scale)):
+            t0 = time.perf_counter(); _, png = r.get(scale); cold = time.perf_counter() - t0
+            t0 = time.perf_counter(); r.get(scale); warm = time.perf_counter() - t0
+            print(f"[RENDER] {side}x{side} x{scale}: {len(png) // 1024} KB, encode {cold * 1000:.1f} ms, "
+                  f"cached {warm * 1e6:.0f} us ({'Pillow' if Image else 'zlib'})")
@@ -1,16 +1,36 @@
-from flask import Flask, jsonify, request, send_from_directory
+from flask import Flask, Response, jsonify, request, send_from_directory
 from flask_cors import CORS
 from werkzeug.middleware.proxy_fix import ProxyFix
-import os, json, time, uuid, base64, threading, array, random, re, io
+import os, json, time, uuid, base64, threading, array, random, re, zlib, struct
 import hashlib
 from collections import deque
-from colorsys import rgb_to_hsv
+from contextlib import nullcontext
 import requests
 from urllib.parse import unquote
 try:
     from PIL import Image
 except Exception:
     Image = None
+from bbyAging import PixelAger
+from bbyUsers import UserStore
+from bbyBackups import BackupManager
+from bbyJournal import PaintJournal
+from bbyEvents import PaintEventLog, PIXEL, unpack_pixels
+from bbyStream import ChangeNotifier, ClientSlots, SlotStream, sse
+from bbyJobs import BrainJobQueue
+from bbyBrain import BrainClient
+from bbyCache import SWRCache
+from bbyGallery import GalleryListing
+from bbyIndex import RecordIndex
+from bbyMetaStore import MetaStore
+from bbyImages import ImagePipeline, sniff as _sniff_image
+from bbyBlobs import BlobStore
+from bbyCanvas import PaintCanvasFile, ProcessLock, try_exclusive, attach as attach_canvas
+from bbyTiles import TileTable, CanvasView
+from bbyWriter import BatchWriter
+import bbyShapes
+from bbyRender import CanvasPNG, encode_animation, encode_png
+from bbyTimeline import Timeline
 
 # ========= CONFIG =========
 LLM_SERVER_URL = os.environ.get("LLM_SERVER_URL", "").strip()
@@ -19,13 +39,25 @@ if not LLM_SERVER_URL:
     print("This server cannot function without knowing where the brain server is.")
     print("Please set it and restart.\n")
 PORT = int(os.environ.get("BBY_PORT", "8420"))
-PAINT_W, PAINT_H = 64, 64
+# canvas size; changing it carries the existing pixels over into the top-left corner
+PAINT_W = int(os.environ.get("BBY_CANVAS_W", "64"))
+PAINT_H = int(os.environ.get("BBY_CANVAS_H", "64"))
+PAINT_TILE = 64                 # tile edge for dirty tracking, flushing and viewport fetches
+LEGACY_PAINT_W = LEGACY_PAINT_H = 64    # size of the pre-mmap .raw buffers
 MAX_UPLOAD_MB = 8
 FADE_TICK_SECONDS = 60          # how often the fade loop runs
 AUTOSNAP_IDLE_AFTER = 60        # seconds after last paint to autosnap if a burst was active
 BURST_WINDOW = 30               # seconds to count burst
 BURST_THRESHOLD_PX = 200        # pixels in window to mark a burst
 STATE_SYNC_HZ = 10.0            # pull remote /api/state this many times per second (if available)
+# how babyState follows the brain:
+#   "poll"     - conditional GET at STATE_SYNC_HZ (304s when the brain sends ETags)
+#   "longpoll" - GET ?wait=N; the brain holds it until something changes (falls back to poll pacing if it answers at once)
+#   "push"     - the brain POSTs changes to /api/state/push; a slow conditional poll reconciles missed pushes
+STATE_SYNC_MODE = os.environ.get("BBY_STATE_SYNC", "poll").strip().lower()
+STATE_LONGPOLL_SECONDS = 25
+STATE_PUSH_RECONCILE_SECONDS = 30
+BRAIN_PUSH_TOKEN = os.environ.get("BRAIN_PUSH_TOKEN", "").strip()
 # ====== FADE PROBABILITIES (tuned) ======
 P_SHORT  = 0.001    # ~0.1%
 P_MEDIUM = 0.899    # ~89.9%
@@ -36,6 +68,39 @@ STROKE_COHERENCE = True
 COHERENCE_JITTER = 0.12
 REPAINT_REFRESHES_LIFE = True   # repaint with a>0 refreshes lifespan
 REPAINT_POLICY = "diff_color_refresh"  # "always" | "never" | "diff_color_refresh"
+# ====== PAINT JOURNAL ======
+PAINT_JOURNAL_FSYNC = os.environ.get("BBY_JOURNAL_FSYNC", "interval").strip().lower()  # "always" | "interval" | "never"
+PAINT_JOURNAL_FSYNC_SECONDS = 1.0   # fsync cadence for "interval"
+PAINT_JOURNAL_COMMIT_MS = 5         # group-commit window
+PAINT_COMPACT_BYTES = 4 * 1024 * 1024   # fold the journal into the .raw buffers past this size...
+PAINT_COMPACT_SECONDS = 10 * 60         # ...or this age
+# ====== PAINT EVENTS ======
+PAINT_BATCH_MS = int(os.environ.get("BBY_PAINT_BATCH_MS", "3"))  # paint requests arriving this close share one apply; 0 = apply each inline
+PAINT_OPS_MAX = 256                # drawing ops per /api/paint_pixel request (see bbyShapes)
+PAINT_OPS_MAX_PIXELS = 65536       # pixels one request's ops may expand to, fills included
+PAINT_BRUSH_MAX = 32               # widest line brush
+CANVAS_PNG_CACHE = 16              # rendered canvas PNGs kept, keyed on (version, scale)
+CANVAS_PNG_MAX_EDGE = 4096         # largest rendered side in pixels; caps ?scale=
+SNAPSHOT_PNG_SCALE = 8             # snapshot PNGs are rendered this much larger (within the cap)
+TIMELINE_STEP_SECONDS = 10         # paint events are folded into a timeline delta this often
+TIMELINE_KEYFRAME_EVERY = 60       # deltas per keyframe (10 min at the step above)...
+TIMELINE_KEYFRAME_CANVASES = 4     # ...or sooner once the deltas hold this many canvases' worth of pixels
+TIMELINE_KEEP_DAYS = 30
+TIMELINE_MAX_FRAMES = 240          # frames per /api/timeline/frames or export request
+TIMELINE_EXPORT_MAX_PIXELS = 64 * 1024 * 1024     # frames x scaled width x scaled height per export
+FOREIGN_PAINT_POLL_SECONDS = 0.5  # how often to look for other workers' paints to relay to this worker's clients
+PAINT_EVENTS_MAX = 2000             # events kept for /api/paint_events cursors
+PAINT_EVENTS_MERGE_AFTER = 16       # a client further behind than this gets one coalesced event...
+PAINT_EVENTS_RESYNC_FRAC = 0.25     # ...or the full canvas once the merge would touch this much of it
+# ====== PUSH STREAM (/api/stream) ======
+STREAM_MAX_CLIENTS = int(os.environ.get("BBY_STREAM_MAX_CLIENTS", "64"))  # 0 = unlimited (run under gevent for that)
+STREAM_HEARTBEAT_SECONDS = 15
+SAY_WORKERS = int(os.environ.get("BBY_SAY_WORKERS", "2"))   # concurrent brain /api/say calls
+SAY_QUEUE_MAX = 100          # queued chat messages before /api/say starts answering 503
+SAY_JOB_KEEP_SECONDS = 300   # finished jobs stay pollable this long
+SAY_SYNC_WAIT = 185          # non-async callers wait this long for their reply (slightly longer than brain timeout)
+IMAGE_WORKERS = int(os.environ.get("BBY_IMAGE_WORKERS", "2"))   # processes cropping/stamping gallery uploads
+IMAGE_FILE_WAIT = 10         # /api/gallery/file/<pending image> waits this long for processing
 
 # Guest handling for non‑opted‑in external users
 # 'pooled'  -> all guests per platform share a single UID (e.g., 'discord:guest')
@@ -59,35 +124,53 @@ os.makedirs(STORE_DIR, exist_ok=True)
 os.makedirs(SNAP_DIR,  exist_ok=True)
 os.makedirs(GALL_DIR,  exist_ok=True)
 
+# crop/stamp/colour for uploads run in worker processes; entries stay "pending" until done.
+# Built first: its workers are forked now, before any thread or lock file exists.
+image_pipeline = ImagePipeline(os.path.join(GALL_DIR, "pending"), lambda *a: _finish_gallery_image(*a),
+                               workers=IMAGE_WORKERS)
+
+# snapshot rasters and gallery PNGs are hard links into this content-addressed store (bbyBlobs)
+blobs = BlobStore(os.path.join(STORE_DIR, "blobs"))
+
 SNAP_IDX  = os.path.join(SNAP_DIR, "index.json")
 GALL_IDX  = os.path.join(GALL_DIR, "index.json")
 CHAT_FILE = os.path.join(STORE_DIR, "chatHistory.json")
 
+# --- BACKUPS of the critical JSON files (see bbyBackups) ---
+BACKUP_MIN_INTERVAL = 600    # at most one backup per file per 10 min
+BACKUP_KEEP         = 48     # newest N backups kept per file...
+BACKUP_MAX_AGE_DAYS = 14     # ...and none older than this
+BACKUP_GZIP         = True
+
+backups = BackupManager(min_interval=BACKUP_MIN_INTERVAL, keep=BACKUP_KEEP,
+                        max_age_days=BACKUP_MAX_AGE_DAYS, compress=BACKUP_GZIP)
+backups.start()
+
 # --- USER DATABASE ---
 USERS_FILE = os.path.join(STORE_DIR, "users.json")
 
-def _load_users():
-    try:
-        with open(USERS_FILE, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except Exception:
-        return {}
+USERS_FLUSH_DELAY = 2.0      # debounce before dirty user records hit users.log
+USERS_COMPACT_LINES = 2000   # fold users.log back into users.json past this many records...
+USERS_COMPACT_SECONDS = 600  # ...or this long after the last compaction
 
-def _save_users(users: dict):
-    tmp = USERS_FILE + ".tmp"
-    with open(tmp, "w", encoding="utf-8") as f:
-        json.dump(users, f, indent=2)
-    os.replace(tmp, USERS_FILE)
+user_store = UserStore(USERS_FILE, flush_delay=USERS_FLUSH_DELAY,
+                       compact_lines=USERS_COMPACT_LINES, compact_seconds=USERS_COMPACT_SECONDS,
+                       on_compact=backups.request)
+user_store.start()
 
-def _reload_users_from_disk():
-    """Refresh in-memory `users` from the on-disk users.json.
-    Useful when aliases or edits were made externally (e.g., via a script)."""
-    global users
+def _save_users(*uids: str):
+    """Queue the given user records for the next write-behind flush."""
+    user_store.mark_dirty(*uids)
+
+def _reload_users_from_disk(force: bool = False):
+    """Refresh in-memory `users` from users.json (+ log) if either changed on disk,
+    e.g. aliases added by an external script or records written by another worker.
+    Costs a stat per call unless something changed; `force` always reloads."""
     try:
-        on_disk = _load_users()
-        if isinstance(on_disk, dict):
-            users.clear()
-            users.update(on_disk)
+        if force:
+            user_store.load()
+        else:
+            user_store.reload_if_changed()
     except Exception as e:
         print("[WARN] could not reload users:", e)
 
@@ -97,7 +180,7 @@ def _slug(s: str) -> str:
     except Exception:
         return ""
 
-users = _load_users()
+users = user_store.users   # live dict; reloads update it in place
 
 def _mk_uid(platform: str, user_id: str, fallback_author: str = "anon") -> str:
     """Create a stable UID like 'web:abc123' or 'discord:123456'.
@@ -109,26 +192,27 @@ def _mk_uid(platform: str, user_id: str, fallback_author: str = "anon") -> str:
 
 def _upsert_user(platform: str, user_id: str, handle: str = None, display_name: str = None, colour: dict | None = None):
     uid = _mk_uid(platform, user_id, display_name or handle)
-    rec = users.get(uid, {
-        "platform": platform,
-        "user_id": user_id,
-        "handle": None,
-        "display_name": None,
-        "nicknames": [],
-        "colour": None,
-        "last_seen": 0,
-        "message_count": 0,
-        "loyalty": 1,
-        "inventory": {},
-        "favourites": []
-    })
-    if handle: rec["handle"] = handle
-    if display_name: rec["display_name"] = display_name
-    if isinstance(colour, dict): rec["colour"] = colour
-    rec["last_seen"] = time.time()
-    rec["message_count"] = float(rec.get("message_count", 0)) + 1.0
-    users[uid] = rec
-    _save_users(users)
+    with user_store.lock:
+        rec = users.get(uid, {
+            "platform": platform,
+            "user_id": user_id,
+            "handle": None,
+            "display_name": None,
+            "nicknames": [],
+            "colour": None,
+            "last_seen": 0,
+            "message_count": 0,
+            "loyalty": 1,
+            "inventory": {},
+            "favourites": []
+        })
+        if handle: rec["handle"] = handle
+        if display_name: rec["display_name"] = display_name
+        if isinstance(colour, dict): rec["colour"] = colour
+        rec["last_seen"] = time.time()
+        rec["message_count"] = float(rec.get("message_count", 0)) + 1.0
+        users[uid] = rec
+        _save_users(uid)
     return uid
 
 # --- Consent + guest helpers ---
@@ -160,7 +244,16 @@ PAINT_STATE_FILE    = os.path.join(STORE_DIR, "paintState.raw")
 PAINT_TS_FILE       = os.path.join(STORE_DIR, "paintTimestamps.raw")
 PAINT_LIFE_FILE     = os.path.join(STORE_DIR, "paintLifespans.raw")
 PAINT_ALPHA0_FILE   = os.path.join(STORE_DIR, "paintAlpha0.raw")
+PAINT_CANVAS_FILE   = os.path.join(STORE_DIR, "paintCanvas.mmap")   # shared by all workers; the .raw files are only imported once
+PAINT_LOCK_FILE     = PAINT_CANVAS_FILE + ".lock"
+PAINT_ATTACH_FILE   = PAINT_CANVAS_FILE + ".attach"
+PAINT_AGING_FILE    = PAINT_CANVAS_FILE + ".aging"
+PAINT_TILES_FILE    = os.path.join(STORE_DIR, "paintTiles.mmap")     # per-tile versions, shared like the canvas
+TIMELINE_DIR        = os.path.join(STORE_DIR, "timeline")
+TIMELINE_LEADER_FILE = os.path.join(TIMELINE_DIR, ".record.lock")    # one worker records the timeline
 BBYBOOK_LOCAL       = os.path.join(STORE_DIR, "bbybook.json")
+BBYBOOK_TTL         = 60        # seconds a fetched bbybook counts as fresh
+BBYBOOK_ERROR_TTL   = 10        # after a failed refresh, keep serving the old copy this long before retrying
 GALLERY_ADMIN_TOKEN = os.environ.get("GALLERY_ADMIN_TOKEN", "").strip()
 
 # Prefer proxy-provided scheme/host when building absolute URLs
@@ -172,24 +265,35 @@ def _get_base_url():
     return f"{proto}://{host}".rstrip("/")
 
 # === Brain (local Mac) proxy helpers ===
-def _brain_url(path: str) -> str:
-    base = (LLM_SERVER_URL or '').rstrip('/')
-    path = '/' + path.lstrip('/')
-    return base + path
-
-def _brain_post(path: str, payload: dict, timeout=15):
+# All brain traffic goes through one pooled keep-alive client (see bbyBrain).
+# (timeout seconds, retries) per endpoint; anything else gets BRAIN_DEFAULT.
+BRAIN_ENDPOINTS = {
+    "GET /api/state":   (2, 0),     # polled at STATE_SYNC_HZ; the next poll is the retry
+    "POST /api/state":  (5, 1),
+    "POST /api/say":    (185, 0),   # slightly longer than brain timeout
+    "GET /api/bbybook": (5, 1),
+}
+BRAIN_DEFAULT = (15, 0)
+BRAIN_POOL_SIZE = 16
+BRAIN_BREAKER_FAILURES = 5       # consecutive transport errors before failing fast...
+BRAIN_BREAKER_RESET = 10.0       # ...for this long, then one trial call
+BRAIN_OWN_BREAKER = ("POST /api/say",)   # slow calls whose timeouts must not trip the shared breaker
+
+brain = BrainClient(LLM_SERVER_URL, endpoints=BRAIN_ENDPOINTS, default=BRAIN_DEFAULT,
+                    pool_size=BRAIN_POOL_SIZE, breaker_failures=BRAIN_BREAKER_FAILURES,
+                    breaker_reset=BRAIN_BREAKER_RESET, own_breaker=BRAIN_OWN_BREAKER)
+
+def _brain_post(path: str, payload: dict, timeout=None):
     try:
-        url = _brain_url(path)
-        r = requests.post(url, json=payload, timeout=timeout)
+        r = brain.post(path, json=payload, timeout=timeout)
         r.raise_for_status()
         return r.json()
     except Exception as e:
         return {"error": f"brain post failed: {e}"}
 
-def _brain_get(path: str, timeout=10):
+def _brain_get(path: str, timeout=None):
     try:
-        url = _brain_url(path)
-        r = requests.get(url, timeout=timeout)
+        r = brain.get(path, timeout=timeout)
         r.raise_for_status()
         return r.json()
     except Exception as e:
@@ -205,26 +309,16 @@ def _load_json(path, default):
 
 def _save_json(path, data):
     """
-    Atomically save JSON and, if it's one of our critical indexes, write a timestamped backup.
+    Atomically save JSON and, if it's one of our critical indexes, queue a backup.
     """
     tmp = path + ".tmp"
     with open(tmp, "w", encoding="utf-8") as f:
         json.dump(data, f, indent=2, ensure_ascii=False)
     os.replace(tmp, path)
 
-    # Write a timestamped backup for critical files
-    try:
-        critical = {GALL_IDX, SNAP_IDX, USERS_FILE, CHAT_FILE}
-        if path in critical:
-            backup_dir = os.path.join(os.path.dirname(path), "backups")
-            os.makedirs(backup_dir, exist_ok=True)
-            stamp = time.strftime("%Y%m%d-%H%M%S", time.gmtime())
-            base = os.path.basename(path)
-            backup_path = os.path.join(backup_dir, f"{base}.{stamp}.json")
-            with open(backup_path, "w", encoding="utf-8") as f:
-                json.dump(data, f, indent=2, ensure_ascii=False)
-    except Exception as e:
-        print("[WARN] could not write backup for", path, "->", e)
+    # backups are copied off the request path, at most once per BACKUP_MIN_INTERVAL
+    if path in {GALL_IDX, SNAP_IDX, USERS_FILE, CHAT_FILE}:
+        backups.request(path)
 
 def _b64_to_bytes(s: str) -> bytes:
     m = re.match(r'^data:image/\w+;base64,(.+)$', s, re.I)
@@ -249,47 +343,209 @@ def _split_linger_fade(total_seconds: float):
 
 # ========= RUNTIME STATE =========
 state_lock = threading.Lock()
-paint_lock = threading.Lock()
-events_lock = threading.Lock()
+paint_lock = ProcessLock(PAINT_LOCK_FILE)   # also excludes other worker processes
 activity_lock = threading.Lock()
 chat_lock = threading.Lock()
 
-snapshot_index = _load_json(SNAP_IDX, [])
-gallery_index  = _load_json(GALL_IDX, [])
-chat_history   = _load_json(CHAT_FILE, [])
+# Metadata backend: "sqlite" writes each index change as one row (bbyMetaStore),
+# "json" rewrites index.json / chatHistory.json whole on every save.
+METADATA_BACKEND = os.environ.get("BBY_METADATA", "sqlite").strip().lower()
+METADATA_DB = os.path.join(STORE_DIR, "bby.sqlite3")
+meta_store = None
+if METADATA_BACKEND == "sqlite":
+    meta_store = MetaStore(METADATA_DB)
+    for _kind, _path in (("gallery", GALL_IDX), ("snapshots", SNAP_IDX), ("chat", CHAT_FILE)):
+        _n = meta_store.migrate_json(_kind, _path)     # one-shot, first start only
+        if _n: print(f"[METASTORE] migrated {_n} {_kind} records from {_path}")
+        backups.register(_path, meta_store.table(_kind).export)   # backups stay importable JSON
+
+def _load_index(kind: str, path: str, **kw) -> RecordIndex:
+    if meta_store:
+        table = meta_store.table(kind)
+        return RecordIndex(table.load(), sink=table, **kw)
+    return RecordIndex(_load_json(path, []), **kw)
+
+def _save_index(path: str, index: RecordIndex):
+    """With SQLite the rows are already written, so just queue a backup;
+    with the JSON backend rewrite the file."""
+    if meta_store:
+        backups.request(path)
+    else:
+        _save_json(path, index.to_list())
+
+# id/file lookups, deletes and trimming are O(1) (see bbyIndex)
+snapshot_index = _load_index("snapshots", SNAP_IDX, flags=("has_png",))
+gallery_index  = _load_index("gallery", GALL_IDX, unique=("file",))
+gallery_listing = GalleryListing(lambda: gallery_index,   # paginated /api/gallery views; invalidated on every save...
+                                 generation=lambda: gallery_index.sync())   # ...and when another worker's writes are loaded
+chat_history   = _load_index("chat", CHAT_FILE)
 
 # This is a *cached* copy of the state from the brain server.
 babyState = { "eyes": 5, "mouth": 1, "isSpeaking": False, "R": 133, "G": 239, "B": 238 }
+state_version = 0   # bumped (under state_lock) whenever babyState actually changes
+_state_epoch = uuid.uuid4().hex[:8]   # keeps ETags from an earlier process from matching
+
+# Wakes /api/stream clients on any paint event or state change
+stream_notifier = ChangeNotifier()
+stream_slots = ClientSlots(STREAM_MAX_CLIENTS)
 
 PIX_COUNT = PAINT_W * PAINT_H
-paint_rgba   = bytearray(PIX_COUNT * 4)
-paint_ts     = array.array('L', [0] * PIX_COUNT)
-paint_life   = array.array('f', [0.0] * (PIX_COUNT * 2))
-paint_alpha0 = array.array('B', [0] * PIX_COUNT)
-
-try:  # Load persisted paint buffers
-    if os.path.exists(PAINT_STATE_FILE):
-        with open(PAINT_STATE_FILE, "rb") as f:
-            paint_rgba[:] = f.read(PIX_COUNT * 4)
-    if os.path.exists(PAINT_TS_FILE):
-        with open(PAINT_TS_FILE, "rb") as f:
-            arr = array.array('L')
-            arr.fromfile(f, PIX_COUNT)
-            paint_ts = arr
-    if os.path.exists(PAINT_LIFE_FILE):
-        with open(PAINT_LIFE_FILE, "rb") as f:
-            arr = array.array('f')
-            arr.fromfile(f, PIX_COUNT * 2)
-            paint_life = arr
-    if os.path.exists(PAINT_ALPHA0_FILE):
-        with open(PAINT_ALPHA0_FILE, "rb") as f:
-            arr = array.array('B')
-            arr.fromfile(f, PIX_COUNT)
-            paint_alpha0 = arr
-except Exception as e:
-    print("[WARN] could not load paint buffers:", e)
-
-paint_events = deque(maxlen=2000)
+paint_canvas = PaintCanvasFile(PAINT_CANVAS_FILE, PAINT_W, PAINT_H)
+paint_rgba   = paint_canvas.rgba
+paint_ts     = paint_canvas.ts
+paint_life   = paint_canvas.life
+paint_alpha0 = paint_canvas.alpha0
+paint_tiles  = TileTable(PAINT_TILES_FILE, PAINT_W, PAINT_H, PAINT_TILE)
+
+def _import_raw_buffers():
+    """One-off import of the pre-mmap .raw files (always 64x64) into the top-left
+    corner of a freshly created canvas."""
+    n = LEGACY_PAINT_W * LEGACY_PAINT_H
+    w, h = min(PAINT_W, LEGACY_PAINT_W), min(PAINT_H, LEGACY_PAINT_H)
+    try:
+        for path, code, per_px, dst in ((PAINT_STATE_FILE, 'B', 4, paint_rgba),
+                                        (PAINT_TS_FILE, 'L', 1, paint_ts),
+                                        (PAINT_LIFE_FILE, 'f', 2, paint_life),
+                                        (PAINT_ALPHA0_FILE, 'B', 1, paint_alpha0)):
+            if not os.path.exists(path):
+                continue
+            with open(path, "rb") as f:
+                arr = array.array(code)
+                try:
+                    arr.fromfile(f, n * per_px)
+                except EOFError:
+                    pass    # short file: keep what was read
+            for y in range(h):
+                for i in range(y * LEGACY_PAINT_W * per_px, (y * LEGACY_PAINT_W + w) * per_px):
+                    if i >= len(arr): break
+                    dst[i + y * (PAINT_W - LEGACY_PAINT_W) * per_px] = arr[i]
+        print("[CANVAS] imported legacy .raw paint buffers")
+    except Exception as e:
+        print("[WARN] could not load paint buffers:", e)
+
+def _apply_journal_record(idx, r, g, b, a, ts, start_fade, end_fade, alpha0):
+    paint_canvas.apply_record(idx, r, g, b, a, ts, start_fade, end_fade, alpha0)
+
+def _journal_record(idx):
+    off = idx*4
+    return (idx, paint_rgba[off], paint_rgba[off+1], paint_rgba[off+2], paint_rgba[off+3],
+            paint_ts[idx], paint_life[idx*2], paint_life[idx*2+1], paint_alpha0[idx])
+
+def _compact_paint_journal():
+    """Flush the dirty tiles of the mapped canvas to disk and drop the journal
+    segments they now cover."""
+    with paint_lock:
+        seg, ticket = paint_journal.rotate()
+        cut = paint_canvas.write_seq
+        dirty = paint_tiles.changed_since(paint_canvas.flushed_seq)
+    paint_journal.wait(ticket, timeout=30)
+    paint_canvas.flush_rows(paint_tiles.bands(dirty))
+    with paint_lock:
+        paint_canvas.mark_flushed(cut)
+    paint_journal.drop_segments_before(seg)
+
+paint_journal = PaintJournal(STORE_DIR, fsync=PAINT_JOURNAL_FSYNC, fsync_seconds=PAINT_JOURNAL_FSYNC_SECONDS,
+                             commit_ms=PAINT_JOURNAL_COMMIT_MS, seq_source=paint_canvas.next_seq)
+
+def _recover_paint_canvas():
+    """Runs in the first worker to attach: import legacy buffers into a new
+    mapping, replay journal frames newer than the last flush, then clear the journal."""
+    with paint_lock:
+        # the journal's pixel indices belong to whichever canvas wrote it
+        target = paint_canvas
+        if paint_canvas.resized_from:
+            try:
+                target = PaintCanvasFile.open_existing(paint_canvas.resized_from)
+            except Exception as e:
+                print("[WARN] could not open the previous canvas to carry it over:", e)
+                target = None
+        elif paint_canvas.created:
+            _import_raw_buffers()
+        try:
+            if target is not None:
+                replayed, upto = paint_journal.replay(target.apply_record, min_seq=target.flushed_seq)
+                if replayed:
+                    print(f"[JOURNAL] replayed {replayed} pixel records")
+                paint_canvas.advance_seq(upto)
+        except Exception as e:
+            print("[WARN] could not replay paint journal:", e)
+        if target not in (None, paint_canvas):
+            paint_canvas.copy_from(target)
+            print(f"[CANVAS] carried the {target.width}x{target.height} canvas over to {PAINT_W}x{PAINT_H}")
+        paint_canvas.flush()
+        paint_canvas.mark_flushed(paint_canvas.write_seq)
+        paint_journal.drop_all()
+        if paint_tiles.created or paint_canvas.created:
+            paint_tiles.mark_all(paint_canvas.write_seq)
+
+_paint_attach_fd, _ = attach_canvas(PAINT_ATTACH_FILE, _recover_paint_canvas)
+paint_journal.start()
+
+# Fade schedule over the buffers above; guarded by paint_lock like the buffers themselves
+paint_ager = PixelAger(paint_rgba, paint_ts, paint_life, paint_alpha0, PAINT_W, grid=paint_tiles)
+paint_ager.rebuild()
+
+# Immutable per-tile copy of the canvas, republished under paint_lock after each write; readers don't lock
+paint_view = CanvasView(paint_tiles, paint_rgba, paint_lock, lambda: paint_canvas.write_seq, lambda: paint_events.head_id())
+# Appended under paint_lock so event order matches apply order.  Cursors are the shared
+# canvas instance + write_seq, so any worker can serve a cursor another one handed out
+with paint_lock:
+    paint_events = PaintEventLog(maxlen=PAINT_EVENTS_MAX, epoch=f"{paint_canvas.instance:x}", base=paint_canvas.write_seq)
+    _events_base = paint_view.refresh()     # canvas snapshot this process's event log accounts for
+
+def _tile_diff(t, old, new):
+    """Packed PIXEL records for the pixels of tile `t` that differ between two copies of it."""
+    x, y, w, _ = paint_tiles.rect(t)
+    out = bytearray()
+    for k in range(0, len(new), 4):
+        if old[k:k+4] != new[k:k+4]:
+            p = k // 4
+            out += PIXEL.pack((y + p // w) * PAINT_W + x + p % w, *new[k:k+4])
+    return out
+
+def _sync_foreign_paints_locked():
+    """Under paint_lock: if other workers moved the canvas past what our event
+    log covers, log the pixels they changed (in the tiles they marked) as one
+    event, so this worker's poll and stream clients see them.  Returns True if
+    it logged anything."""
+    global _events_base
+    base = _events_base
+    if base.seq == paint_canvas.write_seq:
+        return False
+    snap = paint_view.refresh()
+    changed = bytearray()
+    for t, (v, ov) in enumerate(zip(snap.versions, base.versions)):
+        if v != ov and snap.tiles[t] != base.tiles[t]:
+            changed += _tile_diff(t, base.tiles[t], snap.tiles[t])
+    if changed:
+        paint_events.append(changed, seq=snap.seq)
+        snap = paint_view.refresh()     # same pixels, tag now past the new event
+    else:
+        paint_events.advance(snap.seq)
+    _events_base = snap
+    return bool(changed)
+
+def _sync_foreign_paints():
+    if _events_base.seq == paint_canvas.write_seq:
+        return      # the common case: one int compare, no lock
+    with paint_lock:
+        relayed = _sync_foreign_paints_locked()
+    if relayed:
+        stream_notifier.bump()
+
+def foreign_paint_loop():
+    while True:
+        try:
+            _sync_foreign_paints()
+        except Exception as e:
+            print("[ERROR] foreign paint relay:", e)
+        time.sleep(FOREIGN_PAINT_POLL_SECONDS)
+
+canvas_png = CanvasPNG(paint_view, PAINT_W, PAINT_H, lambda: paint_canvas.instance,
+                       max_entries=CANVAS_PNG_CACHE, max_edge=CANVAS_PNG_MAX_EDGE)
+# Keyframe + delta history of the canvas, fed from paint_events by timeline_loop
+timeline = Timeline(TIMELINE_DIR, keyframe_every=TIMELINE_KEYFRAME_EVERY,
+                    keyframe_pixels=TIMELINE_KEYFRAME_CANVASES * PIX_COUNT, keep_days=TIMELINE_KEEP_DAYS)
 recent_paints = deque()
 last_paint_ts = 0.0
 burst_active = False
@@ -298,161 +554,160 @@ last_autosnap_ts = 0.0
 last_autosnap_id = None
 
 # ========= SNAPSHOTS/GALLERY HELPERS =========
-def _save_snapshot(label=""):
+def _save_snapshot(label="", render_png=True):
+    """Save the canvas and state; with render_png the canvas PNG is rendered
+    here too (callers with a client composite attach that instead)."""
     snap_id, ts = str(uuid.uuid4()), int(time.time())
     raw_path = os.path.join(SNAP_DIR, f"{snap_id}.raw")
     state_path = os.path.join(SNAP_DIR, f"{snap_id}.state.json")
     print(f"[_save_snapshot] Attempting to save snapshot {snap_id}...")
-    with paint_lock, state_lock:
-        paint_bytes = bytes(paint_rgba); state_json  = json.dumps(dict(babyState), ensure_ascii=False).encode("utf-8")
+    snap = paint_view.current()
+    paint_bytes = snap.rgba()
+    with state_lock:
+        state_json  = json.dumps(dict(babyState), ensure_ascii=False).encode("utf-8")
     try:
-        with open(raw_path, "wb") as f: f.write(paint_bytes)
+        blobs.write(raw_path, paint_bytes)     # unchanged canvases share one copy
         with open(state_path, "wb") as f: f.write(state_json)
     except Exception as e:
         print(f"[_save_snapshot][FATAL] FAILED TO WRITE SNAPSHOT FILES for {snap_id}: {e}")
         print("[_save_snapshot] This might be a file permissions issue on the server!")
         return None
-    meta = {"id": snap_id, "ts": ts, "label": label, "has_png": False}; snapshot_index.append(meta); _save_json(SNAP_IDX, snapshot_index)
+    has_png = False
+    if render_png:
+        try:
+            png = canvas_png.render(snap, min(SNAPSHOT_PNG_SCALE, canvas_png.max_scale))
+            blobs.write(os.path.join(SNAP_DIR, f"{snap_id}.png"), png)
+            has_png = True
+        except Exception as e:
+            print(f"[_save_snapshot][WARN] could not render PNG for {snap_id}:", e)
+    meta = {"id": snap_id, "ts": ts, "label": label, "has_png": has_png, "w": PAINT_W, "h": PAINT_H}; snapshot_index.append(meta); _save_index(SNAP_IDX, snapshot_index)
     print(f"[_save_snapshot] Successfully saved snapshot {snap_id}.")
     return meta
 
 def _attach_png(snap_id: str, png_bytes: bytes):
     png_path = os.path.join(SNAP_DIR, f"{snap_id}.png")
     try:
-        with open(png_path, "wb") as f: f.write(png_bytes)
-        for m in snapshot_index:
-            if m["id"] == snap_id:
-                m["has_png"] = True
-                break
-        _save_json(SNAP_IDX, snapshot_index)
+        blobs.write(png_path, png_bytes)
+        snapshot_index.update(snap_id, has_png=True)
+        _save_index(SNAP_IDX, snapshot_index)
     except Exception as e:
         print("[ERROR] attach png:", e)
 
 
-def _crop_transparent_to_square(image_bytes: bytes) -> bytes:
-    """
-    Crops transparent padding, then places the result onto a new, perfectly
-    square canvas, ensuring the final image has a 1:1 aspect ratio.
-    """
-    if Image is None:
-        return image_bytes
-    try:
-        with Image.open(io.BytesIO(image_bytes)) as img:
-            img = img.convert("RGBA")
-
-            # 1. Get the tightest bounding box of the content
-            bbox = img.getbbox()
-            if not bbox:
-                # Image is fully transparent, return a 1x1 transparent pixel
-                return Image.new("RGBA", (1, 1), (0,0,0,0)).tobytes()
-
-            # 2. Crop to the tightest rectangle first
-            cropped = img.crop(bbox)
-            width, height = cropped.size
-
-            # 3. Determine the size of the new square canvas
-            max_dim = max(width, height)
-
-            # 4. Create a new transparent square canvas
-            square_canvas = Image.new("RGBA", (max_dim, max_dim), (0, 0, 0, 0))
-
-            # 5. Calculate position to paste the cropped image to center it
-            paste_x = (max_dim - width) // 2
-            paste_y = (max_dim - height) // 2
-
-            # 6. Paste the cropped image onto the square canvas
-            square_canvas.paste(cropped, (paste_x, paste_y))
-
-            # 7. Save and return the final square image bytes
-            out = io.BytesIO()
-            square_canvas.save(out, format="PNG")
-            return out.getvalue()
-    except Exception as e:
-        print(f"[_crop_transparent_to_square] failed: {e}")
-    # Fallback to original bytes on error
-    return image_bytes
-
 def _add_to_gallery(image_bytes: bytes, author="anon", title="", label="", snap_id=None):
+    """Record the upload as a "pending" gallery entry and hand it to the image
+    pipeline; _finish_gallery_image() writes the files and marks it "ready"."""
     if not image_bytes:
         raise ValueError("empty image")
     if len(image_bytes) > MAX_UPLOAD_MB*1024*1024:
         raise ValueError("image too large")
-    image_bytes = _crop_transparent_to_square(image_bytes)
+    _sniff_image(image_bytes)
     gid = str(uuid.uuid4()); ts = int(time.time())
-    fname = f"{ts}_{gid}.png"
-    path = os.path.join(GALL_DIR, fname)
-    with open(path, "wb") as f: f.write(image_bytes)
-
-    stamp_fname = f"{ts}_{gid}.stamp.png"
-    stamp_path = os.path.join(GALL_DIR, stamp_fname)
-    MAX_STAMP_DIM = 64
-    try:
-        if Image is None:
-            raise Exception("Pillow not installed")
-
-        with Image.open(io.BytesIO(image_bytes)) as img:
-            img = img.convert("RGBA")
-
-            # Default: use original as stamp
-            stamp_img = img.copy()
-
-            # For snapshots, force 64x64
-            if snap_id and (img.width != 64 or img.height != 64):
-                stamp_img = img.resize((64, 64), Image.Resampling.NEAREST)
-
-            # For bigger drawings, shrink down to max size
-            elif img.width > MAX_STAMP_DIM or img.height > MAX_STAMP_DIM:
-                stamp_img.thumbnail((MAX_STAMP_DIM, MAX_STAMP_DIM), Image.Resampling.NEAREST)
-
-            # Save stamp
-            out_buffer = io.BytesIO()
-            stamp_img.save(out_buffer, format="PNG")
-            with open(stamp_path, "wb") as f:
-                f.write(out_buffer.getvalue())
-    except Exception as e:
-        print(f"[WARN] Failed to create stamp for {gid}: {e}")
-        stamp_fname = None
-    # --- END NEW STAMP LOGIC ---
-
     meta = {
         "id": gid,
         "ts": ts,
-        "file": fname,
+        "file": f"{ts}_{gid}.png",
         "author": author,
         "title": title or label,
         "label": label or title,
+        "status": "pending",
     }
     if snap_id: meta["snap_id"] = snap_id
-    if stamp_fname: meta["stamp_file"] = stamp_fname
-
-    colour_path = os.path.join(GALL_DIR, stamp_fname or fname)
-    c = _avg_colour_from_image(colour_path)
-    if c: meta["colour"] = c
-
-    def _avg_colour_from_image(path: str) -> dict | None:
-        if Image is None:
-            return None
-        try:
-            with Image.open(path).convert("RGBA") as img:
-                data = list(img.getdata())
-                # filter out transparent pixels
-                opaque = [(r, g, b) for (r, g, b, a) in data if a > 0]
-                if not opaque:
-                    return None
-                avg_r = sum(p[0] for p in opaque) / len(opaque)
-                avg_g = sum(p[1] for p in opaque) / len(opaque)
-                avg_b = sum(p[2] for p in opaque) / len(opaque)
-                h, s, v = rgb_to_hsv(avg_r/255, avg_g/255, avg_b/255)
-                return {"r": int(avg_r), "g": int(avg_g), "b": int(avg_b), "h": int(h*360)}
-        except Exception as e:
-            print("[WARN] avg_colour failed:", e)
-            return None
-
+    image_pipeline.spool(gid, image_bytes)
     gallery_index.append(meta)
-    if len(gallery_index) > 5000: del gallery_index[:-5000]
-    _save_json(GALL_IDX, gallery_index)
+    gallery_index.trim(5000)
+    _save_gallery_index()
+    image_pipeline.submit(gid, snapshot=bool(snap_id))
     return meta
 
+def _finish_gallery_image(gid: str, result: dict | None, error: str | None):
+    """Pipeline callback: write the cropped PNG and stamp, then flip the entry to ready."""
+    meta = gallery_index.get(gid)
+    if meta is None:
+        return      # deleted or trimmed while it was processing
+    if error:
+        print(f"[GALLERY][WARN] processing {gid} failed: {error}")
+        gallery_index.remove(gid)
+        _save_gallery_index()
+        return
+    blobs.write(os.path.join(GALL_DIR, meta["file"]), result["png"])
+    changes = {"status": "ready"}
+    if result["stamp"]:
+        stamp_fname = meta["file"][:-len(".png")] + ".stamp.png"
+        blobs.write(os.path.join(GALL_DIR, stamp_fname), result["stamp"])
+        changes["stamp_file"] = stamp_fname
+    if result["colour"]:
+        changes["colour"] = result["colour"]
+        changes["palette"] = result["palette"]
+    gallery_index.update(gid, **changes)
+    _save_gallery_index()
+
+def _save_gallery_index():
+    """Persist gallery_index and drop the cached listing pages built from it."""
+    _save_index(GALL_IDX, gallery_index)
+    gallery_listing.invalidate()
+
+def _resume_pending_images():
+    """Resubmit uploads spooled before a restart; entries whose upload is gone are dropped."""
+    spooled = set(image_pipeline.leftover())
+    stale = [m["id"] for m in gallery_index if m.get("status") == "pending" and m["id"] not in spooled]
+    for gid in stale:
+        gallery_index.remove(gid)
+    resumed = 0
+    for gid in spooled:
+        meta = gallery_index.get(gid)
+        if meta and meta.get("status") == "pending":
+            image_pipeline.submit(gid, snapshot=bool(meta.get("snap_id")))
+            resumed += 1
+        else:
+            try: os.remove(image_pipeline.spool_path(gid))
+            except OSError: pass
+    if stale or resumed:
+        print(f"[GALLERY] resumed {resumed} spooled uploads, dropped {len(stale)} lost ones")
+    if stale:
+        _save_gallery_index()
+
+def _backfill_gallery_colours(force=False) -> int:
+    """Give every ready entry without a palette (every entry with `force`) its
+    colour and palette, analysed on the image pool and saved in one batch.
+    Returns how many entries were updated."""
+    todo = [m for m in gallery_index if m.get("status", "ready") == "ready"
+            and (force or not isinstance(m.get("palette"), list))]
+    if not todo:
+        return 0
+    paths = [os.path.join(GALL_DIR, m.get("stamp_file") or m["file"]) for m in todo]
+    found = [i for i, path in enumerate(paths) if os.path.exists(path)]
+    results = dict(zip(found, image_pipeline.analyse_many([paths[i] for i in found])))
+    with meta_store.batch() if meta_store else nullcontext():
+        for i, m in enumerate(todo):
+            colour, palette = results.get(i, (None, []))
+            changes = {"palette": palette}      # [] marks missing/unreadable files as done too
+            if colour:
+                changes["colour"] = colour
+            gallery_index.update(m["id"], **changes)
+    _save_gallery_index()
+    print(f"[GALLERY] colour backfill: {len(found)} analysed, {len(todo) - len(found)} files missing")
+    return len(todo)
+
+def _adopt_blobs():
+    """Move files from before the blob store into it (deduplicating), then drop orphaned blobs."""
+    for d in (SNAP_DIR, GALL_DIR):
+        n, saved = blobs.adopt(d)
+        if n: print(f"[BLOBS] adopted {n} files from {d}, {saved // 1024} KB deduplicated")
+    removed, freed = blobs.gc()
+    if removed: print(f"[BLOBS] gc removed {removed} unreferenced blobs ({freed // 1024} KB)")
+
+def _storage_maintenance():
+    _backfill_gallery_colours()
+    _adopt_blobs()
+
+# one worker process picks up the spool, backfills palettes and tidies the blob
+# store; the lock is held for its lifetime
+_image_resume_fd = try_exclusive(os.path.join(image_pipeline.spool_dir, ".resume.lock"))
+if _image_resume_fd is not None:
+    _resume_pending_images()
+    threading.Thread(target=_storage_maintenance, daemon=True).start()
+
 # ---- Gallery index import / merge (recovery) ----
 def _validate_gallery_item(it: dict) -> dict | None:
     """
@@ -476,8 +731,29 @@ def _validate_gallery_item(it: dict) -> dict | None:
         out["snap_id"] = it["snap_id"]
     if isinstance(it.get("stamp_file"), str):
         out["stamp_file"] = it["stamp_file"]
+    if isinstance(it.get("colour"), dict):
+        out["colour"] = it["colour"]     # colour/palette are needed by the hue filter on /api/gallery/page
+    if isinstance(it.get("palette"), list):
+        out["palette"] = [p for p in it["palette"] if isinstance(p, dict)]
     return out
 
+@app.post("/api/gallery/backfill_colours")
+def api_gallery_backfill_colours():
+    """Recompute colour + palette for entries missing a palette; `?force=1` for all (protected)."""
+    provided = request.headers.get('X-Admin-Token') or request.headers.get('Authorization', '').replace('Bearer ', '').strip()
+    if not GALLERY_ADMIN_TOKEN or not provided or provided != GALLERY_ADMIN_TOKEN:
+        return jsonify({"status": "error", "message": "forbidden"}), 403
+    force = request.args.get("force", "").lower() in ("1", "true", "yes")
+    return jsonify(ok=True, updated=_backfill_gallery_colours(force))
+
+@app.get("/api/gallery/export_index")
+def api_gallery_export_index():
+    """The gallery index as a body /api/gallery/import_index accepts (protected)."""
+    provided = request.headers.get('X-Admin-Token') or request.headers.get('Authorization', '').replace('Bearer ', '').strip()
+    if not GALLERY_ADMIN_TOKEN or not provided or provided != GALLERY_ADMIN_TOKEN:
+        return jsonify({"status": "error", "message": "forbidden"}), 403
+    return jsonify(index=gallery_index.to_list(), mode="replace")
+
 @app.post("/api/gallery/import_index")
 def api_gallery_import_index():
     """
@@ -508,30 +784,17 @@ def api_gallery_import_index():
         imported = 0
         updated = 0
 
-        global gallery_index
         if mode == "replace":
-            gallery_index = cleaned
+            gallery_index.replace(cleaned)
             imported = len(cleaned)
         else:
-            # merge mode: keep existing, update/insert by 'file' fallback 'id'
-            existing_by_file = {it["file"]: i for i, it in enumerate(gallery_index) if isinstance(it, dict) and it.get("file")}
-            existing_by_id   = {it.get("id"): i for i, it in enumerate(gallery_index) if isinstance(it, dict) and it.get("id")}
-            for it in cleaned:
-                idx = existing_by_file.get(it["file"])
-                if idx is None and it.get("id"):
-                    idx = existing_by_id.get(it["id"])
-                if idx is None:
-                    gallery_index.append(it)
-                    imported += 1
-                else:
-                    gallery_index[idx] = it
-                    updated += 1
+            # merge mode: keep existing, update/insert by id, falling back to 'file'
+            imported, updated = gallery_index.merge(cleaned, match=("file",))
 
         # keep only the newest 5000 like saver does
-        if len(gallery_index) > 5000:
-            gallery_index = gallery_index[-5000:]
+        gallery_index.trim(5000)
 
-        _save_json(GALL_IDX, gallery_index)
+        _save_gallery_index()
         return jsonify(ok=True, mode=mode, imported=imported, updated=updated, total=len(gallery_index))
     except Exception as e:
         return jsonify(error=f"import failed: {e}"), 500
@@ -597,7 +860,7 @@ def _claim_alias_if_exists(platform: str, display_name: str, handle: str, real_u
         users[real_uid] = real
         rec["claimed_by"] = real_uid
         users[alias_uid] = rec
-        _save_users(users)
+        _save_users(real_uid, alias_uid)
         return True
 
     tried = set()
@@ -608,8 +871,9 @@ def _claim_alias_if_exists(platform: str, display_name: str, handle: str, real_u
         if alias_uid in tried:
             continue
         tried.add(alias_uid)
-        if _merge_from_alias(alias_uid):
-            break
+        with user_store.lock:   # a reload mustn't swap either record out mid-merge
+            if _merge_from_alias(alias_uid):
+                break
 
 # ========= BACKGROUND LOOPS =========
 def _register_paint(n):
@@ -628,56 +892,42 @@ def _register_paint(n):
 
 def pixel_aging_loop():
     print("[PIXEL_AGING] active")
-    global burst_active, last_autosnap_ts, last_autosnap_id
+    global burst_active, last_autosnap_ts, last_autosnap_id, _events_base
+    aging_fd = None   # only one worker process fades the shared canvas
+    aged_upto = 0     # canvas seq the schedule reflects
     while True:
-        changed = []
+        changed = b""
+        relayed = False
         try:
             now = int(time.time())
+            fresh_leader = False
+            if aging_fd is None:
+                aging_fd = try_exclusive(PAINT_AGING_FILE)
+                fresh_leader = aging_fd is not None
             with paint_lock:
-                for i in range(PIX_COUNT):
-                    ts = paint_ts[i]
-                    if ts == 0: continue
-                    age = now - ts
-                    a_idx = i*4 + 3
-                    cur_a = paint_rgba[a_idx]
-                    start_fade = paint_life[i*2]
-                    end_fade   = paint_life[i*2+1]
-                    if end_fade <= start_fade:
-                        continue
-                    new_a = cur_a
-                    if age > end_fade:
-                        if cur_a > 0:
-                            new_a = 0
-                            paint_ts[i] = 0
-                            paint_life[i*2] = 0.0
-                            paint_life[i*2+1] = 0.0
-                            paint_alpha0[i] = 0
-                    elif age > start_fade:
-                        frac = (age - start_fade) / (end_fade - start_fade)
-                        frac = max(0.0, min(1.0, frac))
-                        frac = frac * frac  # ease-out
-                        alpha0 = paint_alpha0[i] or cur_a or 255
-                        new_a = int(alpha0 * (1.0 - frac))
-                    if new_a != cur_a:
-                        paint_rgba[a_idx] = max(0, min(255, new_a))
-                        x = i % PAINT_W; y = i // PAINT_W
-                        off = i*4
-                        changed.append({
-                            "x": x, "y": y,
-                            "r": paint_rgba[off+0], "g": paint_rgba[off+1],
-                            "b": paint_rgba[off+2], "a": paint_rgba[off+3],
-                        })
-                if changed:
-                    with open(PAINT_STATE_FILE, "wb") as f: f.write(paint_rgba)
-                    with open(PAINT_TS_FILE, "wb") as f: paint_ts.tofile(f)
-                    with open(PAINT_LIFE_FILE, "wb") as f: paint_life.tofile(f)
-                    with open(PAINT_ALPHA0_FILE, "wb") as f: paint_alpha0.tofile(f)
-            if changed:
-                ev = {"id": str(uuid.uuid4()), "ts": time.time(), "pixels": changed}
-                with events_lock:
-                    paint_events.append(ev)
+                relayed = _sync_foreign_paints_locked()
+                # other workers' strokes never touched our schedule: rescan just the tiles they wrote
+                if fresh_leader:
+                    paint_ager.rebuild()
+                elif paint_canvas.foreign_writes():
+                    paint_ager.rebuild(paint_tiles.changed_since(aged_upto))
+                due = paint_ager.tick(now) if aging_fd is not None else []
+                if due:
+                    paint_journal.commit([_journal_record(i) for i in due])
+                    paint_tiles.mark({paint_tiles.tile_of(i) for i in due}, paint_canvas.write_seq)
+                    changed = b"".join(PIXEL.pack(i, *paint_rgba[i*4:i*4+4]) for i in due)
+                    paint_events.append(changed, seq=paint_canvas.write_seq)
+                    _events_base = paint_view.refresh()
+                aged_upto = paint_canvas.write_seq
+            if changed or relayed:
+                stream_notifier.bump()
         except Exception as e:
             print("[ERROR] pixel_aging:", e)
+        try:
+            if paint_journal.needs_compaction(PAINT_COMPACT_BYTES, PAINT_COMPACT_SECONDS):
+                _compact_paint_journal()
+        except Exception as e:
+            print("[ERROR] paint compaction:", e)
         # autosnap check
         try:
             with activity_lock:
@@ -695,20 +945,72 @@ def pixel_aging_loop():
             print("[ERROR] autosnap:", e)
         time.sleep(FADE_TICK_SECONDS)
 
+def _timeline_step(cursor):
+    """Record the events since `cursor` (or a keyframe when they can't be
+    served) up to the current canvas snapshot; returns the next cursor."""
+    snap = paint_view.current()
+    events = paint_events.since(cursor) if cursor else None
+    if events is not None:
+        upto = paint_events.parse_cursor(snap.tag)     # later events belong to the next step
+        events = [ev for ev in events if ev["seq"] <= upto]
+    timeline.record(snap.rgba(), PAINT_W, PAINT_H, events)
+    return snap.tag
+
+def timeline_loop():
+    leader_fd = None   # only one worker process records
+    cursor = None
+    while True:
+        try:
+            if leader_fd is None:
+                leader_fd = try_exclusive(TIMELINE_LEADER_FILE)
+            if leader_fd is not None:
+                cursor = _timeline_step(cursor)
+        except Exception as e:
+            print("[ERROR] timeline:", e)
+        time.sleep(TIMELINE_STEP_SECONDS)
+
+def _apply_brain_state(incoming: dict) -> dict:
+    """Merge the fields of `incoming` that differ into babyState; listeners are
+    only woken when something actually changed.  Returns the changed fields."""
+    global state_version
+    if not isinstance(incoming, dict):
+        return {}
+    with state_lock:
+        diff = {k: v for k, v in incoming.items() if k not in babyState or babyState[k] != v}
+        if diff:
+            babyState.update(diff)
+            state_version += 1
+    if diff:
+        stream_notifier.bump()
+    return diff
+
 def state_sync_loop():
     if not LLM_SERVER_URL:
         print("[STATE_SYNC] FATAL: loop cannot run as LLM_SERVER_URL is not set.")
         return
-    print(f"[STATE_SYNC] active, polling {LLM_SERVER_URL} at {STATE_SYNC_HZ}Hz")
+    mode = STATE_SYNC_MODE if STATE_SYNC_MODE in ("poll", "longpoll", "push") else "poll"
+    print(f"[STATE_SYNC] active, {mode} against {LLM_SERVER_URL}" + (f" at {STATE_SYNC_HZ}Hz" if mode == "poll" else ""))
     base_period = 1.0 / max(STATE_SYNC_HZ, 0.1)
+    if mode == "push":
+        base_period = STATE_PUSH_RECONCILE_SECONDS
     period = base_period
     failures = 0
+    etag = None
     while True:
+        t0 = time.time()
         try:
-            r = requests.get(f"{LLM_SERVER_URL.rstrip('/')}/api/state", timeout=2)
-            if r.ok:
-                with state_lock:
-                    babyState.update(r.json())
+            headers = {"If-None-Match": etag} if etag else {}
+            if mode == "longpoll":
+                r = brain.get("/api/state", params={"wait": STATE_LONGPOLL_SECONDS}, headers=headers,
+                              timeout=STATE_LONGPOLL_SECONDS + 5)
+            else:
+                r = brain.get("/api/state", headers=headers)
+            if r.status_code == 304:
+                failures = 0
+                period = base_period
+            elif r.ok:
+                etag = r.headers.get("ETag")
+                _apply_brain_state(r.json())
                 failures = 0
                 period = base_period
             elif random.randint(0, 50) == 0:
@@ -718,9 +1020,15 @@ def state_sync_loop():
             if failures == 1 or failures % 5 == 0:
                 print(f"[STATE_SYNC][WARN] Could not connect to brain server at {LLM_SERVER_URL}.")
             period = min(period * 2, 60)
-        time.sleep(period)
+        if mode == "longpoll" and not failures:
+            # a held request already waited; one answered at once gets poll pacing
+            time.sleep(max(0.0, base_period - (time.time() - t0)))
+        else:
+            time.sleep(period)
 
 threading.Thread(target=pixel_aging_loop, daemon=True).start()
+threading.Thread(target=timeline_loop, daemon=True).start()
+threading.Thread(target=foreign_paint_loop, daemon=True).start()
 threading.Thread(target=state_sync_loop, daemon=True).start()
 
 # ========= ROUTES =========
@@ -736,22 +1044,44 @@ def api_speak():
 @app.get("/api/ping")
 def ping(): return jsonify(ok=True, msg="hello from server")
 
+@app.get("/api/brain/metrics")
+def api_brain_metrics():
+    """Per-endpoint brain call counts, error rates and latency, plus breaker state."""
+    return jsonify(brain.metrics())
+
 @app.get("/api/state")
 def get_state():
-    with state_lock: return jsonify(babyState)
+    with state_lock:
+        etag = f'"{_state_epoch}-{state_version}"'
+        if etag in request.headers.get("If-None-Match", ""):
+            return Response(status=304, headers={"ETag": etag})
+        resp = jsonify(babyState)
+    resp.headers["ETag"] = etag
+    return resp
+
+@app.post("/api/state/push")
+def api_state_push():
+    """The brain pushes babyState changes here (STATE_SYNC_MODE="push"); full or partial dicts."""
+    provided = request.headers.get('X-Brain-Token') or request.headers.get('Authorization', '').replace('Bearer ', '').strip()
+    if not BRAIN_PUSH_TOKEN or provided != BRAIN_PUSH_TOKEN:
+        return jsonify({"status": "error", "message": "forbidden"}), 403
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify(error="no json body"), 400
+    diff = _apply_brain_state(data)
+    return jsonify(ok=True, changed=sorted(diff))
 
 # --- Proxy POST for /api/state ---
 
 @app.post("/api/state")
 def api_set_state():
     data = request.get_json(silent=True) or {}
-    _reload_users_from_disk()
     if not isinstance(data, dict):
         return jsonify(error="no json body"), 400
     if not LLM_SERVER_URL:
         return jsonify(error="brain not configured"), 503
     try:
-        r = requests.post(f"{LLM_SERVER_URL.rstrip('/')}/api/state", json=data, timeout=5)
+        r = brain.post("/api/state", json=data)
         return (r.text, r.status_code, {"Content-Type": r.headers.get("Content-Type","application/json")})
     except requests.exceptions.RequestException as e:
         return jsonify(error=f"brain unreachable: {e}"), 504
@@ -804,22 +1134,27 @@ def api_consent():
     uid = _mk_uid(platform, user_id, display_name or handle)
     if consent_flag:
         # ensure record exists and mark consent
-        _upsert_user(platform=platform, user_id=user_id, handle=handle, display_name=display_name, colour=colour)
-        users[uid].setdefault('consents', {})[platform] = int(time.time())
+        with user_store.lock:
+            _upsert_user(platform=platform, user_id=user_id, handle=handle, display_name=display_name, colour=colour)
+            users[uid].setdefault('consents', {})[platform] = int(time.time())
+            _save_users(uid)
         try: _claim_alias_if_exists(platform, display_name or (handle or ""), handle or (display_name or ""), uid)
         except Exception as e: print('[WARN] alias-claim in consent failed:', e)
-        _save_users(users)
     else:
-        rec = users.get(uid)
-        if rec:
-            rec.setdefault('consents', {}).pop(platform, None)
-            users[uid] = rec
-            _save_users(users)
+        with user_store.lock:
+            rec = users.get(uid)
+            if rec:
+                rec.setdefault('consents', {}).pop(platform, None)
+                users[uid] = rec
+                _save_users(uid)
     return jsonify(ok=True, uid=uid, consents=users.get(uid, {}).get('consents', {}))
 
 @app.post("/api/say")
 def api_say():
-    """Proxies the chat message to the brain server and records history."""
+    """Proxies the chat message to the brain server and records history.
+    A client that may resend (a bot retrying on a timeout) passes the same
+    `idempotency_key` (or Idempotency-Key header) each time; a resend joins
+    the job still waiting on the brain instead of asking twice."""
     data = request.json or {}
     _reload_users_from_disk()
     text = (data.get("text") or "").strip()
@@ -857,8 +1192,15 @@ def api_say():
         uid = _guest_uid(platform, user_id)
         if uid == 'reject': return jsonify(status='error', reply='you are chatting as a guest; opt in to play!'), 403
 
+    # a resend of a message that's still waiting on the brain joins that job instead;
+    # without a key every message is its own job (two guests or a deliberate repeat)
+    idem = str(data.get("idempotency_key") or request.headers.get("Idempotency-Key") or "").strip()
+    key = (uid, idem) if idem else None
+    job = say_jobs.find(key) if key else None
+    merged = job is not None
+
     # Only append to chat history if persisted user OR the message is a command
-    if persist_user or is_command:
+    if (persist_user or is_command) and not merged:
         user_msg = {
             "id": str(uuid.uuid4()),
             "uid": uid,
@@ -870,19 +1212,43 @@ def api_say():
         if colour is not None: user_msg["colour"] = colour
         with chat_lock:
             chat_history.append(user_msg)
-            if len(chat_history) > 500:
-                chat_history[:] = chat_history[-500:]
-            _save_json(CHAT_FILE, chat_history)
+            chat_history.trim(500)
+            _save_index(CHAT_FILE, chat_history)
 
+    speak = data.get("speak")
+    if speak is None:
+        speak = (platform == "web")  # default: web messages speak
+    guest = (not persist_user and platform in ('discord','twitch'))
+    if not merged:
+        payload = {"text": text, "author": author, "display_name": display_name,
+                   "platform": platform, "speak": bool(speak)}
+        job, merged = say_jobs.submit(payload, key=key)
+    if job is None:
+        resp = jsonify(status="error", reply="... (baby is busy, try again soon)", uid=uid, guest=guest)
+        resp.headers["Retry-After"] = "5"
+        return resp, 503
+
+    if not (data.get("async") or request.args.get("async")):
+        job = say_jobs.wait(job["id"], SAY_SYNC_WAIT)
+    if job["status"] in ("queued", "running"):
+        return jsonify(status="queued", job_id=job["id"], merged=merged, uid=uid, guest=guest,
+                       poll_url=f"/api/say/{job['id']}"), 202
+    res = job["result"] or {}
+    status_code = res.get("status_code", 500)
+    return jsonify(
+        status=("ok" if status_code == 200 else "error"),
+        reply=res.get("reply", "... (brain error)"),
+        uid=uid,
+        guest=guest
+    ), status_code
+
+def _run_say_job(payload: dict) -> dict:
+    """Worker side of /api/say: ask the brain, record baby's reply in chat history."""
     reply = "... (brain is offline)"
     status_code = 503
     if LLM_SERVER_URL:
         try:
-            r = requests.post(
-                f"{LLM_SERVER_URL.rstrip('/')}/api/say",
-                json={"text": text, "author": author},
-                timeout=185 # Slightly longer than brain timeout
-            )
+            r = brain.post("/api/say", json={"text": payload["text"], "author": payload["author"]})
             status_code = r.status_code
             if r.ok:
                 reply = r.json().get("reply", "... (brain gave empty reply)")
@@ -892,37 +1258,54 @@ def api_say():
             print("[ERROR] /api/say proxy failed:", e)
             reply = "... (could not reach brain)"
             status_code = 504 # Gateway timeout
+        if payload["speak"]:
+            # the brain speaks what it's sent on a second /api/say; still this job's thread, not the request's
+            _brain_post("/api/say", {"text": payload["text"], "author": payload["display_name"]})
 
     # The brain server now handles its own color, so we just get the latest state
     with state_lock:
         bot_color = {"r": babyState.get("R",133), "g": babyState.get("G",239), "b": babyState.get("B",238)}
-    
+
     bot_msg = {
         "id": str(uuid.uuid4()),
         "author": "babyLLM",
         "text": reply,
         "timestamp": time.time(),
         "colour": bot_color,
-        "visible_on_web": (platform == "web"),  # Baby’s own replies only appear if the original was web
+        "visible_on_web": (payload["platform"] == "web"),  # Baby’s own replies only appear if the original was web
     }
     with chat_lock:
         chat_history.append(bot_msg)
-        if len(chat_history) > 500: chat_history[:] = chat_history[-500:]
-        _save_json(CHAT_FILE, chat_history)
+        chat_history.trim(500)
+        _save_index(CHAT_FILE, chat_history)
+    return {"reply": reply, "status_code": status_code, "message_id": bot_msg["id"]}
+
+def _say_job_json(job: dict) -> dict:
+    res = job.get("result") or {}
+    out = {"job_id": job["id"], "status": job["status"]}
+    if job["status"] == "queued":
+        out["position"] = say_jobs.position(job["id"])
+    if job["status"] in ("done", "error"):
+        out["reply"] = res.get("reply", "... (brain error)")
+        out["status_code"] = res.get("status_code", 500)
+        out["message_id"] = res.get("message_id")
+    return out
 
-    speak = data.get("speak")
-    if speak is None:
-        speak = (platform == "web")  # default: web messages speak
-    if speak:
-        brain_resp = _brain_post("/api/say", {"text": text, "author": display_name})
-        bot_msg["brain_reply"] = brain_resp.get("reply") if isinstance(brain_resp, dict) else None
-    
-    return jsonify(
-        status=("ok" if status_code == 200 else "error"),
-        reply=reply,
-        uid=uid,
-        guest=(not persist_user and platform in ('discord','twitch'))
-    ), status_code
+say_jobs = BrainJobQueue(_run_say_job, workers=SAY_WORKERS, maxsize=SAY_QUEUE_MAX,
+                         keep_seconds=SAY_JOB_KEEP_SECONDS, on_done=lambda job: stream_notifier.bump())
+say_jobs.start()
+
+@app.get("/api/say/<job_id>")
+def api_say_job(job_id):
+    """Poll a queued /api/say job; `?wait=N` long-polls up to 30s for it to finish."""
+    try:
+        wait = min(max(float(request.args.get("wait", 0)), 0.0), 30.0)
+    except ValueError:
+        wait = 0.0
+    job = say_jobs.wait(job_id, wait) if wait else say_jobs.get(job_id)
+    if not job:
+        return jsonify(error="unknown or expired job"), 404
+    return jsonify(_say_job_json(job))
 
 
 # --- Optional: Read-only endpoint to fetch a user record by uid ---
@@ -933,144 +1316,542 @@ def api_get_user(uid: str):
     if not rec: return jsonify(error='not found'), 404
     return jsonify(rec)
 
+# --- Force a users.json reload (protected), for edits the mtime check can't see ---
+@app.post('/api/users/reload')
+def api_reload_users():
+    provided = request.headers.get('X-Admin-Token') or request.headers.get('Authorization', '').replace('Bearer ', '').strip()
+    if not GALLERY_ADMIN_TOKEN or not provided or provided != GALLERY_ADMIN_TOKEN:
+        return jsonify({"status": "error", "message": "forbidden"}), 403
+    _reload_users_from_disk(force=True)
+    return jsonify(ok=True, users=len(users))
+
+# bbybook: served from memory, refreshed from the brain in the background once
+# older than BBYBOOK_TTL; bbybook.json is the fallback and is rewritten only
+# when the content actually changes.
+def _bbybook_entry(data):
+    body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+    return data, body, hashlib.sha1(body).hexdigest()[:16]
+
+def _fetch_bbybook():
+    r = brain.get("/api/bbybook")
+    r.raise_for_status()
+    return _bbybook_entry(r.json())
+
+_bbybook_disk_hash = None
+
+def _store_bbybook(entry):
+    global _bbybook_disk_hash
+    _, body, digest = entry
+    if digest == _bbybook_disk_hash:
+        return
+    tmp = BBYBOOK_LOCAL + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(body)
+    os.replace(tmp, BBYBOOK_LOCAL)
+    _bbybook_disk_hash = digest
+
+bbybook_cache = SWRCache(_fetch_bbybook, ttl=BBYBOOK_TTL, error_ttl=BBYBOOK_ERROR_TTL,
+                         on_update=_store_bbybook, name="bbybook")
+if os.path.exists(BBYBOOK_LOCAL):
+    try:
+        _entry = _bbybook_entry(_load_json(BBYBOOK_LOCAL, None))
+        if _entry[0] is not None:
+            bbybook_cache.seed(_entry)      # stale from the start, so the first view triggers a refresh
+            _bbybook_disk_hash = _entry[2]
+    except Exception as e:
+        print("[WARN] could not read local bbybook:", e)
+
 @app.get("/api/bbybook")
 def api_bbybook():
     """Gets the bbybook from the brain server with a local fallback.
 
-    If the brain server is reachable we return its data and update the cached
-    copy on disk.  Otherwise we fall back to the last saved copy if it exists.
+    Served from memory; a stale copy is returned at once while one background
+    request refreshes it, and concurrent cold misses share a single brain call.
     """
-    # Try the brain server first if a URL is configured
-    if LLM_SERVER_URL:
-        try:
-            r = requests.get(f"{LLM_SERVER_URL.rstrip('/')}/api/bbybook", timeout=5)
-            if r.ok:
-                data = r.json()
-                # Save a copy so we can serve it later if the brain is offline
-                try:
-                    with open(BBYBOOK_LOCAL, "w", encoding="utf-8") as f:
-                        json.dump(data, f)
-                except Exception:
-                    pass  # Caching errors shouldn't prevent serving the data
-                return jsonify(data)
-        except requests.exceptions.RequestException:
-            pass  # Fall back to local copy below
-
-    # If we couldn't reach the brain, try the cached local copy
-    if os.path.exists(BBYBOOK_LOCAL):
-        try:
-            with open(BBYBOOK_LOCAL, "r", encoding="utf-8") as f:
-                return jsonify(json.load(f))
-        except Exception as e:
-            return jsonify(error=f"Could not read local bbybook: {e}"), 500
-
-    # No brain data and no local cache – return appropriate error
-    if LLM_SERVER_URL:
-        return jsonify(error="Could not reach brain server"), 504
-    return jsonify(error="Brain server URL not configured"), 503
+    entry, status = bbybook_cache.get(timeout=10)
+    if entry is None:
+        # No brain data and no local copy – return appropriate error
+        if LLM_SERVER_URL:
+            return jsonify(error="Could not reach brain server"), 504
+        return jsonify(error="Brain server URL not configured"), 503
+    _, body, digest = entry
+    etag = f'"{digest}"'
+    headers = {"ETag": etag, "X-Cache": status, "Cache-Control": "no-cache"}
+    if etag in request.headers.get("If-None-Match", ""):
+        return Response(status=304, headers=headers)
+    return Response(body, mimetype="application/json", headers=headers)
 
 # ---- Pixels ----
+# Encoded canvas bodies, one per format, valid for a single canvas version.
+# The version is the mapped canvas' write_seq, which every paint and fade commit
+# bumps (in any worker), so it doubles as the ETag.
+_canvas_cache = {}   # kind -> (version, body)
+
+def _canvas_body(kind: str):
+    v = paint_canvas.write_seq
+    hit = _canvas_cache.get(kind)
+    if hit and hit[0] == v:
+        return hit
+    snap = paint_view.current()
+    v, raw = snap.seq, snap.rgba()
+    if kind == "json":
+        body = json.dumps({"paintOverlayData_b64": base64.b64encode(raw).decode("utf-8"),
+                           "w": PAINT_W, "h": PAINT_H, "version": v}).encode("utf-8")
+    elif kind == "raw+deflate":
+        body = zlib.compress(raw, 6)
+    else:
+        body = raw
+    _canvas_cache[kind] = (v, body)
+    return v, body
+
 @app.get("/api/get_paint_canvas")
 def api_get_paint_canvas():
-    with paint_lock:
-        b64 = base64.b64encode(paint_rgba).decode("utf-8")
-    return jsonify(paintOverlayData_b64=b64, w=PAINT_W, h=PAINT_H)
+    """JSON with the RGBA buffer base64'd, or with `Accept: application/octet-stream`
+    the raw buffer (size in X-Canvas-Width / X-Canvas-Height). Responses carry an
+    ETag for the canvas version; If-None-Match on an unchanged canvas gets a 304."""
+    if _wants_binary():
+        kind = "raw+deflate" if "deflate" in request.headers.get("Accept-Encoding", "") else "raw"
+        mimetype = "application/octet-stream"
+    else:
+        kind, mimetype = "json", "application/json"
+    v = paint_canvas.write_seq
+    etag = f"{paint_canvas.instance:x}-{v}-{kind}"
+    headers = {"Cache-Control": "no-cache", "Vary": "Accept, Accept-Encoding",
+               "X-Canvas-Width": str(PAINT_W), "X-Canvas-Height": str(PAINT_H)}
+    if request.if_none_match.contains(etag):
+        return Response(status=304, headers={**headers, "ETag": f'"{etag}"'})
+    v, body = _canvas_body(kind)
+    headers["ETag"] = f'"{paint_canvas.instance:x}-{v}-{kind}"'
+    if kind == "raw+deflate":
+        headers["Content-Encoding"] = "deflate"
+    return Response(body, mimetype=mimetype, headers=headers)
+
+TILE_HEAD = struct.Struct("<HHHHQ")     # x, y, w, h, version: binary tile record header
+
+def _tile_cursor(seq: int) -> str:
+    return f"{paint_canvas.instance:x}-{seq}"
+
+@app.get("/api/canvas/tiles")
+def api_canvas_tiles():
+    """The tiles overlapping a viewport, ?x=&y=&w=&h= in pixels (default: the
+    whole canvas).  With ?since=<cursor> from an earlier response only tiles
+    changed after it are sent.  JSON is {w, h, tile, cursor, tiles: [{x, y, w,
+    h, version, rgba_b64}]}; with `Accept: application/octet-stream` the body
+    is one record per tile, a 16-byte header (uint16 LE x, y, w, h; uint64 LE
+    version) then w*h*4 RGBA bytes, with the cursor in X-Canvas-Cursor."""
+    try:
+        x = int(request.args.get("x", 0)); y = int(request.args.get("y", 0))
+        w = int(request.args.get("w", PAINT_W)); h = int(request.args.get("h", PAINT_H))
+    except ValueError:
+        return jsonify(error="x, y, w and h must be integers"), 400
+    instance, _, since = (request.args.get("since") or "").partition("-")
+    since = int(since) if since.isdigit() and instance == f"{paint_canvas.instance:x}" else 0
+    snap = paint_view.current()
+    out = [(t, (snap.versions[t], snap.tiles[t])) for t in paint_tiles.in_view(x, y, w, h) if snap.versions[t] > since]
+    cursor = _tile_cursor(snap.seq)
+    if _wants_binary():
+        body = b"".join(TILE_HEAD.pack(*paint_tiles.rect(t), ver) + data for t, (ver, data) in out)
+        return _binary_response(body, {"X-Canvas-Cursor": cursor, "Cache-Control": "no-cache",
+                                       "X-Canvas-Width": str(PAINT_W), "X-Canvas-Height": str(PAINT_H)})
+    tiles = []
+    for t, (ver, data) in out:
+        tx, ty, tw, th = paint_tiles.rect(t)
+        tiles.append({"x": tx, "y": ty, "w": tw, "h": th, "version": ver,
+                      "rgba_b64": base64.b64encode(data).decode("ascii")})
+    return jsonify(w=PAINT_W, h=PAINT_H, tile=PAINT_TILE, cursor=cursor, tiles=tiles)
+
+@app.get("/api/canvas.png")
+def api_canvas_png():
+    """The paint canvas as a PNG, ?scale=N blowing each pixel up to NxN
+    (nearest neighbour).  ETag is the canvas version, so unchanged canvases
+    revalidate with a 304; encodes are shared through canvas_png's LRU."""
+    try:
+        scale = int(request.args.get("scale", 1))
+    except ValueError:
+        return jsonify(error="scale must be an integer"), 400
+    if not 1 <= scale <= canvas_png.max_scale:
+        return jsonify(error=f"scale must be 1..{canvas_png.max_scale}"), 400
+    etag = f"{paint_canvas.instance:x}-{paint_canvas.write_seq}-png{scale}"
+    headers = {"Cache-Control": "no-cache", "X-Canvas-Width": str(PAINT_W), "X-Canvas-Height": str(PAINT_H)}
+    if request.if_none_match.contains(etag):
+        return Response(status=304, headers={**headers, "ETag": f'"{etag}"'})
+    v, png = canvas_png.get(scale)
+    headers["ETag"] = f'"{paint_canvas.instance:x}-{v}-png{scale}"'
+    return Response(png, mimetype="image/png", headers=headers)
 
 # --- Legacy alias (frontend might call /get_paint_canvas) ---
 @app.get("/get_paint_canvas")
 def legacy_get_paint_canvas():
     return api_get_paint_canvas()
 
+def _parse_pixels(pixels):
+    """("px", [(idx, r, g, b, a)]) for the well-formed, on-canvas entries of a request."""
+    out = []
+    for p in pixels:
+        try:
+            x,y = int(p["x"]), int(p["y"])
+            r,g,b,a = int(p["r"]),int(p["g"]),int(p["b"]),int(p["a"])
+        except Exception:
+            continue
+        if not (0 <= x < PAINT_W and 0 <= y < PAINT_H): continue
+        if not (0 <= r < 256 and 0 <= g < 256 and 0 <= b < 256 and 0 <= a < 256): continue
+        out.append((y*PAINT_W + x, r, g, b, a))
+    return ("px", out)
+
+def _parse_ops(ops):
+    """Drawing ops -> chunks for _apply_paint_batch, in order.  Each op carries
+    r, g, b, a plus one of
+        {"op": "line", "x0", "y0", "x1", "y1", "width": 1}
+        {"op": "rect", "x", "y", "w", "h"}
+        {"op": "spans", "runs": [x, y, length, ...]}
+        {"op": "fill", "x", "y"}        (flood fill, against the canvas as it is when applied)
+    except a spans op may instead carry "colours": [r, g, b, a, ...], one per run.
+    Raises ValueError on a malformed op or when they add up to too many pixels."""
+    if len(ops) > PAINT_OPS_MAX:
+        raise ValueError(f"at most {PAINT_OPS_MAX} ops per request")
+    chunks, total = [], 0
+    for op in ops:
+        try:
+            kind = op["op"]
+            if kind == "spans" and "colours" in op:
+                chunk = ("px", _coloured_spans([int(v) for v in op["runs"]], [int(v) for v in op["colours"]]))
+                n = len(chunk[1])
+            else:
+                rgba = tuple(int(op[k]) for k in "rgba")
+                if not all(0 <= v < 256 for v in rgba):
+                    raise ValueError("colour out of range")
+                if kind == "line":
+                    width = min(max(int(op.get("width", 1)), 1), PAINT_BRUSH_MAX)
+                    idx = bbyShapes.line(int(op["x0"]), int(op["y0"]), int(op["x1"]), int(op["y1"]), width, PAINT_W, PAINT_H)
+                elif kind == "rect":
+                    idx = bbyShapes.rect(int(op["x"]), int(op["y"]), int(op["w"]), int(op["h"]), PAINT_W, PAINT_H)
+                elif kind == "spans":
+                    idx = bbyShapes.spans([int(v) for v in op["runs"]], PAINT_W, PAINT_H)
+                elif kind == "fill":
+                    chunks.append(("fill", int(op["x"]), int(op["y"])) + rgba)
+                    continue
+                else:
+                    raise ValueError(f"unknown op {kind!r}")
+                chunk, n = ("run", idx) + rgba, len(idx)
+        except (KeyError, TypeError, ValueError) as e:
+            raise ValueError(f"bad op {op!r:.80}: {e}")
+        total += n
+        if total > PAINT_OPS_MAX_PIXELS:
+            raise ValueError(f"ops cover more than {PAINT_OPS_MAX_PIXELS} pixels")
+        chunks.append(chunk)
+    return chunks
+
+def _coloured_spans(runs, colours):
+    """(idx, r, g, b, a) for spans whose runs each carry their own colour."""
+    if len(runs) % 3 or len(colours) != len(runs) // 3 * 4:
+        raise ValueError("need one r, g, b, a per run")
+    if not all(0 <= v < 256 for v in colours):
+        raise ValueError("colour out of range")
+    return [(i, *colours[k*4:k*4+4]) for k in range(len(runs) // 3)
+            for i in bbyShapes.spans(runs[k*3:k*3+3], PAINT_W, PAINT_H)]
+
+def _chunk_pixels(chunk):
+    """(idx, r, g, b, a) for each pixel of a chunk; fills read the live canvas,
+    so this runs under paint_lock."""
+    kind = chunk[0]
+    if kind == "px":
+        return chunk[1]
+    if kind == "fill":
+        _, x, y, r, g, b, a = chunk
+        idx = bbyShapes.flood(paint_rgba, PAINT_W, PAINT_H, x, y, PAINT_OPS_MAX_PIXELS)
+        if idx is None:
+            return ()       # region too big: skipped, and not counted as changed
+    else:
+        _, idx, r, g, b, a = chunk
+    return ((i, r, g, b, a) for i in idx)
+
+def _apply_paint_batch(batch):
+    """Apply several requests' chunks (each request a list of them, see
+    _parse_pixels/_parse_ops) under one paint_lock round: one journal commit,
+    one event, one snapshot publish.  Returns each request's changed count.  Runs on paint_writer's thread (inline when batching is off)."""
+    global _events_base
+    now = int(time.time())
+    ev_pixels = bytearray()   # packed PIXEL records for the event log
+    records = []
+    touched = set()           # tile ids
+    counts = []
+    with paint_lock:
+        relayed = _sync_foreign_paints_locked()   # other workers' paints get their event before ours
+        for chunks in batch:
+            # one lifespan per request, as before: a stroke fades together
+            stroke_base = _sample_total_seconds() if STROKE_COHERENCE else None
+            n = len(records)
+            for idx, r, g, b, a in (px for chunk in chunks for px in _chunk_pixels(chunk)):
+                off = idx*4
+                old_r, old_g, old_b = paint_rgba[off], paint_rgba[off+1], paint_rgba[off+2]
+                same_rgb = (old_r == r and old_g == g and old_b == b)
+                # choose refresh
+                if REPAINT_REFRESHES_LIFE and a > 0:
+                    refresh = True
+                else:
+                    if REPAINT_POLICY == "always":
+                        refresh = True
+                    elif REPAINT_POLICY == "never":
+                        refresh = (paint_ts[idx] == 0)
+                    else:  # diff_color_refresh
+                        refresh = (paint_ts[idx] == 0) or (not same_rgb)
+                # write pixel
+                paint_rgba[off:off+4] = bytes((r,g,b,a))
+                if a > 0:
+                    if refresh:
+                        paint_ts[idx] = now
+                        total = stroke_base * random.uniform(1-COHERENCE_JITTER, 1+COHERENCE_JITTER) if stroke_base else _sample_total_seconds()
+                        total *= LIFESPAN_SCALE
+                        start_fade, end_fade = _split_linger_fade(total)
+                        paint_life[idx*2] = float(start_fade)
+                        paint_life[idx*2+1] = float(end_fade)
+                        paint_alpha0[idx] = a
+                else:
+                    paint_ts[idx] = 0
+                    paint_life[idx*2] = 0.0
+                    paint_life[idx*2+1] = 0.0
+                    paint_alpha0[idx] = 0
+                paint_ager.touch(idx)
+                touched.add(paint_tiles.tile_of(idx))
+                records.append(_journal_record(idx))
+                ev_pixels += PIXEL.pack(idx, r, g, b, a)
+            counts.append(len(records) - n)
+        if not records:
+            if relayed:
+                stream_notifier.bump()
+            return counts
+        # persist: queue the deltas for the journal's next group commit
+        seq = paint_journal.commit(records)
+        paint_tiles.mark(touched, paint_canvas.write_seq)
+        paint_events.append(ev_pixels, seq=paint_canvas.write_seq)
+        _events_base = paint_view.refresh()
+    if PAINT_JOURNAL_FSYNC == "always":
+        paint_journal.wait(seq)
+    stream_notifier.bump()
+    _register_paint(len(records))
+    return counts
+
+# Single writer: concurrent paint requests queue here instead of on paint_lock
+paint_writer = BatchWriter(_apply_paint_batch, window_ms=PAINT_BATCH_MS)
+paint_writer.start()
+
 @app.post("/api/paint_pixel")
 def api_paint_pixel():
+    """{"pixels": [{x, y, r, g, b, a}, ...]} and/or {"ops": [...]} (see
+    _parse_ops); pixels are applied first, then the ops in order, all with
+    one stroke lifespan."""
     data = request.json or {}
-    pixels = data.get("pixels")
-    if not isinstance(pixels, list) or not pixels:
+    pixels, ops = data.get("pixels") or [], data.get("ops") or []
+    if not isinstance(pixels, list) or not isinstance(ops, list) or not (pixels or ops):
         return jsonify(status="error", message="bad payload"), 400
-    now = int(time.time())
-    ev_pixels = []
-    with paint_lock:
-        stroke_base = _sample_total_seconds() if STROKE_COHERENCE else None
-        for p in pixels:
-            try:
-                x,y = int(p["x"]), int(p["y"])
-                r,g,b,a = int(p["r"]),int(p["g"]),int(p["b"]),int(p["a"])
-            except Exception:
-                continue
-            if not (0 <= x < PAINT_W and 0 <= y < PAINT_H): continue
-            idx = y*PAINT_W + x
-            off = idx*4
-            old_r, old_g, old_b = paint_rgba[off], paint_rgba[off+1], paint_rgba[off+2]
-            same_rgb = (old_r == r and old_g == g and old_b == b)
-            # choose refresh
-            if REPAINT_REFRESHES_LIFE and a > 0:
-                refresh = True
-            else:
-                if REPAINT_POLICY == "always":
-                    refresh = True
-                elif REPAINT_POLICY == "never":
-                    refresh = (paint_ts[idx] == 0)
-                else:  # diff_color_refresh
-                    refresh = (paint_ts[idx] == 0) or (not same_rgb)
-            # write pixel
-            paint_rgba[off:off+4] = bytes((r,g,b,a))
-            if a > 0:
-                if refresh:
-                    paint_ts[idx] = now
-                    total = stroke_base * random.uniform(1-COHERENCE_JITTER, 1+COHERENCE_JITTER) if stroke_base else _sample_total_seconds()
-                    total *= LIFESPAN_SCALE
-                    start_fade, end_fade = _split_linger_fade(total)
-                    paint_life[idx*2] = float(start_fade)
-                    paint_life[idx*2+1] = float(end_fade)
-                    paint_alpha0[idx] = a
-            else:
-                paint_ts[idx] = 0
-                paint_life[idx*2] = 0.0
-                paint_life[idx*2+1] = 0.0
-                paint_alpha0[idx] = 0
-            ev_pixels.append({"x":x,"y":y,"r":r,"g":g,"b":b,"a":a})
-        # persist
-        with open(PAINT_STATE_FILE, "wb") as f: f.write(paint_rgba)
-        with open(PAINT_TS_FILE, "wb") as f: paint_ts.tofile(f)
-        with open(PAINT_LIFE_FILE, "wb") as f: paint_life.tofile(f)
-        with open(PAINT_ALPHA0_FILE, "wb") as f: paint_alpha0.tofile(f)
-    if ev_pixels:
-        _register_paint(len(ev_pixels))
-        ev = {"id": str(uuid.uuid4()), "ts": time.time(), "pixels": ev_pixels}
-        with events_lock:
-            paint_events.append(ev)
-    return jsonify(status="ok", changed=len(ev_pixels))
+    chunks = [_parse_pixels(pixels)] if pixels else []
+    try:
+        chunks += _parse_ops(ops)
+    except ValueError as e:
+        return jsonify(status="error", message=str(e)), 400
+    try:
+        n_changed = paint_writer.submit(chunks) if chunks else 0
+    except TimeoutError:
+        resp = jsonify(status="error", message="canvas is busy, try again")
+        resp.headers["Retry-After"] = "1"
+        return resp, 503
+    return jsonify(status="ok", changed=n_changed)
+
+def _wants_binary() -> bool:
+    """Opt-in binary responses: only when the client explicitly prefers octet-stream."""
+    return request.accept_mimetypes.best_match(["application/json", "application/octet-stream"]) == "application/octet-stream"
+
+def _binary_response(payload: bytes, headers: dict):
+    if "deflate" in request.headers.get("Accept-Encoding", "") and len(payload) > 256:
+        payload = zlib.compress(payload, 6)
+        headers["Content-Encoding"] = "deflate"
+    headers["Vary"] = "Accept, Accept-Encoding"
+    return Response(payload, mimetype="application/octet-stream", headers=headers)
+
+def _paint_resync_event():
+    """Full-canvas fallback for a client whose cursor can't be served."""
+    snap = paint_view.current()
+    return {"id": snap.tag, "pixels": b"", "resync": True, "canvas": snap.rgba()}
+
+def _paint_event_json(ev: dict) -> dict:
+    out = {"id": ev["id"], "pixels": unpack_pixels(ev["pixels"], PAINT_W)}
+    if "ts" in ev: out["ts"] = ev["ts"]
+    if ev.get("merged"): out["merged"] = ev["merged"]
+    if ev.get("resync"):
+        out.update(resync=True, paintOverlayData_b64=base64.b64encode(ev["canvas"]).decode("utf-8"), w=PAINT_W, h=PAINT_H)
+    return out
+
+def _paint_catchup(cursor: str, merge: str = ""):
+    """Events after `cursor`, shaped for a client: as-is, coalesced into one event
+    when the client is far behind, or a single resync event when the cursor can't
+    be served. merge="1" always coalesces, merge="0" never does."""
+    _sync_foreign_paints()
+    events = paint_events.since(cursor)
+    if events is None:
+        return [_paint_resync_event()]
+    if len(events) > 1 and (merge == "1" or (merge != "0" and len(events) > PAINT_EVENTS_MERGE_AFTER)):
+        pixels = PaintEventLog.coalesce(events)
+        if len(pixels) // PIXEL.size > PIX_COUNT * PAINT_EVENTS_RESYNC_FRAC:
+            return [_paint_resync_event()]
+        events = [{"id": events[-1]["id"], "ts": events[-1]["ts"], "pixels": pixels, "merged": len(events)}]
+    return events
 
 @app.get("/api/paint_events")
 def api_paint_events():
+    """Events after `since`, oldest first (see _paint_catchup).
+    With `Accept: application/octet-stream` the body is the events' pixels back to
+    back as 8-byte records (uint32 LE index, r, g, b, a), the new cursor is in
+    X-Paint-Cursor, and a resync is flagged by X-Paint-Resync with the raw RGBA
+    canvas as the body."""
     since = request.args.get("since", "")
-    with events_lock:
-        events = list(paint_events)
-    if not events:
-        return jsonify([])
     if not since:
-        return jsonify([{"id": events[-1]["id"], "pixels": []}])
-    out = []
-    for ev in reversed(events):
-        if ev["id"] == since: break
-        out.append(ev)
-    out.reverse()
-    return jsonify(out)
+        events = [{"id": paint_events.head_id(), "pixels": b""}]
+    else:
+        events = _paint_catchup(since, request.args.get("merge", ""))
+    if _wants_binary():
+        headers = {"X-Paint-Cursor": events[-1]["id"] if events else paint_events.head_id()}
+        if events and events[-1].get("resync"):
+            headers.update({"X-Paint-Resync": "1", "X-Canvas-Width": str(PAINT_W), "X-Canvas-Height": str(PAINT_H)})
+            return _binary_response(events[-1]["canvas"], headers)
+        return _binary_response(b"".join(ev["pixels"] for ev in events), headers)
+    return jsonify([_paint_event_json(ev) for ev in events])
+
+@app.get("/api/stream")
+def api_stream():
+    """Server-Sent Events: `paint` deltas, `resync` full canvases, `state` updates and
+    finished web `say` jobs.
+    Reconnects resume from Last-Event-ID. Each client catches up from its own
+    cursor when woken, so a slow reader gets coalesced frames, never a backlog."""
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    if request.method == "HEAD":
+        return Response(mimetype="text/event-stream", headers=headers)
+    if not stream_slots.acquire():
+        return jsonify(error="too many stream clients, poll instead"), 503
+    cursor = request.headers.get("Last-Event-ID") or request.args.get("since") or paint_events.head_id()
+
+    def gen():
+        nonlocal cursor
+        sent_state = -1
+        sent = {}           # babyState as this client last saw it; later frames carry only changed fields
+        sent_jobs = say_jobs.done_seq
+        yield "retry: 2000\n\n"
+        while True:
+            seen = stream_notifier.version
+            for ev in _paint_catchup(cursor):
+                cursor = ev["id"]
+                yield sse("resync" if ev.get("resync") else "paint", _paint_event_json(ev), id=cursor)
+            with state_lock:
+                diff = {k: v for k, v in babyState.items() if k not in sent or sent[k] != v} \
+                    if state_version != sent_state else None
+                sent_state = state_version
+            if diff:
+                sent.update(diff)
+                yield sse("state", diff)
+            for job in say_jobs.finished_since(sent_jobs):
+                sent_jobs = job["done_seq"]
+                if job["payload"]["platform"] == "web":
+                    yield sse("say", _say_job_json(job))
+            if stream_notifier.wait(seen, STREAM_HEARTBEAT_SECONDS) == seen:
+                yield ": ping\n\n"
+
+    # the slot is released when the server closes the body, whether or not it ever started
+    return Response(SlotStream(stream_slots, gen()), mimetype="text/event-stream", headers=headers)
 
 # --- Legacy alias (frontend might call /paint_events) ---
 @app.get("/paint_events")
 def legacy_paint_events():
     return api_paint_events()
 
+# ---- Timeline ----
+def _timeline_times(default_frames=60):
+    """Evenly spaced timestamps from ?start=&end=&frames= (unix seconds;
+    default the last hour).  Raises ValueError on bad input."""
+    end = float(request.args.get("end") or time.time())
+    start = float(request.args.get("start") or end - 3600)
+    n = int(request.args.get("frames", default_frames))
+    if not (start <= end and 1 <= n <= TIMELINE_MAX_FRAMES):
+        raise ValueError(f"need start <= end and 1..{TIMELINE_MAX_FRAMES} frames")
+    step = (end - start) / (n - 1) if n > 1 else 0
+    return [start + i * step for i in range(n)]
+
+@app.get("/api/timeline")
+def api_timeline():
+    """What the timeline holds: {start, end, segments, keyframes, deltas, bytes}."""
+    return jsonify(**timeline.stats(), w=PAINT_W, h=PAINT_H, step_seconds=TIMELINE_STEP_SECONDS)
+
+@app.get("/api/timeline/canvas")
+def api_timeline_canvas():
+    """The canvas as it was at ?ts= (unix seconds).  JSON like
+    /api/get_paint_canvas, the raw RGBA with `Accept: application/octet-stream`,
+    or a PNG with ?format=png (&scale=N)."""
+    try:
+        ts = float(request.args.get("ts") or time.time())
+        scale = int(request.args.get("scale", 1))
+    except ValueError:
+        return jsonify(error="ts must be a number and scale an integer"), 400
+    if not 1 <= scale <= canvas_png.max_scale:
+        return jsonify(error=f"scale must be 1..{canvas_png.max_scale}"), 400
+    got = timeline.at(ts)
+    if got is None:
+        return jsonify(error="no timeline before that moment"), 404
+    rgba, w, h = got
+    headers = {"X-Canvas-Width": str(w), "X-Canvas-Height": str(h)}
+    if request.args.get("format") == "png":
+        return Response(encode_png(rgba, w, h, scale), mimetype="image/png", headers=headers)
+    if _wants_binary():
+        return _binary_response(rgba, headers)
+    return jsonify(ts=ts, w=w, h=h, paintOverlayData_b64=base64.b64encode(rgba).decode("utf-8"))
+
+@app.get("/api/timeline/frames")
+def api_timeline_frames():
+    """?start=&end=&frames=N evenly spaced canvases:
+    {frames: [{ts, w, h, paintOverlayData_b64}]}, oldest first."""
+    try:
+        times = _timeline_times()
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+    frames = [{"ts": t, "w": w, "h": h, "paintOverlayData_b64": base64.b64encode(rgba).decode("utf-8")}
+              for t, rgba, w, h in timeline.frames(times)]
+    return jsonify(frames=frames)
+
+@app.get("/api/timeline/export")
+def api_timeline_export():
+    """Time-lapse of ?start=&end= as a looping animation: ?frames=N
+    (default 120), &fps= (default 12), &scale=, &format=apng|gif."""
+    try:
+        times = _timeline_times(default_frames=120)
+        fps = min(max(float(request.args.get("fps", 12)), 1), 50)
+        scale = int(request.args.get("scale", 4))
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+    fmt = request.args.get("format", "apng")
+    if fmt not in ("apng", "gif"):
+        return jsonify(error="format must be apng or gif"), 400
+    if not 1 <= scale <= min(canvas_png.max_scale, 16):
+        return jsonify(error=f"scale must be 1..{min(canvas_png.max_scale, 16)}"), 400
+    frames = timeline.frames(times)
+    if not frames:
+        return jsonify(error="no timeline in that range"), 404
+    w, h = max(f[2] for f in frames), max(f[3] for f in frames)
+    if len(frames) * w * scale * h * scale > TIMELINE_EXPORT_MAX_PIXELS:
+        return jsonify(error=f"too large: frames x {w * scale}x{h * scale} is over {TIMELINE_EXPORT_MAX_PIXELS} pixels, "
+                             "ask for fewer frames or a smaller scale"), 400
+    try:
+        body = encode_animation([f[1:] for f in frames], scale=scale, fps=fps, fmt=fmt)
+    except RuntimeError as e:
+        return jsonify(error=str(e)), 503
+    return Response(body, mimetype="image/gif" if fmt == "gif" else "image/apng",
+                    headers={"Content-Disposition": f'inline; filename="bby-timelapse.{"gif" if fmt == "gif" else "png"}"'})
+
 # ---- Snapshots ----
 @app.post("/api/snapshot")
 def api_snapshot():
     data = request.json or {}
     label = (data.get("label") or "").strip()
-    meta = _save_snapshot(label)
+    b64 = data.get("composite_png_b64")
+    meta = _save_snapshot(label, render_png=not b64)
     if not meta:
         return jsonify(status="error", message="failed"), 500
-    b64 = data.get("composite_png_b64")
     if b64:
         try:
             _attach_png(meta["id"], _b64_to_bytes(b64))
@@ -1114,13 +1895,7 @@ def api_snapshots():
 def api_snapshots_latest():
     base = _get_base_url()
     # prefer the newest item that has a png; otherwise fall back to newest overall
-    latest = None
-    for m in reversed(snapshot_index):
-        if m.get('has_png'):
-            latest = m
-            break
-    if latest is None:
-        latest = snapshot_index[-1] if snapshot_index else None
+    latest = snapshot_index.latest("has_png") or snapshot_index.last()
     if not latest:
         return jsonify({}), 200
     it = dict(latest)
@@ -1158,7 +1933,8 @@ def api_gallery_index_count():
 @app.post("/api/gallery/save")
 def api_gallery_save():
     try:
-        body = request.get_data(cache=False)
+        # JSON bodies carry png_b64; anything else is the raw image
+        body = None if request.is_json else request.get_data(cache=False)
         if body:
             img = body
             # Headers are ASCII only, so values may be percent-encoded to allow
@@ -1178,7 +1954,9 @@ def api_gallery_save():
             snap_id= str(j.get("snap_id")) if j.get("snap_id") else None
         meta = _add_to_gallery(img, author=author, title=title, label=label, snap_id=snap_id)
         base = _get_base_url()
-        return jsonify(ok=True, id=meta["id"], url=f"{base}/api/gallery/file/{meta['file']}", title=meta.get("title",""))
+        # processing continues in the background; the file URL waits briefly for it
+        return jsonify(ok=True, id=meta["id"], url=f"{base}/api/gallery/file/{meta['file']}", title=meta.get("title",""),
+                       status=meta["status"], status_url=f"{base}/api/gallery/status/{meta['id']}")
     except ValueError as e:
         return jsonify(ok=False, error=str(e)), 413
     except Exception as e:
@@ -1186,23 +1964,30 @@ def api_gallery_save():
 
 @app.get("/api/gallery")
 def api_gallery_list():
-    base = _get_base_url()
-    out = []
-    for m in reversed(gallery_index[-200:]):
-        it = dict(m)
-        it["url"] = f"{base}/api/gallery/file/{m['file']}"
-        # Provide a stable 'timestamp' alias alongside legacy 'ts'
-        if 'timestamp' not in it:
-            it['timestamp'] = it.get('ts')
-        # Compatibility: some external clients may look for a 'stamp' field
-        # intending a timestamp; provide it as an alias to avoid misusing
-        # unrelated 'stamp' concepts elsewhere (e.g., thumbnail stamps).
-        if 'stamp' not in it:
-            it['stamp'] = it.get('ts')
-        if m.get("stamp_file"):
-            it["stamp_url"] = f"{base}/api/gallery/file/{m['stamp_file']}"
-        out.append(it)
-    return jsonify(out)
+    """Newest 200 items as a bare array (legacy shape); see /api/gallery/page for the rest."""
+    body = gallery_listing.page(_get_base_url(), limit=200, bare=True)
+    return Response(body, mimetype="application/json")
+
+@app.get("/api/gallery/page")
+def api_gallery_page():
+    """Cursor-paginated gallery, newest first.
+    ?limit=1..200 (default 50), ?before=<cursor> for older items or ?after=<cursor> for newer,
+    ?author=<name>, ?hue=0..359 with ?hue_range=<degrees> (default 20); hue matches the
+    average colour or any colour covering 20%+ of the palette.
+    Returns {items, total, next, prev}; pass `next` as ?before= to continue."""
+    try:
+        limit = min(max(int(request.args.get("limit", 50)), 1), 200)
+        hue = request.args.get("hue")
+        hue = int(hue) % 360 if hue not in (None, "") else None
+        hue_range = min(max(int(request.args.get("hue_range", 20)), 0), 180)
+    except ValueError:
+        return jsonify(error="limit, hue and hue_range must be integers"), 400
+    body = gallery_listing.page(
+        _get_base_url(), limit=limit,
+        before=request.args.get("before") or None, after=request.args.get("after") or None,
+        author=(request.args.get("author") or "").strip() or None,
+        hue=hue, hue_range=hue_range)
+    return Response(body, mimetype="application/json")
 
 @app.post("/api/gallery/update_meta")
 def api_gallery_update_meta():
@@ -1211,25 +1996,47 @@ def api_gallery_update_meta():
     if not gid: return jsonify(ok=False, error="missing id"), 400
     new_title = (data.get("title") or "").strip()
     new_label = (data.get("label") or "").strip()
-    found = False
-    for m in gallery_index:
-        if m.get("id") == gid:
-            if new_title:
-                m["title"] = new_title
-                if not new_label:
-                    m["label"] = m.get("label") or new_title
-            if new_label:
-                m["label"] = new_label
-            found = True
-            break
-    if not found: return jsonify(ok=False, error="not found"), 404
-    _save_json(GALL_IDX, gallery_index)
+    m = gallery_index.get(gid)
+    if not m: return jsonify(ok=False, error="not found"), 404
+    changes = {}
+    if new_title:
+        changes["title"] = new_title
+        if not new_label:
+            changes["label"] = m.get("label") or new_title
+    if new_label:
+        changes["label"] = new_label
+    gallery_index.update(gid, **changes)
+    _save_gallery_index()
     return jsonify(ok=True)
 
+@app.get("/api/gallery/status/<gid>")
+def api_gallery_status(gid):
+    """Processing status of an upload: pending, ready or failed.  `?wait=N`
+    long-polls up to 30s for a pending one to finish."""
+    try:
+        wait = min(max(float(request.args.get("wait", 0)), 0.0), 30.0)
+    except ValueError:
+        wait = 0.0
+    job = image_pipeline.wait(gid, wait) if wait else image_pipeline.status(gid)
+    meta = gallery_index.get(gid)
+    if meta is None:
+        if job and job["status"] == "failed":
+            return jsonify(id=gid, status="failed", error=job["error"])
+        return jsonify(error="not found"), 404
+    out = {"id": gid, "status": meta.get("status", "ready"), "url": f"{_get_base_url()}/api/gallery/file/{meta['file']}"}
+    if meta.get("stamp_file"):
+        out["stamp_url"] = f"{_get_base_url()}/api/gallery/file/{meta['stamp_file']}"
+    return jsonify(out)
+
 @app.get("/api/gallery/file/<fname>")
 def api_gallery_file(fname):
     if not fname.endswith(".png"): return ("forbidden", 403)
     path = os.path.join(GALL_DIR, fname)
+    if not os.path.exists(path):
+        # a just-uploaded image (or its stamp) may still be processing
+        meta = gallery_index.by("file", fname.replace(".stamp.png", ".png"))
+        if meta and meta.get("status") == "pending":
+            image_pipeline.wait(meta["id"], IMAGE_FILE_WAIT)
     if not os.path.exists(path): return ("not found", 404)
     return send_from_directory(GALL_DIR, fname, mimetype="image/png")
 
@@ -1243,7 +2050,7 @@ def delete_gallery_image(img_id):
 
     try:
         # Find the metadata record first, whether by ID or filename
-        target_meta = next((m for m in gallery_index if m.get('id') == img_id or m.get('file') == img_id), None)
+        target_meta = gallery_index.find(img_id)
         if not target_meta:
             return jsonify({"status": "error", "message": "not found"}), 404
 
@@ -1255,7 +2062,7 @@ def delete_gallery_image(img_id):
         if main_file:
             path = os.path.join(GALL_DIR, main_file)
             if os.path.isfile(path):
-                os.remove(path)
+                blobs.unlink(path)      # the blob stays while other uploads share it
                 deleted["image"] = True
         
         # Delete stamp file if it exists
@@ -1263,15 +2070,13 @@ def delete_gallery_image(img_id):
         if stamp_file:
             path = os.path.join(GALL_DIR, stamp_file)
             if os.path.isfile(path):
-                os.remove(path)
+                blobs.unlink(path)
                 deleted["stamp"] = True
 
         # Remove from index by its ID
-        before = len(gallery_index)
-        gallery_index[:] = [m for m in gallery_index if m.get('id') != target_id]
-        if len(gallery_index) != before:
+        if gallery_index.remove(target_id):
             deleted["index"] = True
-            _save_json(GALL_IDX, gallery_index)
+            _save_gallery_index()
 
         if not deleted:
             return jsonify({"status": "error", "message": "index entry found but no files to delete"}), 404
@@ -0,0 +1,196 @@
+"""Drawing primitives for /api/paint_pixel.
+
+A drag, a clear or a fill used to arrive as one {x,y,r,g,b,a} dict per pixel;
+these let the client send the shape instead and expand it here into pixel
+indices (row-major, clipped to the canvas).  Every function returns indices
+only, with the colour passed alongside them, so the server's one paint loop
+(lifespans, REPAINT_POLICY, journal, events) handles primitives and single
+pixels alike.
+
+    python bbyShapes.py     # request size and parse cost, pixels vs. ops
+"""
+
+
+def _clip(x0, y0, x1, y1, xmin, ymin, xmax, ymax):
+    """Liang-Barsky: the part of the segment inside the box, rounded to whole
+    pixels, or None if it misses the box."""
+    t0, t1 = 0.0, 1.0
+    dx, dy = x1 - x0, y1 - y0
+    for p, q in ((-dx, x0 - xmin), (dx, xmax - x0), (-dy, y0 - ymin), (dy, ymax - y0)):
+        if p == 0:
+            if q < 0:
+                return None
+        elif p < 0:
+            t0 = max(t0, q / p)
+        else:
+            t1 = min(t1, q / p)
+        if t0 > t1:
+            return None
+    return (round(x0 + t0 * dx), round(y0 + t0 * dy), round(x0 + t1 * dx), round(y0 + t1 * dy))
+
+
+def line(x0, y0, x1, y1, width, w, h):
+    """Bresenham segment from (x0, y0) to (x1, y1), stamped with a round brush
+    `width` pixels across.  The segment is clipped to the canvas (plus the
+    brush) first, so far-off endpoints cost nothing."""
+    pad = max(1, width)
+    seg = _clip(x0, y0, x1, y1, -pad, -pad, w - 1 + pad, h - 1 + pad)
+    if seg is None:
+        return []
+    x0, y0, x1, y1 = seg
+    pts = []
+    dx, dy = abs(x1 - x0), -abs(y1 - y0)
+    sx, sy = (1 if x0 < x1 else -1), (1 if y0 < y1 else -1)
+    err = dx + dy
+    while True:
+        pts.append((x0, y0))
+        if x0 == x1 and y0 == y1:
+            break
+        e2 = 2 * err
+        if e2 >= dy:
+            err += dy; x0 += sx
+        if e2 <= dx:
+            err += dx; y0 += sy
+    if width <= 1:
+        return [y * w + x for x, y in pts if 0 <= x < w and 0 <= y < h]
+    # a round brush swept along a segment is convex, so each row it covers is one run
+    lo = -((width - 1) // 2)
+    c = lo + (width - 1) / 2.0          # brush centre (between pixels for even widths)
+    r2 = (width / 2.0) ** 2
+    brush = []                          # (dy, first dx, last dx) per brush row
+    for by in range(lo, lo + width):
+        xs = [bx for bx in range(lo, lo + width) if (bx - c) ** 2 + (by - c) ** 2 <= r2]
+        if xs:
+            brush.append((by, xs[0], xs[-1]))
+    rows = {}
+    for x, y in pts:
+        for by, bx0, bx1 in brush:
+            py = y + by
+            run = rows.get(py)
+            if run is None:
+                rows[py] = [x + bx0, x + bx1]
+            else:
+                if x + bx0 < run[0]: run[0] = x + bx0
+                if x + bx1 > run[1]: run[1] = x + bx1
+    out = []
+    for py in sorted(rows):
+        if 0 <= py < h:
+            x0, x1 = max(0, rows[py][0]), min(w - 1, rows[py][1])
+            out.extend(range(py * w + x0, py * w + x1 + 1))
+    return out
+
+
+def rect(x, y, rw, rh, w, h):
+    """Filled rectangle, clipped."""
+    x0, y0, x1, y1 = max(0, x), max(0, y), min(w, x + rw), min(h, y + rh)
+    if x0 >= x1 or y0 >= y1:
+        return []
+    if x0 == 0 and x1 == w:
+        return range(y0 * w, y1 * w)
+    out = []
+    for row in range(y0, y1):
+        out.extend(range(row * w + x0, row * w + x1))
+    return out
+
+
+def spans(runs, w, h):
+    """Run-length spans: `runs` is flat [x, y, length, x, y, length, ...];
+    each run goes right from (x, y) and is clipped to its row."""
+    out = []
+    for i in range(0, len(runs) - 2, 3):
+        x, y, n = runs[i], runs[i + 1], runs[i + 2]
+        if 0 <= y < h:
+            out.extend(range(y * w + max(0, x), y * w + min(w, x + n)))
+    return out
+
+
+def flood(rgba, w, h, x, y, limit):
+    """Indices of the 4-connected region around (x, y) with the seed's colour
+    (any fully transparent pixel counts as the same colour), read from the
+    live `rgba` buffer.  None if the region is larger than `limit`."""
+    if not (0 <= x < w and 0 <= y < h):
+        return []
+    px = memoryview(rgba).cast("B").cast("I")
+    seed = y * w + x
+    clear = rgba[seed * 4 + 3] == 0
+    target = px[seed]
+
+    def same(i):
+        return rgba[i * 4 + 3] == 0 if clear else px[i] == target
+
+    seen = bytearray(w * h)
+    out = []
+    stack = [seed]
+    while stack:
+        i = stack.pop()
+        if seen[i] or not same(i):
+            continue
+        row = i - i % w
+        lo = i
+        while lo > row and not seen[lo - 1] and same(lo - 1):
+            lo -= 1
+        hi = i
+        while hi + 1 < row + w and not seen[hi + 1] and same(hi + 1):
+            hi += 1
+        seen[lo:hi + 1] = b"\1" * (hi + 1 - lo)
+        out.extend(range(lo, hi + 1))
+        if len(out) > limit:
+            return None
+        for nrow in (row - w, row + w):
+            if 0 <= nrow < w * h:
+                # one seed per matching run in the neighbouring row
+                inside = False
+                for j in range(nrow + (lo - row), nrow + (hi - row) + 1):
+                    if not seen[j] and same(j):
+                        if not inside:
+                            stack.append(j)
+                            inside = True
+                    else:
+                        inside = False
+    return out
+
+
+def _bench(w=64, h=64):
+    import json, time
+
+    def parse_pixels(body):
+        out = []
+        for p in json.loads(body)["pixels"]:
+            x, y = int(p["x"]), int(p["y"])
+            r, g, b, a = int(p["r"]), int(p["g"]), int(p["b"]), int(p["a"])
+            if 0 <= x < w and 0 <= y < h:
+                out.append((y * w + x, r, g, b, a))
+        return out
+
+    def parse_ops(body):
+        out = []
+        for op in json.loads(body)["ops"]:
+            if op["op"] == "rect":
+                out.append((rect(int(op["x"]), int(op["y"]), int(op["w"]), int(op["h"]), w, h), op["r"]))
+            elif op["op"] == "line":
+                out.append((line(int(op["x0"]), int(op["y0"]), int(op["x1"]), int(op["y1"]), int(op["width"]), w, h), op["r"]))
+        return out
+
+    colour = {"r": 200, "g": 40, "b": 90, "a": 255}
+    cases = {
+        "whole-canvas fill": (
+            [dict(x=x, y=y, **colour) for y in range(h) for x in range(w)],
+            [dict(op="rect", x=0, y=0, w=w, h=h, **colour)]),
+        "3px brush drag": (
+            [dict(x=w * 3 // 4 - (y * 3) // 4 + k, y=y, **colour) for y in range(h) for k in range(3)],
+            [dict(op="line", x0=w * 3 // 4, y0=0, x1=w * 3 // 4 - ((h - 1) * 3) // 4, y1=h - 1, width=3, **colour)]),
+    }
+    for name, (pixels, ops) in cases.items():
+        a, b = json.dumps({"pixels": pixels}), json.dumps({"ops": ops})
+        res = []
+        for fn, body in ((parse_pixels, a), (parse_ops, b)):
+            t0 = time.perf_counter()
+            for _ in range(20):
+                fn(body)
+            res.append((time.perf_counter() - t0) / 20 * 1000)
+        print(f"[SHAPES] {name}: {len(a)} B as pixels vs {len(b)} B as ops; "
+              f"parse {res[0]:.2f} ms vs {res[1]:.3f} ms")
+
+
+if __name__ == "__main__":
+    _bench()
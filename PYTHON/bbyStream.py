@@ -0,0 +1,86 @@
+"""Server-Sent Events plumbing for /api/stream.
+
+Publishers (paint writes, the fade loop, state sync) only bump a version
+counter; each connected client keeps its own cursor into `paint_events` and its
+own last-sent state version, and catches up when woken.  A client that reads
+slowly therefore never queues anything server-side: by the time it is ready
+again the deltas it missed are coalesced into one frame (or a resync).
+
+The waits are plain `threading.Condition` waits, so under gevent
+(`gunicorn -k gevent bbyServer:app`, which monkey-patches threading) an idle
+viewer is a parked greenlet rather than a blocked worker thread.
+"""
+import json, threading
+
+
+class ChangeNotifier:
+    def __init__(self):
+        self._cv = threading.Condition()
+        self.version = 0
+
+    def bump(self):
+        with self._cv:
+            self.version += 1
+            self._cv.notify_all()
+
+    def wait(self, seen, timeout):
+        """Block until the version moves past `seen` or `timeout` passes.
+        Returns the current version (== seen on timeout)."""
+        with self._cv:
+            if self.version == seen:
+                self._cv.wait(timeout)
+            return self.version
+
+
+class ClientSlots:
+    """Caps concurrent streams so a threaded deployment can't be starved by
+    viewers; clients over the cap fall back to polling."""
+    def __init__(self, limit):
+        self.limit = limit
+        self.active = 0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            if self.limit and self.active >= self.limit:
+                return False
+            self.active += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self.active -= 1
+
+
+class SlotStream:
+    """Response body that holds a ClientSlots slot until the server closes it.
+    A generator's `finally` never runs when it is closed before its first
+    item (e.g. a HEAD request, or a client gone before the first write);
+    close() always does."""
+    def __init__(self, slots, body):
+        self.slots = slots
+        self.body = body
+        self._closed = False
+
+    def __iter__(self):
+        return iter(self.body)
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            if hasattr(self.body, "close"):
+                self.body.close()
+        finally:
+            self.slots.release()
+
+
+def sse(event, data, id=None):
+    """Format one SSE frame."""
+    out = []
+    if id is not None:
+        out.append(f"id: {id}")
+    out.append(f"event: {event}")
+    out.append("data: " + json.dumps(data, separators=(",", ":"), ensure_ascii=False))
+    return "\n".join(out) + "\n\n"
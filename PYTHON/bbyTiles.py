@@ -0,0 +1,224 @@
+"""Fixed-size tiles over the shared paint canvas.
+
+The paint buffers stay flat and row-major (snapshots, full-canvas fetches and
+the journal all want that); tiles are an overlay on top.  `TileTable` keeps one
+version per tile in its own small mapping, shared by every worker like the
+canvas: the canvas write_seq of the tile's last change.  That one number serves
+as the tile's dirty bit (version > the canvas' flushed_seq), as the key for
+viewport fetches (`?since=` returns only tiles newer than the cursor) and tells
+the aging leader which tiles another process touched.
+
+Call `mark()` under paint_lock, right after the journal commit that drew the
+sequence number.  `python bbyTiles.py` benchmarks a sparse 1024x1024 canvas.
+
+`CanvasView` publishes an immutable copy of the canvas, per tile, after every
+write, so readers (canvas fetches, tile fetches, resyncs, snapshots) never take
+paint_lock: only the tiles whose version moved are copied again.
+"""
+import mmap, os, struct, threading
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+MAGIC = b"BBYT"
+HEADER = struct.Struct("<4sIII")    # magic, width, height, tile size
+HEADER_SIZE = 64
+
+
+class TileTable:
+    def __init__(self, path, width, height, tile=64):
+        self.path = path
+        self.width = width
+        self.height = height
+        self.tile = tile
+        self.cols = -(-width // tile)
+        self.rows = -(-height // tile)
+        self.count = self.cols * self.rows
+        self.size = HEADER_SIZE + self.count * 8
+        self.created = False
+        self._open()
+        self.versions = memoryview(self._mm)[HEADER_SIZE:self.size].cast("Q")
+
+    def _open(self):
+        init_fd = os.open(self.path + ".init", os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if fcntl:
+                fcntl.flock(init_fd, fcntl.LOCK_EX)
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                head = os.pread(fd, HEADER.size, 0)
+                want = HEADER.pack(MAGIC, self.width, self.height, self.tile)
+                if head != want or os.fstat(fd).st_size < self.size:
+                    # new, or the canvas was resized/retiled: versions start over
+                    os.ftruncate(fd, 0)
+                    os.ftruncate(fd, self.size)
+                    os.pwrite(fd, want, 0)
+                    self.created = True
+                self._mm = mmap.mmap(fd, self.size)
+            finally:
+                os.close(fd)
+        finally:
+            os.close(init_fd)
+
+    # ---- geometry ----
+    def tile_of(self, idx):
+        y, x = divmod(idx, self.width)
+        return (y // self.tile) * self.cols + x // self.tile
+
+    def rect(self, t):
+        """(x, y, w, h) of tile `t`; edge tiles are clipped to the canvas."""
+        ty, tx = divmod(t, self.cols)
+        x, y = tx * self.tile, ty * self.tile
+        return x, y, min(self.tile, self.width - x), min(self.tile, self.height - y)
+
+    def runs(self, t):
+        """Pixel index ranges (lo, hi), one per row of tile `t`."""
+        x, y, w, h = self.rect(t)
+        base = y * self.width + x
+        return [(base + r * self.width, base + r * self.width + w) for r in range(h)]
+
+    def in_view(self, x, y, w, h):
+        """Tiles overlapping the pixel rectangle, clipped to the canvas."""
+        x0, y0 = max(0, x), max(0, y)
+        x1, y1 = min(self.width, x + w), min(self.height, y + h)
+        if x0 >= x1 or y0 >= y1:
+            return []
+        t = self.tile
+        return [ty * self.cols + tx for ty in range(y0 // t, (y1 - 1) // t + 1)
+                                    for tx in range(x0 // t, (x1 - 1) // t + 1)]
+
+    def bands(self, tiles):
+        """Row ranges (y0, y1) covered by `tiles`, merged, for flushing."""
+        rows = sorted({t // self.cols for t in tiles})
+        out = []
+        for ty in rows:
+            y0, y1 = ty * self.tile, min(self.height, (ty + 1) * self.tile)
+            if out and out[-1][1] == y0:
+                out[-1] = (out[-1][0], y1)
+            else:
+                out.append((y0, y1))
+        return out
+
+    def extract(self, buf, t, bpp=4):
+        """Tile `t` of a row-major buffer (`bpp` bytes per pixel) as packed rows."""
+        return b"".join(bytes(buf[lo * bpp:hi * bpp]) for lo, hi in self.runs(t))
+
+    # ---- versions (call under paint_lock) ----
+    def mark(self, tiles, seq):
+        v = self.versions
+        for t in tiles:
+            v[t] = seq
+
+    def mark_all(self, seq):
+        self.mark(range(self.count), seq)
+
+    def changed_since(self, seq):
+        v = self.versions
+        return [t for t in range(self.count) if v[t] > seq]
+
+
+class CanvasSnapshot:
+    """The canvas at one write_seq: `tiles[t]` is tile t's RGBA (packed rows),
+    `versions[t]` its version, `tag` whatever the view's tag_source returned."""
+    __slots__ = ("seq", "versions", "tiles", "tag", "_grid", "_rgba")
+
+    def __init__(self, grid, seq, versions, tiles, tag):
+        self._grid = grid
+        self.seq = seq
+        self.versions = versions
+        self.tiles = tiles
+        self.tag = tag
+        self._rgba = None
+
+    def rgba(self):
+        """The whole canvas as row-major RGBA bytes (assembled once per snapshot)."""
+        if self._rgba is None:
+            g = self._grid
+            if g.cols == 1:
+                self._rgba = b"".join(self.tiles)
+            else:
+                rows = []
+                for ty in range(g.rows):
+                    band = self.tiles[ty * g.cols:(ty + 1) * g.cols]
+                    strides = [g.rect(ty * g.cols + tx)[2] * 4 for tx in range(g.cols)]
+                    for r in range(g.rect(ty * g.cols)[3]):
+                        rows.extend(data[r * w:(r + 1) * w] for data, w in zip(band, strides))
+                self._rgba = b"".join(rows)
+        return self._rgba
+
+
+class CanvasView:
+    def __init__(self, grid, rgba, lock, seq_source, tag_source=None):
+        self.grid = grid
+        self.rgba = rgba                # the live row-major buffer
+        self.lock = lock                # paint_lock
+        self.seq_source = seq_source    # -> current write_seq
+        self.tag_source = tag_source    # -> extra state to capture with the pixels (e.g. event head)
+        self._snap = None
+        self._guard = threading.Lock()  # one refresher at a time within this process
+
+    def refresh(self):
+        """Publish the canvas as it is now; call under paint_lock after writing.
+        Re-copies only tiles whose version changed since the last snapshot."""
+        with self._guard:
+            g, old = self.grid, self._snap
+            versions = tuple(g.versions)
+            if old is None:
+                tiles = tuple(g.extract(self.rgba, t) for t in range(g.count))
+            else:
+                tiles = tuple(data if v == ov else g.extract(self.rgba, t)
+                              for t, (v, ov, data) in enumerate(zip(versions, old.versions, old.tiles)))
+            tag = self.tag_source() if self.tag_source else None
+            self._snap = CanvasSnapshot(g, self.seq_source(), versions, tiles, tag)
+            return self._snap
+
+    def current(self):
+        """Latest snapshot, without locking unless the canvas moved on since it
+        was published (another worker painted, or a write is mid-flight)."""
+        snap = self._snap
+        if snap is not None and snap.seq == self.seq_source():
+            return snap
+        with self.lock:
+            snap = self._snap
+            if snap is not None and snap.seq == self.seq_source():
+                return snap
+            return self.refresh()
+
+
+def _bench(side=1024, painted_tiles=6, per_tile=500):
+    """Sparse big canvas: aging rebuild with and without tile skipping, and a
+    viewport fetch against the whole canvas."""
+    import array, random, tempfile, time
+    from bbyAging import PixelAger
+    rnd = random.Random(1)
+    n = side * side
+    tiles = TileTable(os.path.join(tempfile.mkdtemp(), "tiles"), side, side)
+    rgba = bytearray(n * 4)
+    ts = array.array("Q", [0]) * n
+    life = array.array("f", [0.0]) * (n * 2)
+    alpha0 = bytearray(n)
+    now = int(time.time())
+    for t in rnd.sample(range(tiles.count), painted_tiles):
+        for _ in range(per_tile):
+            lo, hi = rnd.choice(tiles.runs(t))
+            i = rnd.randrange(lo, hi)
+            rgba[i*4:i*4+4] = bytes((200, 30, 40, 255))
+            ts[i], life[i*2], life[i*2+1], alpha0[i] = now, 3600.0, 7200.0, 255
+    ager = PixelAger(rgba, ts, life, alpha0, side, grid=tiles)
+    for label, run in (("every pixel", lambda: ager._rescan_all()),
+                       ("tile-skipping", lambda: ager.rebuild()),
+                       ("one foreign tile", lambda: ager.rebuild([tiles.tile_of(ts.index(now))]))):
+        t0 = time.perf_counter()
+        run()
+        print(f"[TILES] {side}x{side}, {painted_tiles} painted tiles: aging rebuild ({label}) "
+              f"{(time.perf_counter() - t0) * 1000:.1f} ms, {len(ager)} live pixels")
+    view = tiles.in_view(0, 0, 256, 192)
+    t0 = time.perf_counter()
+    body = b"".join(tiles.extract(rgba, t) for t in view)
+    print(f"[TILES] 256x192 viewport: {len(view)} tiles, {len(body) // 1024} KB in "
+          f"{(time.perf_counter() - t0) * 1000:.1f} ms (whole canvas {n * 4 // 1024} KB)")
+
+
+if __name__ == "__main__":
+    _bench()
@@ -0,0 +1,238 @@
+"""Keyframe + delta history of the paint canvas, for replay and time-lapses.
+
+The timeline lives in segment files, timeline/<start ms>.tl, each one keyframe
+(the whole canvas, zlib'd) followed by delta records.  A delta holds the paint
+events of one recording step (pixel writes and fades, packed PIXEL records,
+each event with its own timestamp), zlib'd together.  A new segment starts
+after `keyframe_every` deltas or once the deltas since the keyframe add up to
+`keyframe_pixels`, so the canvas at any moment costs one keyframe plus a
+bounded number of deltas to rebuild, and most of the time the history is a
+few bytes per painted pixel instead of a raw copy of the whole canvas.
+
+`record()` is given the canvas as it is now along with the events since the
+last call; it checks that the events really turn the previous frame into that
+canvas and writes a keyframe instead when they don't (another worker painted,
+the event log overflowed, a restart).
+
+    python bbyTimeline.py       # storage and replay cost for a simulated hour
+"""
+import bisect, os, struct, threading, time, zlib
+from collections import OrderedDict
+
+from bbyEvents import PIXEL
+
+RECORD = struct.Struct("<cddI")     # kind (K/D), first ts, last ts, payload length
+KEY_HEAD = struct.Struct("<II")     # keyframe payload: width, height, then zlib'd RGBA
+EVENT_HEAD = struct.Struct("<dI")   # inside a delta: event ts, packed pixel bytes
+
+
+def _apply(frame, packed):
+    size = PIXEL.size
+    for off in range(0, len(packed), size):
+        i = int.from_bytes(packed[off:off + 4], "little") * 4
+        frame[i:i + 4] = packed[off + 4:off + size]
+
+
+class Timeline:
+    def __init__(self, root, keyframe_every=60, keyframe_pixels=16384, keep_days=30):
+        self.root = root
+        self.keyframe_every = keyframe_every
+        self.keyframe_pixels = keyframe_pixels
+        self.keep_seconds = keep_days * 86400
+        os.makedirs(root, exist_ok=True)
+        self._lock = threading.Lock()
+        self._records = OrderedDict()   # segment path -> [(kind, ts0, ts1, offset, length)], recently read
+        self._file = None               # segment being appended to
+        self._deltas = self._pixels = 0
+        self.frame = None               # canvas after the last record written (this process)
+        self.size = None
+
+    # ---- segments ----
+    def segments(self):
+        """Segment start times (ms) in order."""
+        return sorted(int(n[:-3]) for n in os.listdir(self.root) if n.endswith(".tl") and n[:-3].isdigit())
+
+    def _path(self, start_ms):
+        return os.path.join(self.root, f"{start_ms}.tl")
+
+    def _read_records(self, path):
+        with self._lock:
+            size = os.path.getsize(path)
+            hit = self._records.get(path)
+            if hit and hit[0] == size:
+                self._records.move_to_end(path)
+                return hit[1]
+        out, off = [], 0
+        with open(path, "rb") as f:
+            while True:
+                head = f.read(RECORD.size)
+                if len(head) < RECORD.size:
+                    break
+                kind, ts0, ts1, n = RECORD.unpack(head)
+                if off + RECORD.size + n > size:
+                    break               # torn tail from a crash mid-write
+                out.append((kind, ts0, ts1, off + RECORD.size, n))
+                f.seek(n, 1)
+                off += RECORD.size + n
+        with self._lock:
+            self._records[path] = (size, out)
+            while len(self._records) > 32:
+                self._records.popitem(last=False)
+        return out
+
+    # ---- writing ----
+    def _write(self, kind, ts0, ts1, payload):
+        self._file.write(RECORD.pack(kind, ts0, ts1, len(payload)) + payload)
+        self._file.flush()
+
+    def keyframe(self, rgba, width, height, ts=None):
+        """Start a new segment with the whole canvas."""
+        ts = ts or time.time()
+        if self._file:
+            self._file.close()
+        self._file = open(self._path(int(ts * 1000)), "ab")
+        self._write(b"K", ts, ts, KEY_HEAD.pack(width, height) + zlib.compress(bytes(rgba), 6))
+        self._deltas = self._pixels = 0
+        self.frame, self.size = bytearray(rgba), (width, height)
+        self.prune(ts)
+
+    def record(self, rgba, width, height, events, ts=None):
+        """Append what happened since the last call.  `events` are paint event
+        dicts ({"ts", "pixels"}) in order, or None when they couldn't be had;
+        `rgba` is the canvas after them.  Returns "delta", "keyframe" or None."""
+        if events is not None and not events and self.frame is not None and rgba == self.frame:
+            return None
+        if (events is None or self._file is None or self.size != (width, height)
+                or self._deltas >= self.keyframe_every or self._pixels >= self.keyframe_pixels):
+            self.keyframe(rgba, width, height, ts)
+            return "keyframe"
+        frame = bytearray(self.frame)
+        for ev in events:
+            _apply(frame, ev["pixels"])
+        if frame != rgba:               # writes we never saw an event for
+            self.keyframe(rgba, width, height, ts)
+            return "keyframe"
+        if not events:
+            return None
+        payload = b"".join(EVENT_HEAD.pack(ev["ts"], len(ev["pixels"])) + ev["pixels"] for ev in events)
+        self._write(b"D", events[0]["ts"], events[-1]["ts"], zlib.compress(payload, 6))
+        self._deltas += 1
+        self._pixels += sum(len(ev["pixels"]) for ev in events) // PIXEL.size
+        self.frame = frame
+        return "delta"
+
+    def prune(self, now=None):
+        cutoff = ((now or time.time()) - self.keep_seconds) * 1000
+        starts = self.segments()
+        # keep the segment that covers the cutoff moment
+        for start in starts[:max(0, bisect.bisect_right(starts, cutoff) - 1)]:
+            try:
+                os.remove(self._path(start))
+            except OSError:
+                pass
+
+    # ---- replay ----
+    def _play(self, start_ms, times, out):
+        """Roll segment `start_ms` forward, appending (t, rgba, w, h) to `out`
+        for each of the sorted `times` (all before the next segment starts)."""
+        path = self._path(start_ms)
+        records = self._read_records(path)
+        if not records or records[0][0] != b"K":
+            return
+        frame = size = None
+        with open(path, "rb") as f:
+            for kind, ts0, ts1, off, n in records:
+                while times and times[0] < ts0 and frame is not None:
+                    out.append((times.pop(0), bytes(frame), *size))
+                if not times:
+                    return
+                f.seek(off)
+                payload = f.read(n)
+                if kind == b"K":
+                    w, h = KEY_HEAD.unpack_from(payload)
+                    frame, size = bytearray(zlib.decompress(payload[KEY_HEAD.size:])), (w, h)
+                    continue
+                data, pos = zlib.decompress(payload), 0
+                while pos < len(data):
+                    ets, k = EVENT_HEAD.unpack_from(data, pos)
+                    pos += EVENT_HEAD.size
+                    while times and times[0] < ets:
+                        out.append((times.pop(0), bytes(frame), *size))
+                    _apply(frame, data[pos:pos + k])
+                    pos += k
+        # past the last record: the canvas stayed as the segment left it
+        while times and frame is not None:
+            out.append((times.pop(0), bytes(frame), *size))
+
+    def frames(self, times):
+        """[(t, rgba, w, h)] for each timestamp in `times` (sorted), the canvas
+        as it was then.  Times before the first keyframe are skipped; one pass
+        per segment touched, so a sequence costs little more than one frame."""
+        times = sorted(times)
+        starts = self.segments()
+        out = []
+        while times:
+            i = bisect.bisect_right(starts, times[0] * 1000) - 1
+            if i < 0:
+                times.pop(0)        # before the timeline began
+                continue
+            nxt = starts[i + 1] / 1000 if i + 1 < len(starts) else None
+            mine = [t for t in times if nxt is None or t < nxt]
+            rest = times[len(mine):]
+            self._play(starts[i], mine, out)
+            times = rest
+        return out
+
+    def at(self, ts):
+        """(rgba, w, h) as of `ts`, or None before the timeline began."""
+        got = self.frames([ts])
+        return got[0][1:] if got else None
+
+    def stats(self):
+        starts = self.segments()
+        size = keyframes = deltas = 0
+        for s in starts:
+            path = self._path(s)
+            size += os.path.getsize(path)
+            for kind, *_ in self._read_records(path):
+                keyframes += kind == b"K"
+                deltas += kind == b"D"
+        end = None
+        if starts:
+            recs = self._read_records(self._path(starts[-1]))
+            end = recs[-1][2] if recs else None
+        return {"start": starts[0] / 1000 if starts else None, "end": end, "segments": len(starts),
+                "keyframes": keyframes, "deltas": deltas, "bytes": size}
+
+
+if __name__ == "__main__":
+    import random, tempfile
+    rnd = random.Random(1)
+    w = h = 64
+    tl = Timeline(tempfile.mkdtemp())
+    canvas = bytearray(w * h * 4)
+    t = 1_700_000_000.0
+    step_events = []
+    # an hour of painting: a 12-pixel stroke every 2 s, recorded every 10 s
+    for second in range(0, 3600, 2):
+        x, y = rnd.randrange(w - 12), rnd.randrange(h)
+        colour = bytes((rnd.randrange(256), rnd.randrange(256), rnd.randrange(256), 255))
+        packed = b"".join(PIXEL.pack(y * w + x + k, *colour) for k in range(12))
+        _apply(canvas, packed)
+        step_events.append({"ts": t + second, "pixels": packed})
+        if second % 10 == 8:
+            tl.record(bytes(canvas), w, h, step_events, ts=t + second)
+            step_events = []
+    st = tl.stats()
+    raw = w * h * 4
+    print(f"[TIMELINE] 1 h, 1800 strokes: {st['bytes'] // 1024} KB in {st['segments']} segments "
+          f"({st['keyframes']} keyframes, {st['deltas']} deltas)")
+    print(f"[TIMELINE] raw snapshots: every 10 s {360 * raw // 1024} KB, every minute {60 * raw // 1024} KB, "
+          f"every 10 min {6 * raw // 1024} KB")
+    t0 = time.perf_counter()
+    got = tl.at(t + 1799.5)
+    print(f"[TIMELINE] canvas at an arbitrary moment: {(time.perf_counter() - t0) * 1000:.1f} ms")
+    t0 = time.perf_counter()
+    frames = tl.frames([t + s for s in range(0, 3600, 30)])
+    print(f"[TIMELINE] 120-frame time-lapse: {(time.perf_counter() - t0) * 1000:.1f} ms")
+    assert tl.at(t + 3600)[0] == bytes(canvas)
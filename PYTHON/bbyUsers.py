@@ -0,0 +1,209 @@
+"""Write-behind persistence for users.json.
+
+`users.json` stays the canonical, human-editable snapshot (external scripts
+add alias records to it).  Changes made by the server are not written there
+directly: callers `mark_dirty(uid)`, and a flusher thread appends just the
+dirty records to `users.log` (one JSON line per record) after a short debounce.
+Once the log grows past a limit it is compacted back into users.json.
+
+Loading reads the snapshot, then replays the log on top; records still sitting
+in the dirty set are reapplied after any reload so nothing in memory is lost.
+`reload_if_changed()` only does that when users.json changed (mtime/inode/
+size) or users.log holds bytes this process hasn't replayed, so the request
+path pays for a stat, not a parse.
+
+Several workers share the files: loads, flushes and compactions hold an flock
+on users.lock, and a flush or compaction first reloads whatever another worker
+wrote, so appending (or rewriting the snapshot and truncating the log) never
+buries a record this process hasn't seen.
+
+Read-modify-write of a record should hold `store.lock`, which reloads take
+too; reloads update the live dict in place, so lock-free readers never see it
+empty.
+"""
+import atexit, json, os, threading, time
+from contextlib import contextmanager
+try:
+    import fcntl
+except ImportError:   # no flock (Windows): single-process only
+    fcntl = None
+
+
+class UserStore:
+    def __init__(self, path, flush_delay=2.0, compact_lines=2000, compact_seconds=600, on_compact=None):
+        self.path = path
+        self.log_path = os.path.splitext(path)[0] + ".log"
+        self.flush_delay = flush_delay
+        self.compact_lines = compact_lines
+        self.compact_seconds = compact_seconds
+        self.on_compact = on_compact    # called with the snapshot path after each compaction
+        self.users = {}                 # the live dict; mutate records in place, then mark_dirty()
+        self.lock = threading.RLock()
+        self._lock_fd = os.open(os.path.splitext(path)[0] + ".lock", os.O_RDWR | os.O_CREAT, 0o644)
+        self._disk_depth = 0
+        self._dirty = set()
+        self._wake = threading.Event()
+        self._log_lines = 0
+        self._compacted_ts = time.time()
+        self._seen_snapshot = None      # (mtime_ns, inode, size) of users.json as last read/written
+        self._seen_log = None           # (inode, bytes replayed or appended by us) of users.log
+        self._thread = None
+        self.load()
+
+    @contextmanager
+    def _disk(self):
+        """self.lock plus the cross-process flock; re-entrant within a thread."""
+        with self.lock:
+            if self._disk_depth == 0 and fcntl:
+                fcntl.flock(self._lock_fd, fcntl.LOCK_EX)
+            self._disk_depth += 1
+            try:
+                yield
+            finally:
+                self._disk_depth -= 1
+                if self._disk_depth == 0 and fcntl:
+                    fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+
+    # ---- loading ----
+    def _read_snapshot(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self._seen_snapshot = self._signature(self.path)
+                data = json.load(f)
+            return data if isinstance(data, dict) else {}
+        except FileNotFoundError:
+            self._seen_snapshot = None
+            return {}
+        except Exception as e:
+            print("[USERS][WARN] could not read users snapshot:", e)
+            return {}
+
+    def _replay_log(self, data):
+        n = 0
+        try:
+            with open(self.log_path, "rb") as f:
+                ino = os.fstat(f.fileno()).st_ino
+                for line in f:
+                    try:
+                        ent = json.loads(line)
+                    except ValueError:
+                        continue    # torn last line
+                    uid, rec = ent.get("uid"), ent.get("rec")
+                    if rec is None:
+                        data.pop(uid, None)
+                    else:
+                        data[uid] = rec
+                    n += 1
+                self._seen_log = (ino, f.tell())
+        except FileNotFoundError:
+            self._seen_log = None
+        return n
+
+    @staticmethod
+    def _signature(path):
+        try:
+            st = os.stat(path)
+            return (st.st_mtime_ns, st.st_ino, st.st_size)
+        except FileNotFoundError:
+            return None
+
+    def load(self):
+        """(Re)build the live dict from snapshot + log, keeping unflushed changes."""
+        with self._disk():
+            data = self._read_snapshot()
+            self._log_lines = self._replay_log(data)
+            for uid in self._dirty:
+                if uid in self.users:
+                    data[uid] = self.users[uid]
+            for uid in [u for u in self.users if u not in data]:
+                self.users.pop(uid, None)
+            self.users.update(data)
+
+    def snapshot_changed(self):
+        """True if users.json was modified by someone else since we last read or wrote it."""
+        return self._signature(self.path) != self._seen_snapshot
+
+    def log_changed(self):
+        """True if users.log holds bytes we haven't replayed (or was truncated/replaced)."""
+        try:
+            st = os.stat(self.log_path)
+            return (st.st_ino, st.st_size) != self._seen_log
+        except FileNotFoundError:
+            return self._seen_log is not None
+
+    def changed_on_disk(self):
+        return self.snapshot_changed() or self.log_changed()
+
+    def reload_if_changed(self):
+        """Reload only if users.json or users.log changed under us (external
+        script, another worker).  Returns True if it reloaded."""
+        if not self.changed_on_disk():
+            return False
+        with self._disk():
+            if not self.changed_on_disk():
+                return False
+            self.load()
+            return True
+
+    # ---- writing ----
+    def mark_dirty(self, *uids):
+        with self.lock:
+            self._dirty.update(u for u in uids if u)
+        self._wake.set()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._flush_loop, daemon=True)
+        self._thread.start()
+        atexit.register(self.flush)
+
+    def _flush_loop(self):
+        while True:
+            self._wake.wait(self.compact_seconds)
+            time.sleep(self.flush_delay)    # debounce: let a burst of updates share one write
+            self._wake.clear()
+            try:
+                self.flush()
+                if self._log_lines >= self.compact_lines or (
+                        self._log_lines and time.time() - self._compacted_ts >= self.compact_seconds):
+                    self.compact()
+            except Exception as e:
+                print("[USERS][ERROR] flush failed:", e)
+
+    def flush(self):
+        """Append every dirty record to the log (after catching up with it)."""
+        with self._disk():
+            if not self._dirty:
+                return
+            if self.changed_on_disk():
+                self.load()     # another worker's records first; ours are reapplied on top
+            dirty, self._dirty = self._dirty, set()
+            lines = "".join(json.dumps({"uid": uid, "rec": self.users.get(uid)}, ensure_ascii=False) + "\n"
+                            for uid in dirty)
+            try:
+                with open(self.log_path, "ab") as f:
+                    f.write(lines.encode("utf-8"))
+                    f.flush()
+                    os.fsync(f.fileno())
+                    self._seen_log = (os.fstat(f.fileno()).st_ino, f.tell())
+                self._log_lines += len(dirty)
+            except Exception:
+                self._dirty |= dirty
+                raise
+
+    def compact(self):
+        """Fold the log into users.json and truncate it."""
+        with self._disk():
+            self.flush()
+            if self.changed_on_disk():
+                self.load()     # external edits and other workers' records before overwriting them
+            tmp = self.path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(self.users, f, indent=2)
+            os.replace(tmp, self.path)
+            self._seen_snapshot = self._signature(self.path)
+            with open(self.log_path, "wb") as f:
+                self._seen_log = (os.fstat(f.fileno()).st_ino, 0)
+            self._log_lines = 0
+            self._compacted_ts = time.time()
+        if self.on_compact:
+            self.on_compact(self.path)
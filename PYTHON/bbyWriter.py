@@ -0,0 +1,143 @@
+"""Single writer thread that applies paint requests in batches.
+
+Request threads `submit()` their already-parsed pixels and wait; the writer
+collects whatever arrives within `window_ms` of the first item and hands the
+whole batch to `apply(items)`, which takes paint_lock once, writes every pixel,
+queues one journal commit and publishes one event.  Under load that turns N
+lock round trips (each an flock too) into one, and the requests stop queueing
+behind each other on the lock.  With `window_ms=0` nothing is batched and
+`submit()` applies inline, the old way.
+
+    python bbyWriter.py --url http://127.0.0.1:8420 --painters 200
+
+load-tests a running server (point it at a scratch copy: it really paints)
+and prints the paint latency percentiles.
+"""
+import threading, time
+
+
+class _Ticket:
+    __slots__ = ("item", "result", "error", "done", "taken")
+
+    def __init__(self, item):
+        self.item = item
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+        self.taken = False              # in a batch being applied; too late to withdraw
+
+
+class BatchWriter:
+    def __init__(self, apply, window_ms=3, max_batch=256):
+        self.apply = apply              # list of items -> list of results, same order
+        self.window_ms = window_ms
+        self.max_batch = max_batch
+        self._cv = threading.Condition()
+        self._queue = []
+        self.batches = 0
+        self.items = 0
+        self._thread = None
+
+    def start(self):
+        if self.window_ms and self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name="bby-paint-writer", daemon=True)
+            self._thread.start()
+
+    def submit(self, item, timeout=10.0):
+        """Apply `item` in the next batch and return its result (raises what apply raised).
+        Raises TimeoutError if the writer hasn't picked it up within `timeout`;
+        the item is then withdrawn and never applied."""
+        if not self.window_ms:
+            return self.apply([item])[0]
+        t = _Ticket(item)
+        with self._cv:
+            self._queue.append(t)
+            self._cv.notify()
+        if not t.done.wait(timeout):
+            with self._cv:
+                if not t.taken:
+                    self._queue.remove(t)
+                    raise TimeoutError("paint writer did not answer")
+            t.done.wait()               # already being applied: report how it went
+        if t.error is not None:
+            raise t.error
+        return t.result
+
+    def _loop(self):
+        while True:
+            with self._cv:
+                while not self._queue:
+                    self._cv.wait()
+            time.sleep(self.window_ms / 1000.0)    # let concurrent requests join this batch
+            with self._cv:
+                batch, self._queue = self._queue[:self.max_batch], self._queue[self.max_batch:]
+                for t in batch:
+                    t.taken = True
+            try:
+                results = self.apply([t.item for t in batch])
+                for t, r in zip(batch, results):
+                    t.result = r
+            except Exception as e:
+                print("[WRITER][ERROR] paint batch failed:", e)
+                for t in batch:
+                    t.error = e
+            self.batches += 1
+            self.items += len(batch)
+            for t in batch:
+                t.done.set()
+
+
+def _load_test(url, painters=200, strokes=20, pixels=8, width=64, height=64):
+    """`painters` threads, each posting `strokes` strokes of `pixels` pixels
+    back to back; returns sorted latencies in ms."""
+    import random, requests
+    latencies, errors = [], []
+    lock = threading.Lock()
+    start = threading.Barrier(painters)
+
+    def painter(n):
+        rnd = random.Random(n)
+        s = requests.Session()
+        start.wait()
+        for _ in range(strokes):
+            x, y = rnd.randrange(width), rnd.randrange(height)
+            body = {"pixels": [{"x": (x + k) % width, "y": y, "r": n % 256, "g": k * 30, "b": 200, "a": 255}
+                               for k in range(pixels)]}
+            t0 = time.perf_counter()
+            try:
+                r = s.post(url + "/api/paint_pixel", json=body, timeout=30)
+                ok = r.status_code == 200
+            except requests.exceptions.RequestException:
+                ok = False
+            ms = (time.perf_counter() - t0) * 1000
+            with lock:
+                (latencies if ok else errors).append(ms)
+
+    threads = [threading.Thread(target=painter, args=(n,)) for n in range(painters)]
+    t0 = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - t0
+    latencies.sort()
+    return latencies, len(errors), wall
+
+
+def _pct(sorted_ms, p):
+    return sorted_ms[min(len(sorted_ms) - 1, int(len(sorted_ms) * p / 100))] if sorted_ms else float("nan")
+
+
+if __name__ == "__main__":
+    import argparse
+    ap = argparse.ArgumentParser(description="paint_pixel load test")
+    ap.add_argument("--url", default="http://127.0.0.1:8420")
+    ap.add_argument("--painters", type=int, default=200)
+    ap.add_argument("--strokes", type=int, default=20)
+    ap.add_argument("--pixels", type=int, default=8)
+    args = ap.parse_args()
+    lat, errors, wall = _load_test(args.url.rstrip("/"), args.painters, args.strokes, args.pixels)
+    print(f"[WRITER] {args.painters} painters x {args.strokes} strokes: {len(lat)} ok, {errors} failed, "
+          f"{len(lat) / wall:.0f} req/s")
+    print(f"[WRITER] latency ms  p50 {_pct(lat, 50):.1f}  p90 {_pct(lat, 90):.1f}  "
+          f"p99 {_pct(lat, 99):.1f}  max {lat[-1] if lat else float('nan'):.1f}")
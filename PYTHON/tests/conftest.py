@@ -0,0 +1,31 @@
+"""Shared fixtures.  The server keeps its storage next to its own file, so
+`server` imports a copy of the modules from a scratch directory."""
+import os, shutil, sys
+
+import pytest
+
+PYTHON_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PYTHON_DIR)
+
+
+@pytest.fixture(scope="session")
+def server(tmp_path_factory):
+    root = tmp_path_factory.mktemp("bby")
+    for name in os.listdir(PYTHON_DIR):
+        if name.endswith(".py"):
+            shutil.copy(os.path.join(PYTHON_DIR, name), root)
+    sys.path.insert(0, str(root))
+    for mod in [m for m in sys.modules if m.startswith("bby")]:
+        del sys.modules[mod]            # the copies, not the ones imported from PYTHON_DIR
+    cwd = os.getcwd()
+    os.chdir(root)
+    try:
+        import bbyServer
+    finally:
+        os.chdir(cwd)
+    return bbyServer
+
+
+@pytest.fixture
+def client(server):
+    return server.app.test_client()
@@ -0,0 +1,41 @@
+"""BlobStore reference counting through hard links."""
+import os
+
+import bbyBlobs
+from bbyBlobs import BlobStore, digest
+
+
+def test_overwrite_frees_the_old_blob_without_rehashing(tmp_path, monkeypatch):
+    store = BlobStore(str(tmp_path / "blobs"))
+    name, other = str(tmp_path / "a.raw"), str(tmp_path / "b.raw")
+    old = store.write(name, b"old")
+    store.write(other, b"old")
+    hashed = []
+    monkeypatch.setattr(bbyBlobs, "digest", lambda data: hashed.append(data) or digest(data))
+
+    new = store.write(name, b"new")
+    assert hashed == [b"new"]                   # only the payload being written
+    assert store.refs(old) == 1 and store.refs(new) == 1
+    store.write(other, b"new")
+    assert not os.path.exists(store.path(old)) and store.refs(new) == 2
+
+
+def test_another_process_frees_blobs_it_did_not_store(tmp_path):
+    root = str(tmp_path / "blobs")
+    name = str(tmp_path / "a.raw")
+    old = BlobStore(root).write(name, b"old")
+    fresh = BlobStore(root)                     # knows no inodes yet
+    fresh.write(name, b"new")
+    assert not os.path.exists(fresh.path(old))
+    assert fresh.unlink(name) and fresh.stats()["blobs"] == 0
+    assert not fresh.unlink(name)
+
+
+def test_plain_files_are_replaced_and_removed(tmp_path):
+    store = BlobStore(str(tmp_path / "blobs"))
+    name = str(tmp_path / "legacy.raw")
+    with open(name, "wb") as f:
+        f.write(b"legacy")
+    store.write(name, b"new")
+    assert store.stats() == {"blobs": 1, "bytes": 3, "names": 1, "logical_bytes": 3}
+    assert store.unlink(name) and store.stats()["blobs"] == 0
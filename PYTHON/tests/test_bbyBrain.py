@@ -0,0 +1,40 @@
+"""BrainClient's breaker when a call fails for reasons other than the brain."""
+import pytest
+import requests
+
+from bbyBrain import BrainClient, BrainUnavailable
+
+
+class Response:
+    status_code = 200
+
+
+def test_local_error_frees_the_half_open_trial(monkeypatch):
+    brain = BrainClient("http://brain", breaker_failures=1, breaker_reset=0.0)
+    outcomes = [requests.exceptions.ConnectionError("down"), TypeError("not JSON serializable"), Response()]
+
+    def fake(*args, **kw):
+        out = outcomes.pop(0)
+        if isinstance(out, Exception):
+            raise out
+        return out
+    monkeypatch.setattr(brain.session, "request", fake)
+
+    with pytest.raises(requests.exceptions.ConnectionError):
+        brain.get("/api/state")                       # trips the breaker
+    with pytest.raises(TypeError):
+        brain.post("/api/state", json=object())       # the half-open trial, failing locally
+    assert brain.get("/api/state").status_code == 200     # next call still admitted as the trial
+    assert brain.metrics()["breaker"] == "closed"
+
+
+def test_open_breaker_rejects(monkeypatch):
+    brain = BrainClient("http://brain", breaker_failures=1, breaker_reset=60.0)
+
+    def fake(*args, **kw):
+        raise requests.exceptions.ConnectionError("down")
+    monkeypatch.setattr(brain.session, "request", fake)
+    with pytest.raises(requests.exceptions.ConnectionError):
+        brain.get("/api/state")
+    with pytest.raises(BrainUnavailable):
+        brain.get("/api/state")
@@ -0,0 +1,34 @@
+"""SWRCache on a cold cache: bounded waits, and failures held for error_ttl."""
+import threading, time
+
+from bbyCache import SWRCache
+
+
+def test_cold_fetch_honours_timeout():
+    release = threading.Event()
+
+    def fetch():
+        release.wait(5)
+        return "v"
+    cache = SWRCache(fetch, ttl=60, error_ttl=60)
+    t0 = time.time()
+    assert cache.get(timeout=0.1) == (None, "miss")
+    assert time.time() - t0 < 1
+    release.set()
+    assert cache.get(timeout=5) == ("v", "miss")    # joined the fetch already in flight
+    assert cache.get() == ("v", "fresh")
+
+
+def test_cold_failure_is_cached_until_error_ttl():
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        raise OSError("brain down")
+    cache = SWRCache(fetch, ttl=60, error_ttl=0.3)
+    for _ in range(5):
+        assert cache.get(timeout=1) == (None, "miss")
+    assert len(calls) == 1 and isinstance(cache.last_error, OSError)
+    time.sleep(0.35)
+    assert cache.get(timeout=1) == (None, "miss")
+    assert len(calls) == 2
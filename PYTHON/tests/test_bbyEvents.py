@@ -0,0 +1,46 @@
+"""PaintEventLog cursors: shared between workers, foreign across canvases."""
+from bbyEvents import PIXEL, PaintEventLog
+
+
+def _px(*pairs):
+    return b"".join(PIXEL.pack(idx, v, v, v, 255) for idx, v in pairs)
+
+
+def _final(events):
+    return sorted(PIXEL.iter_unpack(PaintEventLog.coalesce(events)))
+
+
+def test_two_logs_serve_the_same_cursor():
+    # two workers over one canvas (instance "ab12", write_seq 10 at startup)
+    a = PaintEventLog(maxlen=16, epoch="ab12", base=10)
+    b = PaintEventLog(maxlen=16, epoch="ab12", base=10)
+    a.append(_px((1, 10)), seq=11)              # a's own stroke
+    b.append(_px((1, 10)), seq=11)              # ...relayed to b
+    b.append(_px((2, 20)), seq=12)              # b's strokes
+    b.append(_px((3, 30)), seq=13)
+    a.append(_px((2, 20), (3, 30)), seq=13)     # ...relayed to a as one event
+    assert a.head_id() == b.head_id() == "ab12-13"
+
+    cursor = b.since("ab12-10")[0]["id"]         # handed out by b
+    assert cursor == "ab12-11"
+    assert _final(a.since(cursor)) == _final(b.since(cursor)) == sorted(PIXEL.iter_unpack(_px((2, 20), (3, 30))))
+    # a cursor inside a's relayed event gets that event again, never a resync
+    assert [ev["seq"] for ev in a.since("ab12-12")] == [13]
+    assert [ev["seq"] for ev in b.since("ab12-12")] == [13]
+    assert a.since("ab12-13") == b.since("ab12-13") == []
+
+
+def test_unservable_cursors():
+    log = PaintEventLog(maxlen=2, epoch="ab12", base=5)
+    assert log.since("ab12-5") == []
+    assert log.since("ab12-4") is None          # from before this log started
+    assert log.since("ab12-6") is None          # from the future
+    assert log.since("cd34-5") is None          # another canvas
+    assert log.since("garbage") is None
+    for seq in (6, 7, 8):
+        log.append(_px((seq, seq)), seq=seq)
+    assert log.since("ab12-5") is None          # evicted
+    assert [ev["seq"] for ev in log.since("ab12-6")] == [7, 8]
+    log.advance(9)                              # canvas moved, no pixel changed
+    assert log.head_id() == "ab12-9" and log.since("ab12-9") == []
+    assert [ev["seq"] for ev in log.since("ab12-8")] == []
@@ -0,0 +1,139 @@
+"""RecordIndex side maps, the gallery import route and the 5000-entry trim."""
+from bbyIndex import RecordIndex
+from bbyMetaStore import MetaStore
+
+
+class Sink:
+    """Records what a RecordIndex tells its sink, like bbyMetaStore.MetaTable."""
+    def __init__(self):
+        self.rows = {}
+
+    def put(self, rec):
+        self.rows[rec["id"]] = dict(rec)
+
+    def remove(self, rid):
+        del self.rows[rid]
+
+    def replace(self, records):
+        self.rows = {r["id"]: dict(r) for r in records}
+
+
+def _gallery(records=(), sink=None):
+    return RecordIndex(records, unique=("file",), flags=("has_png",), sink=sink)
+
+
+def test_lookups_after_add_update_delete():
+    sink = Sink()
+    idx = _gallery(sink=sink)
+    idx.put({"id": "a", "file": "a.png"})
+    idx.put({"id": "b", "file": "b.png", "has_png": True})
+    assert idx.get("a")["file"] == "a.png"
+    assert idx.by("file", "b.png")["id"] == "b"
+    assert idx.find("a.png")["id"] == "a" and idx.find("b")["id"] == "b"
+    assert idx.latest("has_png")["id"] == "b"
+
+    idx.update("a", file="a2.png", has_png=True)
+    assert idx.by("file", "a.png") is None
+    assert idx.by("file", "a2.png")["id"] == "a"
+    assert idx.latest("has_png")["id"] == "b"          # flag order follows record order, not update order
+    assert sink.rows["a"]["file"] == "a2.png"
+
+    idx.put({"id": "c", "file": "b.png"})               # takes the file over from b
+    assert "b" not in idx and "b" not in sink.rows
+    assert idx.by("file", "b.png")["id"] == "c"
+    assert idx.latest("has_png")["id"] == "a"
+
+    idx.remove("a")
+    assert idx.get("a") is None and idx.find("a2.png") is None and idx.latest("has_png") is None
+    assert set(sink.rows) == {"c"}
+    assert [r["id"] for r in idx] == ["c"]
+    idx.check()
+
+
+def test_trim_drops_oldest_from_maps_and_sink():
+    sink = Sink()
+    idx = _gallery(sink=sink)
+    for i in range(10):
+        idx.put({"id": f"g{i}", "file": f"g{i}.png", "has_png": i % 2 == 0})
+    assert idx.trim(4) == 6
+    assert [r["id"] for r in idx] == ["g6", "g7", "g8", "g9"]
+    for i in range(6):
+        assert idx.get(f"g{i}") is None and idx.by("file", f"g{i}.png") is None
+    assert set(sink.rows) == {"g6", "g7", "g8", "g9"}
+    idx.check()
+
+
+def test_metatable_sink_follows_the_index(tmp_path):
+    table = MetaStore(str(tmp_path / "meta.sqlite3")).table("gallery")
+    idx = _gallery(table.load(), sink=table)
+    for i in range(5):
+        idx.put({"id": f"g{i}", "file": f"g{i}.png", "ts": i})
+    idx.update("g3", title="three")
+    idx.remove("g1")
+    idx.trim(3)
+    assert [r["id"] for r in table.load()] == ["g2", "g3", "g4"]
+    assert table.load()[1]["title"] == "three"
+
+
+def test_two_processes_see_each_others_writes(tmp_path):
+    path = str(tmp_path / "meta.sqlite3")
+    ta, tb = MetaStore(path).table("gallery"), MetaStore(path).table("gallery")
+    a, b = _gallery(ta.load(), sink=ta), _gallery(tb.load(), sink=tb)
+    a.put({"id": "a", "file": "a.png"})
+    b.put({"id": "b", "file": "b.png"})
+    assert [r["id"] for r in a] == ["a", "b"] and [r["id"] for r in b] == ["a", "b"]
+    assert b.by("file", "a.png")["id"] == "a"
+    a.trim(1)
+    assert b.get("a") is None and [r["id"] for r in b] == ["b"]
+
+
+def _items(*names, **extra):
+    return [dict({"id": n, "file": f"{n}.png", "ts": 1000 + i}, **extra) for i, n in enumerate(names)]
+
+
+def _rows(server):
+    return [r["id"] for r in server.meta_store.table("gallery").load()]
+
+
+def test_import_replace(server, client):
+    server.gallery_index.replace(_items("old1", "old2"))
+    r = client.post("/api/gallery/import_index", json={"mode": "replace", "index": _items("n1", "n2", "n3")})
+    assert r.get_json()["imported"] == 3
+    idx = server.gallery_index
+    assert [m["id"] for m in idx] == ["n1", "n2", "n3"]
+    assert idx.get("old1") is None and idx.by("file", "old1.png") is None
+    assert idx.by("file", "n2.png")["id"] == "n2"
+    assert _rows(server) == ["n1", "n2", "n3"]
+    idx.check()
+
+
+def test_import_merge(server, client):
+    server.gallery_index.replace(_items("a", "b"))
+    body = {"mode": "merge", "index": [
+        {"id": "renamed", "file": "a.png", "ts": 5, "title": "by file"},    # matched on file: takes a's place
+        {"id": "b", "file": "b.png", "ts": 6, "title": "by id"},
+        {"id": "c", "file": "c.png", "ts": 7},
+    ]}
+    got = client.post("/api/gallery/import_index", json=body).get_json()
+    assert (got["imported"], got["updated"]) == (1, 2)
+    idx = server.gallery_index
+    assert [m["id"] for m in idx] == ["renamed", "b", "c"]
+    assert idx.get("a") is None
+    assert idx.by("file", "a.png")["id"] == "renamed" and idx.find("a.png")["title"] == "by file"
+    assert idx.get("b")["title"] == "by id"
+    assert _rows(server) == ["renamed", "b", "c"]
+    idx.check()
+
+
+def test_import_trims_to_5000(server, client):
+    server.gallery_index.replace([])
+    names = [f"g{i}" for i in range(5003)]
+    got = client.post("/api/gallery/import_index", json={"mode": "replace", "index": _items(*names)}).get_json()
+    assert got["total"] == 5000
+    idx = server.gallery_index
+    for gone in names[:3]:
+        assert idx.get(gone) is None and idx.by("file", f"{gone}.png") is None
+    assert idx.by("file", "g3.png")["id"] == "g3"
+    rows = _rows(server)
+    assert len(rows) == 5000 and rows[0] == "g3" and "g0" not in rows
+    idx.check()
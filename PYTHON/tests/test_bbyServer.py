@@ -0,0 +1,22 @@
+"""Drawing ops as /api/paint_pixel parses them."""
+import pytest
+
+
+def _pixels(server, ops):
+    return [px for chunk in server._parse_ops(ops) for px in server._chunk_pixels(chunk)]
+
+
+def test_spans_with_a_colour_per_run(server):
+    w = server.PAINT_W
+    got = _pixels(server, [{"op": "spans", "runs": [0, 0, 2, 5, 1, 1], "colours": [1, 2, 3, 255, 9, 9, 9, 128]}])
+    assert got == [(0, 1, 2, 3, 255), (1, 1, 2, 3, 255), (w + 5, 9, 9, 9, 128)]
+    # same pixels as one single-colour op per run
+    plain = [{"op": "spans", "runs": [0, 0, 2], "r": 1, "g": 2, "b": 3, "a": 255},
+             {"op": "spans", "runs": [5, 1, 1], "r": 9, "g": 9, "b": 9, "a": 128}]
+    assert _pixels(server, plain) == got
+
+
+@pytest.mark.parametrize("colours", [[1, 2, 3], [1, 2, 3, 255, 4, 5, 6, 255], [1, 2, 3, 256]])
+def test_spans_colours_must_match_runs(server, colours):
+    with pytest.raises(ValueError):
+        server._parse_ops([{"op": "spans", "runs": [0, 0, 2], "colours": colours}])
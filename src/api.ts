@@ -18,7 +18,7 @@ async function request(endpoint: string, options: RequestInit = {}) {
   };
 
   try {
-    const response = await fetch(url, { ...options, headers, cache: 'no-store' });
+    const response = await fetch(url, { ...options, headers, cache: options.cache ?? 'no-store' });
 
     if (!response.ok) {
       const errorBody = await response.json().catch(() => ({ error: 'Request failed with no JSON body' }));
@@ -48,12 +48,14 @@ export interface PostSayBody {
   display_name?: string;
   is_command?: boolean;
   speak?: boolean;        // <— NEW
+  async?: boolean;        // reply arrives via chat history / the stream's `say` event instead
 }
 
 export const api = {
   getState: () => request('/state'),
   getChatHistory: () => request('/chat_history'),
-  getPaintCanvas: () => request('/get_paint_canvas'),
+  // revalidates with the server's ETag, so an unchanged canvas comes back as a 304
+  getPaintCanvas: () => request('/get_paint_canvas', { cache: 'no-cache' }),
   getBbyBook: () => request('/bbybook'),
   getGallery: () => request('/gallery'),
   getActivity: () => request('/activity'),
@@ -61,7 +63,7 @@ export const api = {
   request('/speak', { method: 'POST', body: JSON.stringify(body) }),
 
   postSay: (body: PostSayBody) => request('/say', { method: 'POST', body: JSON.stringify(body) }),
-  postPixelUpdate: (body: { pixels: object[] }) => request('/paint_pixel', { method: 'POST', body: JSON.stringify(body) }),
+  postPixelUpdate: (body: { pixels?: object[]; ops?: object[] }) => request('/paint_pixel', { method: 'POST', body: JSON.stringify(body) }),
   postStateChange: (body: object) => request('/state', { method: 'POST', body: JSON.stringify(body) }),
   postSnapshot: (body: { label: string; composite_png_b64: string }) => request('/snapshot', { method: 'POST', body: JSON.stringify(body) }),
   postAttachPng: (snap_id: string, body: { composite_png_b64: string }) => request(`/snapshot_attach_png/${snap_id}`, { method: 'POST', body: JSON.stringify(body) }),
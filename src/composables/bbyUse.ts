@@ -86,7 +86,7 @@ async function fetchInitialPaintCanvas() {
       const bytes = new Uint8Array(len);
       for (let i = 0; i < len; i++) bytes[i] = str.charCodeAt(i);
       const clampedBytes = new Uint8ClampedArray(bytes.buffer);
-      paintOverlayData.value = new ImageData(clampedBytes, 64, 64);
+      paintOverlayData.value = new ImageData(clampedBytes, data.w || 64, data.h || 64);
       bumpPaintVersion();
       console.log("Initial paint canvas loaded.");
     }
@@ -99,6 +99,58 @@ async function sendPixelUpdate(pixels: {x:number, y:number, r:number, g:number,
   } catch (error) { console.error("Failed to send pixel update:", error); }
 }
 
+// Drawing ops the server expands itself (line / rect / spans / fill), see _parse_ops in bbyServer.py
+async function sendPaintOps(ops: object[]) {
+  try {
+    await api.postPixelUpdate({ ops });
+  } catch (error) { console.error("Failed to send paint ops:", error); }
+}
+
+type PaintEvent = {id: string, pixels: {x:number, y:number, r:number, g:number, b:number, a:number}[], resync?: boolean, paintOverlayData_b64?: string};
+
+// Takes a full state (polling) or just the changed fields (stream `state` events).
+function applyServerState(serverState: any) {
+  if ('eyes' in serverState && (typeof serverState.eyes !== 'number' || serverState.eyes < 3)) {
+    serverState.eyes = 5;
+  }
+  Object.assign(bbyState, serverState);
+
+  if (serverState.R !== undefined) targetColour.r = serverState.R;
+  if (serverState.G !== undefined) targetColour.g = serverState.G;
+  if (serverState.B !== undefined) targetColour.b = serverState.B;
+}
+
+function applyPaintEvents(events: PaintEvent[]) {
+  if (!paintOverlayData.value || events.length === 0) return;
+  const data = paintOverlayData.value.data;
+  for (const ev of events) {
+    // fell too far behind: the server sends the whole canvas instead of deltas
+    if (ev.resync && ev.paintOverlayData_b64) {
+      const str = atob(ev.paintOverlayData_b64);
+      for (let i = 0; i < str.length && i < data.length; i++) data[i] = str.charCodeAt(i);
+    }
+    for (const p of ev.pixels) {
+      const i = (p.y * paintOverlayData.value.width + p.x) * 4;
+      data[i] = p.r; data[i+1] = p.g; data[i+2] = p.b; data[i+3] = p.a;
+    }
+  }
+  bumpPaintVersion();
+  lastPaintEventId.value = events[events.length - 1].id;
+}
+
+// Push channel for paint deltas and state; the polling loops stand down while it is open.
+let streamLive = false;
+function startStream() {
+  if (typeof EventSource === 'undefined') return;
+  const es = new EventSource('https://childofanandroid.co.uk/api/stream');
+  es.onopen = () => { streamLive = true; };
+  es.onerror = () => { streamLive = false; }; // EventSource reconnects by itself; polling covers the gap
+  es.addEventListener('state', (e) => applyServerState(JSON.parse((e as MessageEvent).data)));
+  const onPaint = (e: Event) => applyPaintEvents([JSON.parse((e as MessageEvent).data)]);
+  es.addEventListener('paint', onPaint);
+  es.addEventListener('resync', onPaint);
+}
+
 function startClient() {
   if (isClientRunning) return;
   isClientRunning = true;
@@ -106,24 +158,17 @@ function startClient() {
   fetchBbyFacts();
   fetchInitialPaintCanvas();
 
+  startStream();
+
   setInterval(async () => {
+    if (streamLive) return;
     try {
-      const serverState = await api.getState();
-      if (typeof serverState.eyes !== 'number' || serverState.eyes < 3) {
-        serverState.eyes = 5;
-      }
-      Object.assign(bbyState, serverState);
-
-      if (serverState.R !== undefined) {
-        targetColour.r = serverState.R;
-        targetColour.g = serverState.G;
-        targetColour.b = serverState.B;
-      }
+      applyServerState(await api.getState());
     } catch { /* ignore poll errors */ }
   }, 500);
 
   setInterval(async () => {
-    if (!paintOverlayData.value) return;
+    if (!paintOverlayData.value || streamLive) return;
     try {
       // This endpoint is unique; keep direct fetch for URL searchParams.
       const url = new URL('https://childofanandroid.co.uk/api/paint_events');
@@ -131,18 +176,7 @@ function startClient() {
       const response = await fetch(url.toString());
       if (!response.ok) return;
 
-      const events: {id: string, pixels: {x:number, y:number, r:number, g:number, b:number, a:number}[]}[] = await response.json();
-      if (events.length > 0) {
-        const data = paintOverlayData.value.data;
-        for (const ev of events) {
-          for (const p of ev.pixels) {
-            const i = (p.y * 64 + p.x) * 4;
-            data[i] = p.r; data[i+1] = p.g; data[i+2] = p.b; data[i+3] = p.a;
-          }
-        }
-        bumpPaintVersion();
-        lastPaintEventId.value = events[events.length - 1].id;
-      }
+      applyPaintEvents(await response.json());
     } catch { /* ignore poll errors */ }
   }, 250);
 
@@ -226,6 +260,7 @@ async function say(text: string, author: string, colour: UserColour) {
       handle: author,
       display_name: author,
       speak: true,            // <— NEW
+      async: true,            // don't hold the request open while the brain thinks
     });
   } catch (error) { console.error("failed to talk to baby:", error); }
 }
@@ -443,7 +478,7 @@ export function bbyUse() {
   return {
     bbyState: readonly(bbyState), currentColour: readonly(currentColour), tintStrength: readonly(tintStrength),
     author: readonly(author), userColour: readonly(userColour), paintOverlayData, paintVersion, tickPaint,
-    sendPixelUpdate, setUsername, setUserColour, requestStateChange, setBbyTintColour, sendBbyPaintColour, say,
+    sendPixelUpdate, sendPaintOps, setUsername, setUserColour, requestStateChange, setBbyTintColour, sendBbyPaintColour, say,
     removeBubble, sayRandomFact, saveCompositeToServer, pollActivityForAutosnap, saveTestGridImage, fetchTestGridGallery,
     fetchBbyBookGallery, getRandomBbyFactPrompt, clearBubbles, bbyFacts: readonly(bbyFacts),
   };